@@ -2,8 +2,55 @@
 Created by Michael Wilson, Senior Software Engineer
 """
 
-from .config import MichaelConfig
-from .http import MichaelHTTP
-from .subs import michaelubs
-from .store import michaeltore
-from .viz import MichaelViz
+import importlib
+from typing import TYPE_CHECKING
+
+# Public names resolve on first access so `import michael_client` (and the CLI's
+# subscribe/event paths) never pay for pandas, plotly or pyarrow.
+_EXPORTS = {
+    "MichaelConfig": ".config",
+    "MichaelHTTP": ".http", "open_session": ".http",
+    "CircuitOpenError": ".throttle",
+    "ResponseCache": ".cache",
+    "michaelubs": ".subs",
+    "michaeltore": ".store", "IngestStats": ".store",
+    "MichaelViz": ".viz",
+    "TrackAnalytics": ".trackstats",
+    "MichaelPager": ".paging",
+    "SchemaCache": ".schema",
+    "BatchWriter": ".ingest",
+    "SeenIds": ".dedupe", "BloomSeen": ".dedupe",
+    "ColumnarStore": ".columnar", "export_store": ".columnar",
+    "REGISTRY": ".metrics", "MetricsRegistry": ".metrics",
+    "LiveAggregator": ".live", "Rule": ".live", "EventAlerter": ".live",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+if TYPE_CHECKING:
+    from .config import MichaelConfig
+    from .http import MichaelHTTP, open_session
+    from .throttle import CircuitOpenError
+    from .cache import ResponseCache
+    from .subs import michaelubs
+    from .store import michaeltore, IngestStats
+    from .viz import MichaelViz
+    from .trackstats import TrackAnalytics
+    from .paging import MichaelPager
+    from .schema import SchemaCache
+    from .ingest import BatchWriter
+    from .dedupe import SeenIds, BloomSeen
+    from .columnar import ColumnarStore, export_store
+    from .metrics import REGISTRY, MetricsRegistry
+    from .live import LiveAggregator, Rule, EventAlerter
@@ -0,0 +1,221 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import argparse, asyncio, json, logging, os, platform, statistics, subprocess, sys, tempfile, time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from .cli import fetch_everything
+from .config import MichaelConfig
+from .mock import Dataset
+from .store import michaeltore
+from .subs import michaelubs
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+LOG = logging.getLogger("michael")
+
+def _worse_sign(name: str) -> int:
+    """+1 if a larger value is worse, -1 if smaller is worse, 0 for plain counts.
+
+    import_heavy_modules is not a trend but a hard limit (it must stay 0), checked in main."""
+    if name.endswith("_per_s"):
+        return -1
+    return 1 if name.endswith(("_s", "_ms", "_mb")) else 0
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / (1 << 20) if sys.platform == "darwin" else kb / 1024  # bytes on macOS, KiB on Linux
+
+def percentiles(values: List[float], points=(50, 90, 99)) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    out = {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    out["max"] = ordered[-1]
+    return out
+
+@contextmanager
+def mock_server(args) -> Iterator[str]:
+    """Run `python -m michael_client.mock` in a child process so it never competes with the
+    measured client for the event loop, the GIL or RSS. Yields its URL."""
+    cmd = [sys.executable, "-m", "michael_client.mock", "--port", "0",
+           "--devices", str(args.devices), "--tracks", str(args.tracks), "--points", str(args.points),
+           "--detections", str(args.detections), "--hours", str(args.hours), "--seed", str(args.seed),
+           "--sub-rate", str(args.sub_rate), "--sub-count", str(args.sub_count),
+           "--latency-ms", str(args.latency_ms)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    try:
+        line = proc.stdout.readline()
+        if not line.startswith("listening "):
+            raise RuntimeError(f"Mock server failed to start (exit {proc.poll()})")
+        yield line.split(" ", 1)[1].strip()
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+def _cfg(url: str, workdir: str, args) -> MichaelConfig:
+    return MichaelConfig(api_url=url, ws_url=url.replace("http", "ws", 1), token_id="bench",
+                         token_value="bench", page_concurrency=args.concurrency,
+                         schema_cache_path=os.path.join(workdir, "schema.json"))
+
+async def bench_fetch(cfg, db_path: str, hours: float, stream: bool) -> Dict[str, float]:
+    store = michaeltore(db_path)
+    t0 = time.perf_counter()
+    await fetch_everything(cfg, store, hours=int(hours) + 1, stream=stream)
+    wall = time.perf_counter() - t0
+    with store._lock:
+        rows = {t: store.cx.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in ("devices", "tracks", "track_points", "detections")}
+    store.close()
+    total = sum(rows.values())
+    return {"fetch_wall_s": wall, "fetch_rows": total, "fetch_rows_per_s": total / wall if wall else 0.0}
+
+def bench_ingest(db_path: str, data: Dataset, chunk_size: int) -> Dict[str, float]:
+    detections = [json.loads(b) for b in data.detections]
+    tracks = [json.loads(b) for b in data.tracks]
+    store = michaeltore(db_path, chunk_size=chunk_size)
+    det = store.save_detections(detections)
+    trk = store.save_tracks(tracks)
+    store.close()
+    return {"ingest_detections_per_s": det.rows_per_s, "ingest_track_rows_per_s": trk.rows_per_s,
+            "ingest_detections_s": det.seconds, "ingest_tracks_s": trk.seconds}
+
+async def bench_subscribe(cfg, subscriptions: int) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    async def on_item(item: Dict[str, Any]):
+        latencies.append((time.time() - item["metadata"]["sentAt"]) * 1000)
+
+    subs = michaelubs(cfg)
+    for _ in range(subscriptions):
+        subs.add_detections(on_item, min_confidence=0.0)
+    t0 = time.perf_counter()
+    await subs.run()
+    wall = time.perf_counter() - t0
+    out = {f"sub_latency_{k}_ms": v for k, v in percentiles(latencies).items()}
+    out["sub_msgs_per_s"] = len(latencies) / wall if wall else 0.0
+    return out
+
+_IMPORT_PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import michael_client.cli
+t1 = time.perf_counter()
+heavy = [m for m in ("pandas", "numpy", "plotly", "pyarrow", "aiohttp", "websockets")
+         if m in sys.modules and type(sys.modules[m]).__name__ != "_LazyModule"]
+print(t1 - t0, len(heavy), ",".join(heavy))
+"""
+
+def bench_import() -> Dict[str, float]:
+    """Cold-start cost of the CLI in a fresh interpreter: process wall time and the import itself."""
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], check=True, capture_output=True, text=True).stdout
+    wall = time.perf_counter() - t0
+    import_s, n_heavy, heavy = (out.split() + [""])[:3]
+    if heavy:
+        LOG.warning("CLI import pulled in %s", heavy)
+    return {"import_cli_s": float(import_s), "import_process_s": wall, "import_heavy_modules": int(n_heavy)}
+
+def run_once(args, workdir: str) -> Dict[str, float]:
+    metrics: Dict[str, float] = {}
+    if "import" in args.phases:
+        metrics.update(bench_import())
+    if "ingest" in args.phases:
+        data = Dataset(args.devices, args.tracks, args.points, args.detections, args.hours, args.seed)
+        metrics.update(bench_ingest(os.path.join(workdir, "ingest.db"), data, args.chunk_size))
+        del data
+    if {"fetch", "subscribe"} & set(args.phases):
+        with mock_server(args) as url:
+            cfg = _cfg(url, workdir, args)
+            if "fetch" in args.phases:
+                metrics.update(asyncio.run(bench_fetch(cfg, os.path.join(workdir, "fetch.db"),
+                                                       args.hours, args.stream)))
+            if "subscribe" in args.phases:
+                metrics.update(asyncio.run(bench_subscribe(cfg, args.subscriptions)))
+    return metrics
+
+def compare(current: Dict[str, float], baseline: Dict[str, float]) -> Dict[str, float]:
+    """Percent change per metric, signed so that positive always means worse."""
+    out = {}
+    for name, value in current.items():
+        base = baseline.get(name)
+        if not base or value is None or not _worse_sign(name):
+            continue
+        out[name] = _worse_sign(name) * (value - base) / base * 100
+    return out
+
+def _parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="End-to-end benchmarks against the local mock server")
+    p.add_argument("--phases", nargs="+", choices=("import", "fetch", "ingest", "subscribe"),
+                   default=["import", "fetch", "ingest", "subscribe"])
+    p.add_argument("--repeat", type=int, default=3, help="Runs per phase; the median is reported")
+    p.add_argument("--devices", type=int, default=50)
+    p.add_argument("--tracks", type=int, default=1000)
+    p.add_argument("--points", type=int, default=50, help="Points per track")
+    p.add_argument("--detections", type=int, default=50_000)
+    p.add_argument("--hours", type=float, default=24.0)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="Simulated server latency per request")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--stream", action="store_true", help="Benchmark the streaming fetch path")
+    p.add_argument("--chunk-size", type=int, default=5000)
+    p.add_argument("--sub-rate", type=float, default=2000.0, help="Messages per second per subscription")
+    p.add_argument("--sub-count", type=int, default=10_000, help="Messages per subscription")
+    p.add_argument("--subscriptions", type=int, default=1)
+    p.add_argument("--out", default="", help="Write the JSON report here")
+    p.add_argument("--baseline", default="", help="Earlier JSON report to compare against")
+    p.add_argument("--max-regression", type=float, default=0.0,
+                   help="Exit non-zero if any metric is this many percent worse than --baseline")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_cli(argv)
+    logging.getLogger("michael").setLevel(logging.WARNING)
+    runs: List[Dict[str, float]] = []
+    with tempfile.TemporaryDirectory(prefix="michael-bench-") as workdir:
+        for _ in range(max(1, args.repeat)):
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            runs.append(run_once(args, workdir))
+    metrics = {k: statistics.median(r[k] for r in runs if k in r) for k in runs[0]}
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count()},
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "max_regression")},
+        "metrics": metrics,
+    }
+    width = max(len(k) for k in metrics)
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            base = json.load(fh)
+        if base.get("params") != report["params"]:
+            LOG.warning("Baseline was recorded with different parameters; deltas are not comparable")
+        regressions = compare(metrics, base.get("metrics") or {})
+    for name, value in metrics.items():
+        line = f"{name:<{width}}  {value:>12.2f}" if value is not None else f"{name:<{width}}  {'n/a':>12}"
+        if name in regressions:
+            line += f"  ({'worse' if regressions[name] > 0 else 'better'} {abs(regressions[name]):.1f}%)"
+        print(line)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    failed = bool(args.max_regression) and any(v > args.max_regression for v in regressions.values())
+    if metrics.get("import_heavy_modules"):
+        LOG.error("Importing the CLI loaded %d heavy module(s); they must stay lazy",
+                  metrics["import_heavy_modules"])
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
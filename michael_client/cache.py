@@ -0,0 +1,106 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import asyncio, hashlib, json, time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from .gql import operation
+
+Key = Tuple[str, str]
+
+class ResponseCache:
+    """Opt-in LRU/TTL cache for read-only GraphQL responses.
+
+    Entries are keyed on (query hash, canonical JSON of the variables). `ttl_s`
+    applies to every query unless `ttl_overrides` names its operation (e.g.
+    {"GetDevice": 300}); a TTL of 0 disables caching for that operation.
+    Concurrent misses for the same key share a single in-flight request.
+    Mutations, subscriptions and responses carrying `errors` are never cached.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 60.0,
+                 ttl_overrides: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.ttl_overrides = dict(ttl_overrides or {})
+        self._entries: "OrderedDict[Key, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Key, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(query: str, variables: Optional[Dict[str, Any]]) -> Key:
+        canon = json.dumps(variables or {}, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(query.encode()).hexdigest(), canon
+
+    def ttl_for(self, query: str) -> float:
+        kind, name = operation(query)
+        if kind != "query":
+            return 0.0
+        return self.ttl_overrides.get(name or "", self.ttl_s)
+
+    def get(self, key: Key) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Key, value: Dict[str, Any], ttl_s: float):
+        self._entries[key] = (time.monotonic() + ttl_s, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, query: Optional[str] = None):
+        if query is None:
+            self._entries.clear()
+            return
+        digest = hashlib.sha256(query.encode()).hexdigest()
+        for key in [k for k in self._entries if k[0] == digest]:
+            del self._entries[key]
+
+    async def fetch(self, query: str, variables: Optional[Dict[str, Any]],
+                    loader: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        ttl = self.ttl_for(query)
+        if ttl <= 0:
+            return await loader()
+        key = self.key(query, variables)
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            data = await loader()
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            if "errors" not in data:
+                self.put(key, data, ttl)
+            fut.set_result(data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "coalesced": self.coalesced, "evictions": self.evictions}
@@ -3,80 +3,202 @@ Created by Michael Wilson, Senior Software Engineer
 """
 
 from __future__ import annotations
-import argparse, asyncio, logging
-from datetime import datetime, timedelta
+import argparse, asyncio, json, logging
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
 from .config import MichaelConfig
-from .http import MichaelHTTP
-from .gql import INTROSPECTION, GET_DEVICES, GET_TRACKS, GET_DETECTIONS, CREATE_EVENT
-from .store import michaeltore
-from .subs import michaelubs
-from .viz import MichaelViz
+from .gql import GET_DEVICES, GET_TRACKS, GET_DETECTIONS, CREATE_EVENT
+from .store import RETAINED_TABLES, IngestStats, michaeltore, newest_marks
+from .ingest import BatchWriter
+from .dedupe import BloomSeen, SeenIds
+from .metrics import REGISTRY, TextfileExporter, profiled, summarize
+
+# aiohttp, websockets, plotly and pyarrow are imported by the commands that use them,
+# so `--help`, `stats` and `event` start without paying for the rest
+if TYPE_CHECKING:
+    from .http import MichaelHTTP
+    from .live import LiveAggregator, Rule
 
 LOG = logging.getLogger("michael")
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
-LOG.addHandler(handler)
+if not LOG.handlers:  # spawned workers may import this module twice (as __mp_main__ too)
+    LOG.addHandler(handler)
 LOG.setLevel(logging.INFO)
 
-async def fetch_everything(cfg: MichaelConfig, store: michaeltore, hours: int = 24):
-    start = datetime.datetime.now(datetime.timezone.utc) - timedelta(hours=hours)
-    end = datetime.datetime.now(datetime.timezone.utc)
-    async with MichaelHTTP(cfg) as http:
-        LOG.info("Introspecting schema…")
-        _ = await http.execute(INTROSPECTION)
-
-        LOG.info("Loading devices…")
-        devs = await http.execute(GET_DEVICES, {"limit": 100, "offset": 0})
-        devices = (devs.get("data") or {}).get("devices") or []
-        store.save_devices(devices)
-        LOG.info("Saved %d devices", len(devices))
-
-        LOG.info("Loading tracks (%dh)…", hours)
-        tr = await http.execute(GET_TRACKS, {
-            "startTime": start.isoformat(),
-            "endTime": end.isoformat(),
-            "limit": 100
-        })
-        tracks = (tr.get("data") or {}).get("tracks") or []
-        store.save_tracks(tracks)
-        LOG.info("Saved %d tracks (and points)", len(tracks))
-
-        LOG.info("Loading detections (%dh)…", hours)
-        dets = await http.execute(GET_DETECTIONS, {
-            "startTime": start.isoformat(),
-            "endTime": end.isoformat(),
-            "limit": 1000,
-            "minConfidence": 0.5
-        })
-        detections = (dets.get("data") or {}).get("detections") or []
-        store.save_detections(detections)
-        LOG.info("Saved %d detections", len(detections))
-
-async def create_sample_event(cfg: MichaelConfig):
+def _window_start(store: michaeltore, entity: str, default: datetime,
+                  incremental: bool, overlap: timedelta) -> datetime:
+    """Resume from the oldest per-device mark, so a device uploading buffered rows late is not
+    skipped; devices silent for longer than the default lookback fall back to the global mark."""
+    marks = store.sync_marks(entity) if incremental else {}
+    glob = marks.pop("", None)
+    if glob is None:
+        return default
+    behind = [ts for ts in marks.values() if default <= ts < glob]
+    return min(behind, default=glob) - overlap
+
+@asynccontextmanager
+async def _client(cfg: MichaelConfig, http: Optional[MichaelHTTP]) -> AsyncIterator[MichaelHTTP]:
+    """Use the caller's client (and its pooled session) if given, else a short-lived one."""
+    if http is not None:
+        yield http
+        return
+    from .http import MichaelHTTP
+    async with MichaelHTTP(cfg) as own:
+        yield own
+
+async def fetch_everything(cfg: MichaelConfig, store: michaeltore, hours: int = 24,
+                           incremental: bool = False, refresh_schema: bool = False,
+                           stream: bool = False, http: Optional[MichaelHTTP] = None):
+    from .paging import MichaelPager
+    from .schema import SchemaCache
+    end = datetime.now(timezone.utc)
+    default_start = end - timedelta(hours=hours)
+    overlap = timedelta(seconds=cfg.sync_overlap_s)
+    async with _client(cfg, http) as http:
+        schema = await SchemaCache(cfg).get(http, refresh=refresh_schema)
+        if schema is not None:
+            for name, doc in (("GET_DEVICES", GET_DEVICES), ("GET_TRACKS", GET_TRACKS),
+                              ("GET_DETECTIONS", GET_DETECTIONS)):
+                for problem in SchemaCache.validate(schema, doc):
+                    LOG.warning("%s: %s", name, problem)
+
+        pager = MichaelPager(http, concurrency=cfg.page_concurrency)
+
+        async def devices():
+            LOG.info("Loading devices…")
+            items = await pager.by_offset(GET_DEVICES, "devices", page_size=cfg.device_page_size)
+            st = await asyncio.to_thread(store.save_devices, items)
+            LOG.info("Saved %d devices (%.0f rows/s)", len(items), st.rows_per_s)
+
+        async def windowed(entity: str, query: str, variables: Dict[str, Any], page_size: int,
+                           save: Callable[[List[Dict[str, Any]]], IngestStats], *ts_keys: str):
+            start = _window_start(store, entity, default_start, incremental, overlap)
+            LOG.info("Loading %s since %s…", entity, start.isoformat())
+            if not stream:
+                items = await pager.by_window(query, entity, start, end, variables, page_size=page_size)
+                st = await asyncio.to_thread(save, items)  # the other entities keep reading pages
+                store.advance_sync_marks(entity, items, *ts_keys)
+                LOG.info("Saved %d %s (%d rows, %.0f rows/s)", len(items), entity, st.rows, st.rows_per_s)
+                return
+
+            # marks are only written once every window has landed, so a failed run leaves no gaps
+            marks: Dict[str, datetime] = {}
+            rows = 0
+
+            async def on_batch(batch: List[Dict[str, Any]]):
+                nonlocal rows
+                st = await asyncio.to_thread(save, batch)
+                rows += st.rows
+                newest_marks(batch, *ts_keys, into=marks)
+
+            n = await pager.stream_window(query, entity, start, end, on_batch, variables,
+                                          page_size=page_size, batch_size=cfg.stream_batch_size)
+            store.write_sync_marks(entity, marks)
+            LOG.info("Streamed %d %s (%d rows)", n, entity, rows)
+
+        tracks = windowed("tracks", GET_TRACKS, {}, cfg.track_page_size,
+                          store.save_tracks, "endTime", "startTime")
+        detections = windowed("detections", GET_DETECTIONS, {"minConfidence": 0.5},
+                              cfg.detection_page_size, store.save_detections, "timestamp")
+        await asyncio.gather(devices(), tracks, detections)
+
+async def create_sample_event(cfg: MichaelConfig, http: Optional[MichaelHTTP] = None):
     payload = {
         "name": "Sample Detection Event",
         "type": "ANOMALY_DETECTED",
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "deviceId": "sample-device-id",
         "location": {"latitude": 40.7128, "longitude": -74.0060, "altitude": 10.0},
         "metadata": {"source": "demo", "confidence": 0.85, "note": "Created from CLI"},
     }
-    async with MichaelHTTP(cfg) as http:
+    async with _client(cfg, http) as http:
         res = await http.execute(CREATE_EVENT, {"input": payload})
         evt = (res.get("data") or {}).get("createEvent")
         if not evt:
             raise SystemExit(f"Event creation failed: {res}")
         LOG.info("Created event id=%s type=%s", evt["id"], evt["type"])
 
-async def run_subscriptions(cfg: MichaelConfig, min_conf: float = 0.7):
+async def run_subscriptions(cfg: MichaelConfig, min_conf: float = 0.7,
+                            store: Optional[michaeltore] = None, batch_size: int = 500,
+                            flush_interval_s: float = 1.0, max_queue: int = 10000,
+                            drop_policy: str = "block", device_ids: Sequence[str] = (),
+                            detection_types: Sequence[str] = (), dedupe: str = "lru",
+                            dedupe_window_s: float = 3600.0, dedupe_fp_rate: float = 0.001,
+                            rules: Sequence["Rule"] = (), alert_events: bool = False,
+                            live_window_s: float = 60.0, live_report_s: float = 0.0):
+    from .subs import michaelubs
+    live = http = report = None
+    if rules or live_report_s:
+        from .live import EventAlerter, LiveAggregator
+        live = LiveAggregator(rules, window_s=live_window_s)
+    writer = None
+    if store is not None:
+        writer = BatchWriter(store.save_detections, batch_size=batch_size,
+                             flush_interval_s=flush_interval_s, max_queue=max_queue,
+                             policy=drop_policy).start()
+
     async def on_det(d):
+        if live is not None:
+            await live.on_item(d)  # alerts first: they should not wait behind logging or the store
         LOG.info("Detection %-16s conf=%.2f device=%s time=%s",
                  d.get("detectionType"), float(d.get("confidence") or 0),
                  d.get("deviceId"), d.get("timestamp"))
-    subs = michaelubs(cfg)
-    await subs.detections(on_det, min_confidence=min_conf)
+        if writer is not None:
+            await writer.put(d)
+
+    seen = None
+    if dedupe == "lru":
+        seen = SeenIds(ttl_s=dedupe_window_s)
+    elif dedupe == "bloom":
+        seen = BloomSeen(fp_rate=dedupe_fp_rate, ttl_s=dedupe_window_s)
+    if seen is not None and store is not None:
+        # ids already backfilled by `fetch` never need to reach the handler again
+        seen.seed(store.recent_detection_ids(datetime.now(timezone.utc) - timedelta(seconds=dedupe_window_s)))
 
-def run_analytics(store: michaeltore):
+    subs = michaelubs(cfg, dedupe=seen)
+    for device_id in device_ids or [None]:
+        for detection_type in detection_types or [None]:
+            subs.add_detections(on_det, device_id=device_id, detection_type=detection_type,
+                                min_confidence=min_conf)
+    LOG.info("Listening for detections on %d subscription(s) (min_confidence=%.2f)...",
+             subs.active, min_conf)
+    try:
+        if live is not None and alert_events:
+            from .http import MichaelHTTP
+            http = await MichaelHTTP(cfg).__aenter__()
+            live.add_callback(EventAlerter(http))
+        if live is not None and live_report_s:
+            report = asyncio.create_task(_report_live(live, live_report_s))
+        await subs.run()
+    finally:
+        if report is not None:
+            report.cancel()
+            with suppress(asyncio.CancelledError):
+                await report
+        if live is not None:
+            await live.drain()
+            LOG.info("Live aggregator: %d detections, %d alerts", live.observed, live.alerts)
+        if http is not None:
+            await http.__aexit__(None, None, None)
+        if writer is not None:
+            await writer.stop()
+            LOG.info("Ingest writer: %s", writer.metrics())
+        if seen is not None:
+            LOG.info("Duplicate filter: %s (reconnects=%d)", seen.stats(), subs.reconnects)
+
+async def _report_live(live: "LiveAggregator", every_s: float, top: int = 5):
+    while True:
+        await asyncio.sleep(every_s)
+        for row in live.snapshot()[:top]:
+            conf = f"{row['mean_conf']:.2f}" if row["mean_conf"] is not None else "-"
+            LOG.info("Live %gs  type=%-16s device=%-16s n=%-6d %.2f/s  mean conf %s", live.window_s,
+                     row["detection_type"], row["device_id"], row["count"], row["rate"], conf)
+
+def run_analytics(store, map_mode: str = "grid", map_zoom: int = 10, max_cells: int = 5000):
+    """`store` is a michaeltore or a ColumnarStore; both expose the same read API."""
+    from .viz import MichaelViz, grid_cell_deg
     df = store.recent_detection_analytics(days=30)
     if df.empty:
         LOG.info("No detection analytics available.")
@@ -85,11 +207,42 @@ def run_analytics(store: michaeltore):
     fig.write_html("detection_dashboard.html")
     LOG.info("Wrote detection_dashboard.html")
 
-    pts = store.detection_points(limit=1000)
-    if not pts.empty:
-        mfig = MichaelViz.map(pts)
+    if map_mode == "points":
+        pts = store.detection_points(limit=1000)
+        if not pts.empty:
+            mfig = MichaelViz.map(pts)
+            mfig.write_html("detection_map.html")
+            LOG.info("Wrote detection_map.html")
+        return
+
+    grid = store.detection_grid(grid_cell_deg(map_zoom), max_cells=max_cells)
+    if not grid.empty:
+        mfig = MichaelViz.density_map(grid, zoom=map_zoom)
         mfig.write_html("detection_map.html")
-        LOG.info("Wrote detection_map.html")
+        LOG.info("Wrote detection_map.html (%d cells, %d detections)", len(grid), int(grid["count"].sum()))
+
+def run_track_report(store: michaeltore, prefix: str = "track", min_stop_s: float = 120.0):
+    from .trackstats import TrackAnalytics
+    report = TrackAnalytics(store, min_stop_s=min_stop_s).run()
+    for name, df in report.items():
+        path = f"{prefix}_{name}.csv"
+        df.to_csv(path, index=False)
+        LOG.info("Wrote %s (%d rows)", path, len(df))
+
+def run_fetch_all(args, cfg: MichaelConfig, store: Optional[michaeltore]):
+    from .shards import fetch_all, load_manifest, merge_shards
+    jobs = load_manifest(args.manifest, cfg, args.shard_dir, hours=args.hours)
+    results = fetch_all(jobs, workers=args.workers, incremental=args.incremental,
+                        refresh_schema=args.refresh_schema, stream=args.stream,
+                        chunk_size=args.chunk_size, compact_points=args.compact_points)
+    ok = [r["db"] for r in results if not r["error"]]
+    if store is not None and ok:
+        totals = merge_shards(store, sorted(ok))
+        LOG.info("Merged %d shard(s) into %s: %s", len(ok), store.path,
+                 ", ".join(f"{k}={v}" for k, v in totals.items()))
+    failed = sorted(r["name"] for r in results if r["error"])
+    if failed:
+        raise SystemExit(f"fetch-all: {len(failed)} of {len(results)} tenant(s) failed: {', '.join(failed)}")
 
 def _parse_cli(argv=None):
     p = argparse.ArgumentParser(description="Michael GraphQL client")
@@ -97,31 +250,215 @@ def _parse_cli(argv=None):
     p.add_argument("--token-value", default="", help="x-token-value")
     p.add_argument("--db", default="michael_data.db", help="SQLite path")
     p.add_argument("--hours", type=int, default=24, help="Look back window for fetch")
+    p.add_argument("--persisted-queries", action="store_true",
+                   help="Send query hashes (APQ) and fall back to full text on a miss")
+    p.add_argument("--schema-ttl", type=int, default=86400, help="Seconds the cached introspection stays valid")
+    p.add_argument("--chunk-size", type=int, default=5000, help="Rows per executemany batch")
+    p.add_argument("--compact-points", action="store_true",
+                   help="Store track points as packed per-track column blobs")
+    p.add_argument("--partitioned", action="store_true",
+                   help="Keep detections and track points in monthly partition files next to --db")
+    p.add_argument("--concurrency", type=int, default=4, help="Concurrent page requests for fetch")
+    p.add_argument("--rate-limit", type=float, default=0.0, help="Max requests per second (0 = unlimited)")
+    p.add_argument("--max-in-flight", type=int, default=32, help="Upper bound for the adaptive in-flight limit")
+    p.add_argument("--conn-limit", type=int, default=100, help="Pooled HTTP connections (0 = unlimited)")
+    p.add_argument("--compress-min-bytes", type=int, default=0,
+                   help="Gzip mutation bodies at least this large (0 = never)")
+    p.add_argument("--metrics-file", default="", help="Where each command saves its metrics (default <db>.metrics.json)")
+    p.add_argument("--prom-textfile", default="", help="Also export metrics in Prometheus textfile format here")
+    p.add_argument("--profile", choices=("cpu", "mem"), default=None, help="Profile the command (cProfile/tracemalloc)")
+    p.add_argument("--profile-out", default="", help="Save the raw cProfile stats / tracemalloc snapshot here")
 
     sub = p.add_subparsers(dest="cmd", required=True)
-    sub.add_parser("fetch", help="Fetch devices/tracks/detections and persist")
+    fsub = sub.add_parser("fetch", help="Fetch devices/tracks/detections and persist")
+    fsub.add_argument("--incremental", action="store_true",
+                      help="Only fetch data newer than the stored high-water marks")
+    fsub.add_argument("--overlap", type=int, default=300,
+                      help="Seconds re-fetched before the mark to catch late rows")
+    fsub.add_argument("--stream", action="store_true",
+                      help="Parse tracks/detections incrementally and store them batch by batch")
+    fsub.add_argument("--refresh-schema", action="store_true", help="Ignore the cached introspection")
+    msub = sub.add_parser("fetch-all", help="Fetch every tenant in a manifest into per-tenant shard DBs, in parallel")
+    msub.add_argument("--manifest", required=True, help="JSON list of tenants (name + MichaelConfig fields)")
+    msub.add_argument("--shard-dir", default="shards", help="Where shard DBs (<name>.db) are written")
+    msub.add_argument("--workers", type=int, default=0, help="Worker processes (0 = one per CPU)")
+    msub.add_argument("--merge", action="store_true", help="Merge the fetched shards into --db afterwards")
+    msub.add_argument("--incremental", action="store_true",
+                      help="Only fetch data newer than each shard's high-water marks")
+    msub.add_argument("--overlap", type=int, default=300,
+                      help="Seconds re-fetched before the mark to catch late rows")
+    msub.add_argument("--stream", action="store_true",
+                      help="Parse tracks/detections incrementally and store them batch by batch")
+    msub.add_argument("--refresh-schema", action="store_true", help="Ignore the cached introspection")
     sub.add_parser("event", help="Create a sample event")
     ssub = sub.add_parser("subscribe", help="Subscribe to live detections")
     ssub.add_argument("--min-confidence", type=float, default=0.7)
-    sub.add_parser("analytics", help="Generate HTML dashboard + map (if data present)")
+    ssub.add_argument("--device-id", action="append", default=[],
+                      help="Subscribe per device (repeatable; all multiplexed on one socket)")
+    ssub.add_argument("--detection-type", action="append", default=[],
+                      help="Subscribe per detection type (repeatable)")
+    ssub.add_argument("--dedupe", choices=("lru", "bloom", "none"), default="lru",
+                      help="Drop repeated detection ids before handlers run")
+    ssub.add_argument("--dedupe-window", type=float, default=3600.0, help="Seconds an id is remembered")
+    ssub.add_argument("--dedupe-fp-rate", type=float, default=0.001, help="Bloom false-positive rate")
+    ssub.add_argument("--store", action="store_true", help="Persist detections to --db in micro-batches")
+    ssub.add_argument("--batch-size", type=int, default=500, help="Max detections per store flush")
+    ssub.add_argument("--flush-ms", type=int, default=1000, help="Max time a partial batch waits")
+    ssub.add_argument("--queue-size", type=int, default=10000, help="Bounded queue size before the drop policy applies")
+    ssub.add_argument("--drop-policy", choices=BatchWriter.POLICIES, default="block")
+    ssub.add_argument("--rules", default="", help="JSON list of live alert rules (threshold/spike)")
+    ssub.add_argument("--alert-events", action="store_true", help="Record every alert as a createEvent mutation")
+    ssub.add_argument("--live-window", type=float, default=60.0, help="Sliding window (s) of the live summary")
+    ssub.add_argument("--live-report", type=float, default=0.0,
+                      help="Log the busiest live windows every N seconds (0 = off)")
+    asub = sub.add_parser("analytics", help="Generate HTML dashboard + map (if data present)")
+    asub.add_argument("--map-mode", choices=("grid", "points"), default="grid",
+                      help="grid: bin every detection into cells; points: newest 1000 raw points")
+    asub.add_argument("--map-zoom", type=int, default=10, help="Map zoom the grid cell size is chosen for")
+    asub.add_argument("--max-cells", type=int, default=5000, help="Coarsen the grid until it fits")
+    tsub = sub.add_parser("track-report", help="Distance/speed/stop metrics computed from stored track points")
+    tsub.add_argument("--prefix", default="track", help="Output CSV prefix")
+    tsub.add_argument("--min-stop", type=float, default=120.0, help="Minimum dwell seconds counted as a stop")
+    asub.add_argument("--from-files", default="", help="Read a columnar export directory instead of --db")
+    sub.add_parser("rebuild-rollups", help="Recompute detection rollup tables from stored detections")
+    sub.add_parser("stats", help="Show stored row counts/sizes and the metrics of the last command")
+    msub = sub.add_parser("maintain", help="Apply retention, reclaim free pages, checkpoint the WAL and ANALYZE")
+    msub.add_argument("--retain", action="append", default=[], metavar="TABLE=DAYS",
+                      help="Keep this many days of detections, tracks, detection_rollup_hour or "
+                           "detection_rollup_day (repeatable)")
+    msub.add_argument("--full-vacuum", action="store_true",
+                      help="Rewrite the main DB (slow; needed once for files created before incremental vacuum)")
+    msub.add_argument("--no-analyze", action="store_true", help="Run PRAGMA optimize instead of a sampled ANALYZE")
+    xsub = sub.add_parser("export", help="Export tables to day-partitioned Parquet/Arrow files (incremental)")
+    xsub.add_argument("--out", default="michael_export", help="Export directory")
+    xsub.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
     return p.parse_args(argv)
 
 def _cfg_from_args(args) -> MichaelConfig:
-    return MichaelConfig(token_id=args.token_id, token_value=args.token_value)
+    return MichaelConfig(token_id=args.token_id, token_value=args.token_value,
+                         page_concurrency=args.concurrency,
+                         rate_limit_rps=args.rate_limit, max_in_flight=args.max_in_flight,
+                         conn_limit=args.conn_limit, compress_min_bytes=args.compress_min_bytes,
+                         sync_overlap_s=getattr(args, "overlap", 300),
+                         schema_cache_ttl_s=args.schema_ttl,
+                         persisted_queries=args.persisted_queries)
+
+def _retention(values: Sequence[str]) -> Dict[str, float]:
+    days = {}
+    for value in values:
+        table, _, n = value.partition("=")
+        try:
+            days[table] = float(n)
+        except ValueError:
+            raise SystemExit(f"--retain expects TABLE=DAYS, got {value!r}")
+    unknown = set(days) - set(RETAINED_TABLES)
+    if unknown:
+        raise SystemExit(f"--retain: unknown table(s) {', '.join(sorted(unknown))}; expected {', '.join(RETAINED_TABLES)}")
+    return days
+
+def _rules(path: str) -> List["Rule"]:
+    if not path:
+        return []
+    from .live import load_rules
+    return load_rules(path)
+
+def run_maintenance(store: michaeltore, retain: Dict[str, float], full_vacuum: bool = False, analyze: bool = True):
+    if retain:
+        store.apply_retention(retain)
+    st = store.maintain(analyze=analyze, full_vacuum=full_vacuum)
+    LOG.info("Maintained %d database file(s) in %.2fs: %.1f MiB reclaimed%s", st["schemas"], st["seconds"],
+             st["freed_bytes"] / 2**20, ", WAL checkpoint blocked by readers" if st["checkpoint_busy"] else "")
+
+def show_stats(store: michaeltore, metrics_file: str):
+    st = store.storage_stats()
+    LOG.info("%s: %.1f MiB (%.1f MiB free, WAL %.1f MiB)", store.path, st["db_bytes"] / 2**20,
+             st["free_bytes"] / 2**20, st["wal_bytes"] / 2**20)
+    if st["partitions"]:
+        LOG.info("  %d monthly partitions: %.1f MiB", st["partitions"], st["partition_bytes"] / 2**20)
+    for table, n in st["rows"].items():
+        LOG.info("  %-22s %12s rows", table, f"{n:,}")
+    try:
+        with open(metrics_file, encoding="utf-8") as fh:
+            snapshot = json.load(fh)
+    except (OSError, ValueError):
+        LOG.info("No metrics recorded yet (%s)", metrics_file)
+        return
+    LOG.info("Metrics of the last command (%s):", metrics_file)
+    for line in summarize(snapshot):
+        LOG.info("  %s", line)
+
+def _needs_store(args) -> bool:
+    if args.cmd == "event":
+        return False
+    if args.cmd == "subscribe":
+        return args.store
+    if args.cmd == "analytics":
+        return not args.from_files
+    if args.cmd == "fetch-all":
+        return args.merge
+    return True
 
 def main(argv=None):
     args = _parse_cli(argv)
     cfg = _cfg_from_args(args)
-    store = michaeltore(args.db)
+    store = (michaeltore(args.db, chunk_size=args.chunk_size, compact_points=args.compact_points,
+                         partitioned=args.partitioned)
+             if _needs_store(args) else None)
+    metrics_file = args.metrics_file or f"{args.db}.metrics.json"
+    if args.cmd == "stats":
+        show_stats(store, metrics_file)
+        store.close()
+        return
+    exporter = TextfileExporter(REGISTRY, args.prom_textfile).start() if args.prom_textfile else None
+    try:
+        with profiled(args.profile, args.profile_out):
+            _run(args, cfg, store)
+    finally:
+        if store is not None:
+            store.close()
+        if exporter is not None:
+            exporter.stop()
+        try:
+            REGISTRY.write_json(metrics_file)
+        except OSError as e:
+            LOG.warning("Could not save metrics to %s: %s", metrics_file, e)
 
+def _run(args, cfg: MichaelConfig, store: Optional[michaeltore]):
     if args.cmd == "fetch":
-        asyncio.run(fetch_everything(cfg, store, hours=args.hours))
+        asyncio.run(fetch_everything(cfg, store, hours=args.hours, incremental=args.incremental,
+                                     refresh_schema=args.refresh_schema, stream=args.stream))
+    elif args.cmd == "fetch-all":
+        run_fetch_all(args, cfg, store)
     elif args.cmd == "event":
         asyncio.run(create_sample_event(cfg))
     elif args.cmd == "subscribe":
-        asyncio.run(run_subscriptions(cfg, min_conf=args.min_confidence))
+        asyncio.run(run_subscriptions(
+            cfg, min_conf=args.min_confidence, store=store,
+            batch_size=args.batch_size, flush_interval_s=args.flush_ms / 1000,
+            max_queue=args.queue_size, drop_policy=args.drop_policy,
+            device_ids=args.device_id, detection_types=args.detection_type,
+            dedupe=args.dedupe, dedupe_window_s=args.dedupe_window, dedupe_fp_rate=args.dedupe_fp_rate,
+            rules=_rules(args.rules), alert_events=args.alert_events,
+            live_window_s=args.live_window, live_report_s=args.live_report,
+        ))
     elif args.cmd == "analytics":
-        run_analytics(store)
+        if args.from_files:
+            from .columnar import ColumnarStore
+            src = ColumnarStore(args.from_files)
+        else:
+            src = store
+        run_analytics(src, map_mode=args.map_mode, map_zoom=args.map_zoom, max_cells=args.max_cells)
+    elif args.cmd == "track-report":
+        run_track_report(store, prefix=args.prefix, min_stop_s=args.min_stop)
+    elif args.cmd == "rebuild-rollups":
+        st = store.rebuild_rollups()
+        LOG.info("Rebuilt %d rollup rows in %.2fs", st.rows, st.seconds)
+    elif args.cmd == "maintain":
+        run_maintenance(store, _retention(args.retain), full_vacuum=args.full_vacuum, analyze=not args.no_analyze)
+    elif args.cmd == "export":
+        from .columnar import export_store
+        counts = export_store(store, args.out, fmt=args.format)
+        LOG.info("Exported to %s: %s", args.out, ", ".join(f"{k}={v}" for k, v in counts.items()))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,225 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import json, logging, os, shutil, uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Sequence
+import numpy as np
+import pandas as pd
+from .store import grid_from_partials, michaeltore, typed_frame
+
+try:  # optional: pip install michael-client[columnar]
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+except ImportError:
+    pa = None
+
+LOG = logging.getLogger("michael")
+
+_FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+_STATE_FILE = "_export_state.json"
+# timestamp columns converted to real timestamps, and the one each table is partitioned by day on
+_TS_COLUMNS = {
+    "detections": ("timestamp",),
+    "track_points": ("timestamp",),
+    "tracks": ("start_time", "end_time"),
+}
+_PARTITION_ON = {"detections": "timestamp", "track_points": "timestamp", "tracks": "start_time"}
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Columnar export needs pyarrow: pip install 'michael-client[columnar]'")
+
+def _to_arrow(df: pd.DataFrame, table: str) -> "pa.Table":
+    df = df.drop(columns=["_rowid", "id"] if table == "track_points" else ["_rowid"])
+    for col in _TS_COLUMNS[table]:
+        df[col] = pd.to_datetime(df[col], utc=True, format="ISO8601", errors="coerce")
+    if "date" not in df.columns:  # changed-day reads carry the store's own day
+        df["date"] = df[_PARTITION_ON[table]].dt.strftime("%Y-%m-%d").fillna("unknown")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def _write(table: "pa.Table", base_dir: str, fmt: str, basename: str):
+    ds.write_dataset(
+        table, base_dir, format=_FORMATS[fmt],
+        partitioning=["date"], partitioning_flavor="hive",
+        basename_template=basename + "-{i}." + ("parquet" if fmt == "parquet" else "arrow"),
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+def _load_state(root: str) -> Dict:
+    try:
+        with open(os.path.join(root, _STATE_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(root: str, state: Dict):
+    tmp = os.path.join(root, _STATE_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, os.path.join(root, _STATE_FILE))
+
+def _swap_days(root: str, table: str, staged: str, days: Sequence[str]):
+    """Move each staged `date=` directory over the export's, one day at a time. Rerunning after a
+    crash finishes the swap: a day is done once its staged directory is gone."""
+    live = os.path.join(root, table)
+    os.makedirs(live, exist_ok=True)
+    for day in days:
+        new, cur = os.path.join(staged, f"date={day}"), os.path.join(live, f"date={day}")
+        if not os.path.isdir(new):
+            continue
+        old = os.path.join(staged, f".old-{day}")
+        if os.path.isdir(cur):
+            os.replace(cur, old)
+        if os.listdir(new):
+            os.replace(new, cur)
+        else:  # the day has no rows left
+            os.rmdir(new)
+        shutil.rmtree(old, ignore_errors=True)
+    shutil.rmtree(staged, ignore_errors=True)
+
+def export_store(store: michaeltore, root: str, fmt: str = "parquet") -> Dict[str, int]:
+    """Write detections, tracks and track points under `root` as day-partitioned datasets.
+
+    detections are append-only, so only rows past the rowid marks recorded per source (main
+    and each monthly partition) in `<root>/_export_state.json` are written. tracks and track
+    points are upserted in place, so the days the store's change log shows as touched since the
+    last export are rebuilt in a staging directory and swapped in day by day; an interrupted
+    swap is finished by the next export.
+    """
+    _require_pyarrow()
+    if fmt not in _FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {sorted(_FORMATS)}")
+    os.makedirs(root, exist_ok=True)
+    state = _load_state(root)
+    if state.setdefault("format", fmt) != fmt:
+        raise ValueError(f"{root} already holds {state['format']} data")
+    for table, pending in state.pop("pending", {}).items():
+        _swap_days(root, table, os.path.join(root, pending["staged"]), pending["days"])
+    _save_state(root, state)
+    run = uuid.uuid4().hex[:8]
+    counts: Dict[str, int] = {}
+
+    counts["detections"] = 0
+    marks = state.get("detections", {})
+    legacy = 0
+    if not isinstance(marks, dict):  # older exports kept one mark across every source
+        legacy, marks = int(marks), {}
+    for i, (source, df) in enumerate(store.iter_table_sources("detections", marks, default=legacy)):
+        _write(_to_arrow(df, "detections"), os.path.join(root, "detections"), fmt, f"part-{run}-{i}")
+        counts["detections"] += len(df)
+        marks[source] = int(df["_rowid"].iloc[-1])
+        state["detections"] = marks
+        _save_state(root, state)
+    state.pop("track_points", None)  # rowid mark of older exports, which appended points
+
+    # exports from before the change log rewrote both tables in full; with no seqs every logged
+    # day is changed, which rebuilds them once
+    changed, seqs = store.export_changes(state.get("changes", {}))
+    staged = {table: f".{table}-{run}" for table in changed}
+    counts["track_points_compact"] = 0
+    for table, days in changed.items():
+        counts[table] = 0
+        tmp = os.path.join(root, staged[table])
+        for i, df in enumerate(store.iter_table_days(table, days)):
+            _write(_to_arrow(df, table), tmp, fmt, f"part-{run}-{i}")
+            counts[table] += len(df)
+        if table == "track_points":
+            for i, df in enumerate(store.iter_blob_points(days)):
+                _write(pa.Table.from_pandas(df, preserve_index=False), tmp, fmt, f"compact-{run}-{i}")
+                counts["track_points_compact"] += len(df)
+        for day in days:  # days left with no rows are swapped in empty, which removes them
+            os.makedirs(os.path.join(tmp, f"date={day}"), exist_ok=True)
+    state["pending"] = {table: {"staged": staged[table], "days": sorted(days)}
+                        for table, days in changed.items() if days}
+    _save_state(root, state)
+    for table, pending in state.pop("pending").items():
+        _swap_days(root, table, os.path.join(root, pending["staged"]), pending["days"])
+    state["changes"] = seqs
+    _save_state(root, state)
+    return counts
+
+class ColumnarStore:
+    """Read side of an export: the michaeltore analytics API served from Parquet/Arrow files.
+
+    Files are opened memory-mapped, only the requested columns are decoded, and
+    `date=` partitions outside the requested window are never touched.
+    """
+
+    def __init__(self, root: str):
+        _require_pyarrow()
+        self.root = root
+        self.fmt = _load_state(root).get("format", "parquet")
+        self._fs = pafs.LocalFileSystem(use_mmap=True)
+
+    def dataset(self, table: str) -> "ds.Dataset":
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            return ds.dataset([], schema=pa.schema([]))
+        return ds.dataset(path, format=_FORMATS[self.fmt], filesystem=self._fs,
+                          partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"))
+
+    def read(self, table: str, columns: Optional[Sequence[str]] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None) -> "pa.Table":
+        data = self.dataset(table)
+        if not data.schema.names:
+            return pa.table({c: pa.array([], pa.null()) for c in columns or []})
+        ts = _PARTITION_ON[table]
+        filt = None
+        if since is not None:
+            filt = (ds.field("date") >= since.strftime("%Y-%m-%d")) & (ds.field(ts) >= pa.scalar(since))
+        if until is not None:
+            upper = (ds.field("date") <= until.strftime("%Y-%m-%d")) & (ds.field(ts) <= pa.scalar(until))
+            filt = upper if filt is None else filt & upper
+        return data.to_table(columns=list(columns) if columns else None, filter=filt)
+
+    def recent_detection_analytics(self, days: int = 30) -> pd.DataFrame:
+        since = (datetime.now(timezone.utc) - timedelta(days=int(days))).strftime("%Y-%m-%d")
+        data = self.dataset("detections")
+        if not data.schema.names:
+            return typed_frame(pd.DataFrame(columns=["detection_type", "date", "avg_confidence",
+                                                     "detection_count", "device_id"]), ("date",))
+        t = data.to_table(columns=["detection_type", "date", "device_id", "confidence"],
+                          filter=ds.field("date") >= since)
+        agg = t.group_by(["detection_type", "date", "device_id"]).aggregate(
+            [("confidence", "mean"), ("date", "count")])
+        df = agg.to_pandas().rename(columns={"confidence_mean": "avg_confidence", "date_count": "detection_count"})
+        df = df[["detection_type", "date", "avg_confidence", "detection_count", "device_id"]] \
+            .sort_values("date", ascending=False, kind="stable").reset_index(drop=True)
+        return typed_frame(df, ("date",))
+
+    def detection_points(self, limit: int = 1000) -> pd.DataFrame:
+        cols = ["id", "device_id", "timestamp", "detection_type", "confidence", "latitude", "longitude"]
+        t = self.read("detections", cols)
+        if not t.num_rows:
+            return typed_frame(pd.DataFrame(columns=cols))
+        t = t.filter(pc.and_(pc.is_valid(t["latitude"]), pc.is_valid(t["longitude"])))
+        idx = pc.select_k_unstable(t, k=min(limit, t.num_rows), sort_keys=[("timestamp", "descending")])
+        return typed_frame(t.take(idx).to_pandas())
+
+    def detection_grid(self, cell_deg: float, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None, detection_type: Optional[str] = None,
+                       max_cells: Optional[int] = None) -> pd.DataFrame:
+        t = self.read("detections", ["latitude", "longitude", "confidence", "detection_type"], since, until)
+        df = t.to_pandas() if t.num_rows else pd.DataFrame(columns=t.column_names)
+        df = df[df["latitude"].notna() & df["longitude"].notna()]
+        if detection_type is not None:
+            df = df[df["detection_type"] == detection_type]
+        lat, lon = df["latitude"].to_numpy(dtype="f8"), df["longitude"].to_numpy(dtype="f8")
+        conf = df["confidence"].to_numpy(dtype="f8")
+        while True:
+            part = pd.DataFrame({
+                "gy": ((lat + 90) / cell_deg).astype("int64"),
+                "gx": ((lon + 180) / cell_deg).astype("int64"),
+                "detection_type": df["detection_type"].to_numpy(),
+                "lat_sum": lat, "lon_sum": lon, "n": 1,
+                "conf_sum": np.nan_to_num(conf), "conf_n": (~np.isnan(conf)).astype("int64"),
+            })
+            raw = part.groupby(["gy", "gx", "detection_type"], dropna=False, sort=False).sum().reset_index()
+            if max_cells is None or raw[["gy", "gx"]].drop_duplicates().shape[0] <= max_cells:
+                return grid_from_partials(raw, cell_deg)
+            cell_deg *= 2
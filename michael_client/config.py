@@ -13,4 +13,40 @@ class MichaelConfig:
     token_value: str = "vr7wedFDUFkdQaTmHbvI"
     request_timeout_s: int = 60  #TODO:: This is added due to timeout issue that is happening need to update before fully executing 
     retries: int = 2
-    retry_backoff_s: float = 0.6  # exponential
+    retry_backoff_s: float = 0.6  # exponential with full jitter, unless the server sends Retry-After
+    retry_backoff_max_s: float = 30.0
+    # client-side throttling: token bucket (0 = unlimited) and an AIMD limit on in-flight requests
+    rate_limit_rps: float = 0.0
+    rate_limit_burst: int = 10
+    initial_in_flight: int = 8
+    min_in_flight: int = 1
+    max_in_flight: int = 32
+    # HTTP transport: connection pool, DNS cache, split timeouts and compression
+    conn_limit: int = 100  # 0 = unlimited
+    conn_limit_per_host: int = 32
+    dns_cache_ttl_s: int = 300
+    keepalive_timeout_s: float = 30.0
+    connect_timeout_s: float = 10.0
+    read_timeout_s: float = 60.0  # max idle time between reads of a response
+    accept_encoding: str = ""  # "" = aiohttp default: gzip, deflate (+ br when Brotli is installed)
+    compress_min_bytes: int = 0  # gzip mutation bodies at least this large (0 = never)
+    # per-endpoint circuit breaker (0 = disabled)
+    breaker_failures: int = 5
+    breaker_reset_s: float = 30.0
+    # pagination
+    page_concurrency: int = 4
+    device_page_size: int = 100
+    track_page_size: int = 100
+    detection_page_size: int = 1000
+    stream_batch_size: int = 500  # items per store batch in streaming fetches
+    # incremental sync: seconds re-fetched before the stored high-water mark
+    sync_overlap_s: int = 300
+    # subscriptions
+    ws_ping_interval_s: float = 20.0
+    ws_ack_timeout_s: float = 10.0
+    ws_reconnect_base_s: float = 0.5
+    ws_reconnect_max_s: float = 30.0
+    # schema cache ("" = ~/.cache/michael-client) and automatic persisted queries
+    schema_cache_path: str = ""
+    schema_cache_ttl_s: int = 86400
+    persisted_queries: bool = False
@@ -0,0 +1,115 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import hashlib, math, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable
+
+class SeenIds:
+    """Exact seen-id filter: an LRU of at most `max_items` ids, each forgotten `ttl_s` after it
+    was last seen."""
+
+    def __init__(self, max_items: int = 100_000, ttl_s: float = 3600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._seen: "OrderedDict[Any, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key: Any) -> bool:
+        """True if `key` was already recorded inside the window; records it otherwise."""
+        now = self.clock()
+        self._expire(now)
+        if key in self._seen:
+            self._seen[key] = now  # keeps the entries in time order for _expire
+            self._seen.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._seen[key] = now
+        if len(self._seen) > self.max_items:
+            self._seen.popitem(last=False)
+        return False
+
+    def seed(self, keys: Iterable[Any]):
+        now = self.clock()
+        for key in keys:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+        while len(self._seen) > self.max_items:
+            self._seen.popitem(last=False)
+
+    def _expire(self, now: float):
+        cutoff = now - self.ttl_s
+        while self._seen:
+            key, ts = next(iter(self._seen.items()))
+            if ts >= cutoff:
+                break
+            self._seen.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": "lru", "size": len(self._seen), "hits": self.hits, "misses": self.misses}
+
+class BloomSeen:
+    """Approximate seen-id filter with fixed memory.
+
+    Two bloom generations sized for `capacity` ids at `fp_rate`; the older one is
+    dropped every `ttl_s / 2` (or when the current one fills), so ids are remembered
+    for between ttl_s/2 and ttl_s. A false positive drops a genuinely new id.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, fp_rate: float = 0.001, ttl_s: float = 3600.0):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.ttl_s = ttl_s
+        self.bits = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.bits / capacity * math.log(2)))
+        self._cur = bytearray((self.bits + 7) // 8)
+        self._old = bytearray(len(self._cur))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def _positions(self, key: Any):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
+
+    @staticmethod
+    def _has(bits: bytearray, pos) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in pos)
+
+    def _rotate(self):
+        self._old, self._cur = self._cur, bytearray(len(self._cur))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+
+    def _add(self, pos):
+        if self._count >= self.capacity or time.monotonic() - self._rotated_at >= self.ttl_s / 2:
+            self._rotate()
+        for p in pos:
+            self._cur[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+
+    def seen(self, key: Any) -> bool:
+        pos = self._positions(key)
+        if self._has(self._cur, pos) or self._has(self._old, pos):
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._add(pos)
+        return False
+
+    def seed(self, keys: Iterable[Any]):
+        for key in keys:
+            self._add(self._positions(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": "bloom", "bytes": 2 * len(self._cur), "k": self.k, "fp_rate": self.fp_rate,
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,29 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import math
+from typing import Tuple
+from .lazy import lazy_import
+
+np = lazy_import("numpy")
+
+EARTH_RADIUS_M = 6_371_008.8
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; accepts scalars or broadcastable NumPy arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype="f8")) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def bbox_around(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) enclosing a circle; widens to all longitudes near the poles/antimeridian."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = math.degrees(radius_m / (EARTH_RADIUS_M * math.cos(math.radians(lat))))
+    if lon - dlon < -180.0 or lon + dlon > 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    return min_lat, lon - dlon, max_lat, lon + dlon
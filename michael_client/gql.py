@@ -4,6 +4,9 @@ Created by Michael Wilson, Senior Software Engineer
 09/09/2025 - Updated the file to added in the GET_DEVICES, TRACKS,DETECTION 
 """
 
+import re
+from typing import Optional, Tuple
+
 INTROSPECTION = """
 query IntrospectionQuery {
   __schema {
@@ -106,3 +109,10 @@ subscription NewDetections($deviceId: ID, $detectionType: String, $minConfidence
   }
 }
 """
+
+_OPERATION = re.compile(r"^\s*(?:#[^\n]*\n\s*)*(query|mutation|subscription)\b\s*([A-Za-z_]\w*)?")
+
+def operation(query: str) -> Tuple[str, Optional[str]]:
+    """(operation type, operation name) of a document; anonymous `{ ... }` is a query."""
+    m = _OPERATION.match(query)
+    return (m.group(1), m.group(2)) if m else ("query", None)
@@ -3,56 +3,333 @@ Created by Michael Wilson, Senior Software Engineer
 """
 
 from __future__ import annotations
-import asyncio, json, logging
-from typing import Any, Dict, Optional
+import asyncio, codecs, gzip, hashlib, json, logging, re, time
+from typing import Any, AsyncIterator, Dict, List, Optional
 import aiohttp
 from .config import MichaelConfig
+from .cache import ResponseCache
+from .gql import operation
+from .metrics import REGISTRY
+from .throttle import AIMDLimiter, CircuitBreaker, TokenBucket, backoff_delay, parse_retry_after
+
+try:  # optional fast paths: pip install michael-client[fast]
+    import orjson
+    _loads, _dumps = orjson.loads, orjson.dumps
+except ImportError:
+    _loads = json.loads
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=str).encode()
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 LOG = logging.getLogger("michael")
 
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+_THROTTLE_STATUS = {429, 503}
+
+# scanner patterns: the rest of a string body, and runs of text with no nesting change, complete
+# strings included (commas only end an element at the array's own depth)
+_STR_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_NESTED = re.compile(r'(?:[^"{}\[\]]+|"(?:[^"\\]|\\.)*")*', re.S)
+_TOP = re.compile(r'(?:[^"{}\[\],]+|"(?:[^"\\]|\\.)*")*', re.S)
+
+async def _iter_array(content: aiohttp.StreamReader, field: str,
+                      chunk_size: int = 1 << 16) -> AsyncIterator[Any]:
+    """Yield the elements of the first `"<field>": [...]` array in a streamed JSON body.
+
+    Each chunk is scanned once, carrying string/nesting state across chunk boundaries, and an
+    element is decoded once, when its closing comma or bracket arrives; only the text of the
+    current element is kept. If the array never appears (null data, errors) the small body is
+    decoded once to surface the errors.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(field))
+    head, found = "", False
+    parts: List[str] = []  # text of the current element so far
+    depth, in_str, escaped = 0, False, False
+    async for chunk in content.iter_chunked(chunk_size):
+        text = decoder.decode(chunk)
+        if not found:
+            head += text
+            m = marker.search(head)
+            if not m:
+                continue
+            text, head, found = head[m.end():], "", True
+        pos = start = 0
+        while pos < len(text):
+            if in_str:
+                if escaped:  # the previous chunk ended on a backslash
+                    pos, escaped = pos + 1, False
+                    continue
+                pos = _STR_BODY.match(text, pos).end()
+                if pos < len(text) and text[pos] == '"':
+                    pos, in_str = pos + 1, False
+                elif pos < len(text):  # a lone backslash ends the chunk
+                    pos, escaped = len(text), True
+                continue
+            pos = (_TOP if depth == 0 else _NESTED).match(text, pos).end()
+            if pos == len(text):
+                break
+            c, pos = text[pos], pos + 1
+            if c == '"':  # a string the chunk cuts short
+                in_str = True
+            elif c in "{[":
+                depth += 1
+            elif depth:
+                depth -= 1
+            else:  # a comma or the array's closing bracket
+                parts.append(text[start:pos - 1])
+                element, parts, start = "".join(parts).strip(), [], pos
+                if element:
+                    yield _loads(element)
+                if c == "]":
+                    return
+        parts.append(text[start:])
+    if found:
+        raise ValueError(f"Response ended inside the {field!r} array")
+    try:
+        errors = json.loads(head).get("errors")
+    except (ValueError, AttributeError):
+        errors = None
+    if errors:
+        LOG.warning("GraphQL returned errors: %s", errors[:1])
+
+def open_session(cfg: MichaelConfig) -> aiohttp.ClientSession:
+    """A pooled session configured from `cfg`; pass it to several MichaelHTTP clients to share
+    connections (and TLS handshakes) across commands. Must be created inside the running loop."""
+    connector = aiohttp.TCPConnector(
+        limit=cfg.conn_limit, limit_per_host=cfg.conn_limit_per_host,
+        ttl_dns_cache=cfg.dns_cache_ttl_s or None, use_dns_cache=cfg.dns_cache_ttl_s > 0,
+        keepalive_timeout=cfg.keepalive_timeout_s,
+    )
+    timeout = aiohttp.ClientTimeout(total=cfg.request_timeout_s, connect=cfg.connect_timeout_s,
+                                    sock_read=cfg.read_timeout_s)
+    headers = {
+        "Content-Type": "application/json",
+        "x-token-id": cfg.token_id,
+        "x-token-value": cfg.token_value,
+    }
+    if cfg.accept_encoding:
+        headers["Accept-Encoding"] = cfg.accept_encoding
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+
 class MichaelHTTP:
-    def __init__(self, cfg: MichaelConfig):
+    def __init__(self, cfg: MichaelConfig, cache: Optional[ResponseCache] = None,
+                 session: Optional[aiohttp.ClientSession] = None):
         self.cfg = cfg
-        self._session: Optional[aiohttp.ClientSession] = None
+        self.cache = cache
+        self._session = session
+        self._owns_session = session is None
+        self._hashes: Dict[str, str] = {}
+        self._apq = True
+        self.bucket = TokenBucket(cfg.rate_limit_rps, cfg.rate_limit_burst)
+        self.limiter = AIMDLimiter(cfg.initial_in_flight, cfg.min_in_flight, cfg.max_in_flight)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._resume_at = 0.0  # monotonic time before which nothing is sent (Retry-After)
+        self.retried = 0
+        self.throttled = 0
+        self.metrics = REGISTRY
 
     async def __aenter__(self) -> "MichaelHTTP":
-        timeout = aiohttp.ClientTimeout(total=self.cfg.request_timeout_s)
-        self._session = aiohttp.ClientSession(
-            timeout=timeout,
-            headers={
-                "Content-Type": "application/json",
-                "x-token-id": self.cfg.token_id,
-                "x-token-value": self.cfg.token_value,
-            },
-        )
+        if self._owns_session:
+            self._session = open_session(self.cfg)
         return self
 
     async def __aexit__(self, *exc):
-        if self._session:
+        if self._session and self._owns_session:
             await self._session.close()
+            self._session = None
+
+    def _query_hash(self, query: str) -> str:
+        h = self._hashes.get(query)
+        if h is None:
+            h = self._hashes[query] = hashlib.sha256(query.encode()).hexdigest()
+        return h
 
     async def execute(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         if not self._session:
             raise RuntimeError("Session not initialized")
+        if self.cache is not None:
+            return await self.cache.fetch(query, variables, lambda: self._execute(query, variables))
+        return await self._execute(query, variables)
 
-        payload = {"query": query}
+    async def _execute(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        kind, name = operation(query)
+        op = name or kind
+        payload: Dict[str, Any] = {}
         if variables:
             payload["variables"] = variables
 
+        if self.cfg.persisted_queries and self._apq:
+            # Automatic persisted queries: send only the hash, register the text on a miss.
+            payload["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": self._query_hash(query)}}
+            data = await self._post(payload, op=op)
+            code = _apq_error(data)
+            if code is None:
+                return self._checked(data)
+            if code == "PERSISTED_QUERY_NOT_SUPPORTED":
+                LOG.info("Server does not support persisted queries; sending full documents")
+                self._apq = False
+                del payload["extensions"]
+
+        payload["query"] = query
+        return self._checked(await self._post(payload, compress=kind == "mutation", op=op))
+
+    @staticmethod
+    def _checked(data: Dict[str, Any]) -> Dict[str, Any]:
+        if "errors" in data:
+            LOG.warning("GraphQL returned errors: %s", data["errors"][:1])
+        return data
+
+    async def _post(self, payload: Dict[str, Any], compress: bool = False, op: str = "") -> Dict[str, Any]:
+        return await self._send(payload, compress=compress, op=op)
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        b = self._breakers.get(url)
+        if b is None:
+            b = self._breakers[url] = CircuitBreaker(self.cfg.breaker_failures, self.cfg.breaker_reset_s)
+        return b
+
+    async def _admit(self):
+        wait = self._resume_at - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.bucket.acquire()
+        await self.limiter.acquire()
+
+    async def _send(self, payload: Dict[str, Any], timeout: Optional[aiohttp.ClientTimeout] = None,
+                    read: bool = True, compress: bool = False, op: str = "") -> Any:
+        """POST `payload` through the rate limiter, concurrency limiter and circuit breaker.
+
+        429/5xx, connection errors and timeouts are retried with jittered backoff, or after
+        the server's Retry-After (which also pauses every other request). Other 4xx are
+        raised at once. With read=False the open response is returned and the caller
+        must release it and then `await self.limiter.release()`. With `compress`, bodies of
+        at least cfg.compress_min_bytes are sent gzip-encoded.
+        """
+        url = self.cfg.api_url
+        breaker = self.breaker(url)
+        body = _dumps(payload)
+        extra: Dict[str, Any] = {} if timeout is None else {"timeout": timeout}
+        if compress and 0 < self.cfg.compress_min_bytes <= len(body):
+            body = gzip.compress(body, compresslevel=6)
+            extra["headers"] = {"Content-Encoding": "gzip"}
+        m = self.metrics
         attempt = 0
-        backoff = self.cfg.retry_backoff_s
         while True:
             attempt += 1
+            breaker.before_call(url)
+            await self._admit()
+            resp, error, retry_after, handed_off = None, None, None, False
+            m.inc("michael_http_bytes_out_total", len(body), op=op)
+            started = time.perf_counter()
             try:
-                async with self._session.post(self.cfg.api_url, json=payload) as resp:
-                    resp.raise_for_status()
-                    data = await resp.json()
-                if "errors" in data:
-                    LOG.warning("GraphQL returned errors: %s", data["errors"][:1])
-                return data
-            except Exception as e:
-                if attempt > self.cfg.retries:
-                    raise
-                await asyncio.sleep(backoff)
-                backoff *= 2
-                LOG.debug("Retrying after error (%s), attempt %d", e, attempt)
+                resp = await self._session.post(url, data=body, **extra)
+                m.inc("michael_http_requests_total", op=op, status=resp.status)
+                if resp.status in _RETRY_STATUS:
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    error = aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status,
+                                                        message=resp.reason or "", headers=resp.headers)
+                else:
+                    try:
+                        resp.raise_for_status()
+                    except aiohttp.ClientResponseError:
+                        breaker.record_success()  # the endpoint is up; the request is at fault
+                        raise
+                    data = resp
+                    if read:
+                        raw = await resp.read()
+                        m.observe("michael_http_request_seconds", time.perf_counter() - started, op=op)
+                        m.inc("michael_http_bytes_in_total", len(raw), op=op)
+                        decode_started = time.perf_counter()
+                        data = _loads(raw)
+                        m.observe("michael_http_decode_seconds", time.perf_counter() - decode_started, op=op)
+                    self.limiter.on_success()
+                    breaker.record_success()
+                    handed_off = not read
+                    return data
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = e
+                if resp is None:
+                    m.inc("michael_http_requests_total", op=op, status="error")
+            finally:
+                if not handed_off:
+                    if resp is not None:
+                        resp.release()
+                    await self.limiter.release()
+
+            status = getattr(error, "status", None)
+            if status in _THROTTLE_STATUS or isinstance(error, asyncio.TimeoutError):
+                self.throttled += 1
+                self.limiter.on_throttle()
+            if status != 429:
+                breaker.record_failure()
+            if attempt > self.cfg.retries:
+                raise error
+            if retry_after is not None:
+                self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+                delay = retry_after
+            else:
+                delay = backoff_delay(attempt, self.cfg.retry_backoff_s, self.cfg.retry_backoff_max_s)
+            self.retried += 1
+            m.inc("michael_http_retries_total", op=op)
+            LOG.debug("Retrying in %.2fs after error (%s), attempt %d", delay, error, attempt)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": self.limiter.in_flight, "in_flight_limit": int(self.limiter.limit),
+                "retried": self.retried, "throttled": self.throttled,
+                "breakers": {url: b.state for url, b in self._breakers.items()}}
+
+    async def stream(self, query: str, field: str, variables: Optional[Dict[str, Any]] = None,
+                     batch_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield `data.<field>` in batches while the body is still downloading.
+
+        Peak memory is one batch plus the parser buffer, independent of response
+        size. Uses ijson when installed. Only establishing the response is retried;
+        a failure mid-stream is raised, since batches have already been handed out.
+        """
+        if not self._session:
+            raise RuntimeError("Session not initialized")
+        payload: Dict[str, Any] = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        # the body may take longer than request_timeout_s in total; bound idle reads instead
+        timeout = aiohttp.ClientTimeout(total=None, connect=self.cfg.connect_timeout_s,
+                                        sock_read=self.cfg.read_timeout_s)
+
+        op = operation(query)[1] or "query"
+        started = time.perf_counter()
+        resp = await self._send(payload, timeout, read=False, op=op)
+        try:
+            async with resp:
+                if ijson is not None:
+                    items = ijson.items(resp.content, f"data.{field}.item", use_float=True)
+                else:
+                    items = _iter_array(resp.content, field)
+                batch: List[Dict[str, Any]] = []
+                async for item in items:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+                self.metrics.observe("michael_http_request_seconds", time.perf_counter() - started, op=op)
+                self.metrics.inc("michael_http_bytes_in_total", resp.content.total_bytes, op=op)
+        finally:
+            await self.limiter.release()
+
+def _apq_error(data: Dict[str, Any]) -> Optional[str]:
+    for err in data.get("errors") or []:
+        code = (err.get("extensions") or {}).get("code") or ""
+        msg = err.get("message") or ""
+        if code == "PERSISTED_QUERY_NOT_FOUND" or msg == "PersistedQueryNotFound":
+            return "PERSISTED_QUERY_NOT_FOUND"
+        if code == "PERSISTED_QUERY_NOT_SUPPORTED" or msg == "PersistedQueryNotSupported":
+            return "PERSISTED_QUERY_NOT_SUPPORTED"
+    return None
@@ -0,0 +1,129 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import asyncio, logging, time
+from typing import Any, Callable, Dict, List, Optional
+
+LOG = logging.getLogger("michael")
+
+_STOP = object()
+
+class BatchWriter:
+    """Bounded queue between a fast producer (the websocket reader) and a store writer task.
+
+    `put` is meant to be passed as a subscription `on_item` callback. Items are
+    flushed to `save` (e.g. michaeltore.save_detections) in micro-batches of up to
+    `batch_size`, or after `flush_interval_s` when traffic is light. `save` runs in a
+    worker thread so SQLite never blocks the event loop.
+
+    When the queue is full, `policy` decides what happens:
+      block        - put() waits for room (backpressure onto the socket reader)
+      drop_newest  - the incoming item is discarded
+      drop_oldest  - the oldest queued item is discarded to make room
+    """
+
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, save: Callable[[List[Dict[str, Any]]], Any], batch_size: int = 500,
+                 flush_interval_s: float = 1.0, max_queue: int = 10000, policy: str = "block"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown drop policy {policy!r}; expected one of {self.POLICIES}")
+        self._save = save
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.policy = policy
+        self._q: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_flush_s = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth, "max_depth": self.max_depth, "enqueued": self.enqueued,
+            "dropped": self.dropped, "written": self.written, "batches": self.batches,
+            "last_flush_s": round(self.last_flush_s, 4),
+        }
+
+    async def put(self, item: Dict[str, Any]):
+        if self.policy == "block":
+            await self._q.put(item)
+        else:
+            if self._q.full():
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    return
+                self._q.get_nowait()
+            self._q.put_nowait(item)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._q.qsize())
+
+    def start(self) -> "BatchWriter":
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer task."""
+        if self._task is None:
+            return
+        await self._q.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def __aenter__(self) -> "BatchWriter":
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._save, batch)
+        except Exception:
+            LOG.exception("Batch write of %d items failed", len(batch))
+            return
+        self.last_flush_s = time.perf_counter() - started
+        self.written += len(batch)
+        self.batches += 1
+        LOG.debug("Flushed %d items in %.3fs (queue depth %d)", len(batch), self.last_flush_s, self.depth)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch: List[Dict[str, Any]] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if batch else None
+            try:
+                item = await asyncio.wait_for(self._q.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._flush(batch)
+                batch = []
+                continue
+            if item is _STOP:
+                await self._flush(batch)
+                return
+            if not batch:
+                deadline = loop.time() + self.flush_interval_s
+            batch.append(item)
+            while len(batch) < self.batch_size and not self._q.empty():
+                nxt = self._q.get_nowait()
+                if nxt is _STOP:
+                    await self._flush(batch)
+                    return
+                batch.append(nxt)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
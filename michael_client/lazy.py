@@ -0,0 +1,26 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import importlib.util, sys
+from types import ModuleType
+
+def lazy_import(name: str) -> ModuleType:
+    """`name` as a module object whose real import runs on first attribute access.
+
+    Lets modules keep `pd.`/`np.` call sites while paths that never touch them
+    (subscribe, event) skip the import cost entirely.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,320 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import asyncio, dataclasses, inspect, json, logging, math, time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from .gql import CREATE_EVENT
+from .metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from .http import MichaelHTTP
+
+LOG = logging.getLogger("michael")
+
+ANY = "*"
+Key = Tuple[str, str]  # (detection type, device id); ANY pools over that dimension
+
+class _Ring:
+    """Counts and confidence stats for the last `n` time slots. Slots are absolute indices
+    (arrival time // resolution); the ones a new slot overtakes are zeroed on the way."""
+    __slots__ = ("n", "head", "last", "count", "conf_n", "conf_sum", "conf_min", "conf_max")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.head = -1
+        self.last = -1  # newest slot written; reads move `head` too
+        self.count = [0] * n
+        self.conf_n = [0] * n
+        self.conf_sum = [0.0] * n
+        self.conf_min = [math.inf] * n
+        self.conf_max = [-math.inf] * n
+
+    def _advance(self, slot: int):
+        if slot <= self.head:
+            return
+        for s in range(max(self.head + 1, slot - self.n + 1), slot + 1):
+            i = s % self.n
+            self.count[i] = self.conf_n[i] = 0
+            self.conf_sum[i] = 0.0
+            self.conf_min[i] = math.inf
+            self.conf_max[i] = -math.inf
+        self.head = slot
+
+    def add(self, slot: int, conf: Optional[float]):
+        self._advance(slot)
+        self.last = slot
+        i = slot % self.n
+        self.count[i] += 1
+        if conf is not None:
+            self.conf_n[i] += 1
+            self.conf_sum[i] += conf
+            if conf < self.conf_min[i]:
+                self.conf_min[i] = conf
+            if conf > self.conf_max[i]:
+                self.conf_max[i] = conf
+
+    def totals(self, slot: int, k: int) -> Tuple[int, int, float, float, float]:
+        """count, conf_n, conf_sum, conf_min, conf_max over the `k` slots ending at `slot`."""
+        self._advance(slot)
+        k = max(1, min(k, self.n))
+        lo = (slot - k + 1) % self.n
+        hi = lo + k
+        arrays = (self.count, self.conf_n, self.conf_sum, self.conf_min, self.conf_max)
+        if hi <= self.n:
+            c, n, s, mn, mx = (a[lo:hi] for a in arrays)
+        else:  # the window wraps past the end of the ring
+            c, n, s, mn, mx = (a[lo:] + a[:hi - self.n] for a in arrays)
+        return sum(c), sum(n), sum(s), min(mn), max(mx)
+
+@dataclass(frozen=True)
+class Rule:
+    """An alert condition, checked whenever a matching detection arrives.
+
+    "threshold" rules fire when `metric` over the last `window_s` reaches `threshold` (or drops
+    to it, with `below`). "spike" rules fire when the window's rate is at least `factor` times
+    the rate over the rest of the preceding `baseline_s`, which needs `min_baseline` detections
+    (0 lets a quiet baseline count as an infinite spike). `detection_type`/`device_id` narrow
+    what is watched; `per_device` judges each device on its own instead of pooling them.
+    """
+    name: str
+    kind: str = "threshold"
+    metric: str = "count"
+    threshold: float = 0.0
+    below: bool = False
+    window_s: float = 60.0
+    factor: float = 3.0
+    baseline_s: float = 600.0
+    min_count: int = 1  # detections the window needs before the rule is judged at all
+    min_baseline: int = 1  # spikes: detections the baseline needs
+    detection_type: Optional[str] = None
+    device_id: Optional[str] = None
+    per_device: bool = False
+    cooldown_s: float = 60.0  # per rule and key
+
+    KINDS = ("threshold", "spike")
+    METRICS = ("count", "rate", "mean_conf", "min_conf", "max_conf")
+
+    def __post_init__(self):
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Rule {self.name!r}: kind must be one of {self.KINDS}")
+        if self.metric not in self.METRICS:
+            raise ValueError(f"Rule {self.name!r}: metric must be one of {self.METRICS}")
+        if self.window_s <= 0 or (self.kind == "spike" and self.baseline_s <= self.window_s):
+            raise ValueError(f"Rule {self.name!r}: needs 0 < window_s (< baseline_s for spikes)")
+
+    @property
+    def span_s(self) -> float:
+        return self.baseline_s if self.kind == "spike" else self.window_s
+
+@dataclass
+class Alert:
+    rule: Rule
+    key: Key
+    value: float
+    stats: Dict[str, Any]
+    item: Dict[str, Any]  # the detection that tripped the rule
+    at: float  # epoch seconds
+
+    def describe(self) -> str:
+        what = self.rule.metric if self.rule.kind == "threshold" else "rate/baseline"
+        return (f"{self.rule.name}: {what}={self.value:.3g} for type={self.key[0]} device={self.key[1]} "
+                f"({self.stats['count']} detections in {self.rule.window_s:g}s)")
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"source": "michael-client live", "rule": self.rule.name, "kind": self.rule.kind,
+                "detectionType": self.key[0], "deviceId": self.key[1],
+                "value": self.value if math.isfinite(self.value) else None,  # spikes off a zero baseline
+                "detectionId": self.item.get("id"), **{k: v for k, v in self.stats.items() if v is not None}}
+
+AlertCallback = Callable[[Alert], Union[None, Awaitable[None]]]
+
+class LiveAggregator:
+    """Sliding-window counts and confidence stats over the live detection stream, with alert
+    rules judged on arrival; pass `on_item` to michaelubs as (part of) the detection callback.
+
+    Each detection is added to ring-buffer slots of `resolution_s` under four keys, (type,
+    device), (type, ANY), (ANY, device) and (ANY, ANY), so any window up to the longest rule
+    span is a sum over a few slots. Memory is keys x span / resolution; idle keys are pruned.
+    Alert callbacks may be plain or async; async ones run as tasks so the socket keeps pumping.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = (), window_s: float = 60.0, resolution_s: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rules = list(rules)
+        names = [r.name for r in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+        self.window_s = window_s
+        self.resolution_s = resolution_s
+        self.horizon_s = max([window_s, *(r.span_s for r in self.rules)])
+        self.clock = clock
+        self.started = clock()
+        self._n = math.ceil(self.horizon_s / resolution_s) + 1  # +1: the newest slot is still filling
+        self._rings: Dict[Key, _Ring] = {}
+        self._fired: Dict[Tuple[str, Key], float] = {}
+        self._callbacks: List[AlertCallback] = []
+        self._tasks: Set[asyncio.Future] = set()
+        self.observed = 0
+        self.alerts = 0
+
+    def add_callback(self, callback: AlertCallback) -> "LiveAggregator":
+        self._callbacks.append(callback)
+        return self
+
+    def _slots(self, seconds: float) -> int:
+        return math.ceil(seconds / self.resolution_s)
+
+    def _window(self, ring: _Ring, slot: int, seconds: float) -> Dict[str, Any]:
+        count, conf_n, conf_sum, conf_min, conf_max = ring.totals(slot, self._slots(seconds))
+        return {"count": count, "rate": count / seconds,
+                "mean_conf": conf_sum / conf_n if conf_n else None,
+                "min_conf": conf_min if conf_n else None, "max_conf": conf_max if conf_n else None}
+
+    def observe(self, item: Dict[str, Any], now: Optional[float] = None) -> List[Alert]:
+        """Add one detection and return the alerts it trips (callbacks are not run here)."""
+        now = self.clock() if now is None else now
+        slot = int(now // self.resolution_s)
+        dtype, dev = str(item.get("detectionType") or ANY), str(item.get("deviceId") or ANY)
+        conf = item.get("confidence")
+        conf = float(conf) if conf is not None else None
+        for key in {(dtype, dev), (dtype, ANY), (ANY, dev), (ANY, ANY)}:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = _Ring(self._n)
+            ring.add(slot, conf)
+        self.observed += 1
+        if self.observed % 10_000 == 0:
+            self.prune(now)
+        alerts = []
+        for rule in self.rules:
+            if rule.detection_type not in (None, dtype) or rule.device_id not in (None, dev):
+                continue
+            key = (rule.detection_type or ANY, rule.device_id or (dev if rule.per_device else ANY))
+            value, stats = self._judge(rule, self._rings[key], slot, now)
+            if value is None:
+                continue
+            last = self._fired.get((rule.name, key))
+            if last is not None and now - last < rule.cooldown_s:
+                continue
+            self._fired[(rule.name, key)] = now
+            alerts.append(Alert(rule, key, value, stats, item, time.time()))
+        return alerts
+
+    def _judge(self, rule: Rule, ring: _Ring, slot: int, now: float) -> Tuple[Optional[float], Dict[str, Any]]:
+        stats = self._window(ring, slot, rule.window_s)
+        if stats["count"] < rule.min_count:
+            return None, stats
+        if rule.kind == "spike":
+            if now - self.started < rule.baseline_s:
+                return None, stats  # no baseline yet
+            before = (ring.totals(slot, self._slots(rule.baseline_s))[0] - stats["count"])
+            if before < rule.min_baseline:
+                return None, stats
+            stats["baseline_rate"] = before / (rule.baseline_s - rule.window_s)
+            value = stats["rate"] / stats["baseline_rate"] if before else math.inf
+            return (value if value >= rule.factor else None), stats
+        value = stats[rule.metric]
+        if value is None:
+            return None, stats
+        hit = value <= rule.threshold if rule.below else value >= rule.threshold
+        return (value if hit else None), stats
+
+    async def on_item(self, item: Dict[str, Any]):
+        started = time.perf_counter()
+        for alert in self.observe(item):
+            self.alerts += 1
+            REGISTRY.inc("michael_live_alerts_total", rule=alert.rule.name)
+            LOG.warning("ALERT %s", alert.describe())
+            for callback in self._callbacks:
+                try:
+                    res = callback(alert)
+                except Exception as e:
+                    LOG.error("Alert callback failed for %s: %s", alert.rule.name, e)
+                    continue
+                if inspect.isawaitable(res):
+                    task = asyncio.ensure_future(res)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._task_done)
+        REGISTRY.observe("michael_live_eval_seconds", time.perf_counter() - started)
+
+    def _task_done(self, task: asyncio.Future):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOG.error("Alert callback failed: %s", task.exception())
+
+    async def drain(self):
+        """Wait for alert callbacks still in flight."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def prune(self, now: Optional[float] = None):
+        """Forget keys with no detections inside the horizon."""
+        now = self.clock() if now is None else now
+        slot = int(now // self.resolution_s)
+        for key in [k for k, r in self._rings.items() if r.last <= slot - self._n]:
+            del self._rings[key]
+        cooldown = max((r.cooldown_s for r in self.rules), default=0.0)
+        self._fired = {k: t for k, t in self._fired.items() if now - t < cooldown}
+
+    def stats(self, detection_type: Optional[str] = None, device_id: Optional[str] = None,
+              window_s: Optional[float] = None, now: Optional[float] = None) -> Dict[str, Any]:
+        """count, rate and confidence mean/min/max over the last `window_s` (default: window_s)."""
+        ring = self._rings.get((detection_type or ANY, device_id or ANY))
+        window_s = min(window_s or self.window_s, self.horizon_s)
+        if ring is None:
+            return {"count": 0, "rate": 0.0, "mean_conf": None, "min_conf": None, "max_conf": None}
+        slot = int((self.clock() if now is None else now) // self.resolution_s)
+        return self._window(ring, slot, window_s)
+
+    def snapshot(self, window_s: Optional[float] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Stats for every active key over the last `window_s`, busiest first."""
+        rows = [{"detection_type": t, "device_id": d, **self.stats(t, d, window_s, now)} for t, d in list(self._rings)]
+        return sorted((r for r in rows if r["count"]), key=lambda r: -r["count"])
+
+class EventAlerter:
+    """Alert callback that records each alert on the server as a `createEvent` mutation."""
+
+    def __init__(self, http: "MichaelHTTP", event_type: str = "ANOMALY_DETECTED"):
+        self.http = http
+        self.event_type = event_type
+        self.created = 0
+
+    async def __call__(self, alert: Alert):
+        payload = {
+            "name": f"Live alert: {alert.rule.name}",
+            "type": self.event_type,
+            "timestamp": datetime.fromtimestamp(alert.at, timezone.utc).isoformat(),
+            "deviceId": alert.item.get("deviceId"),
+            "location": alert.item.get("location"),
+            "metadata": alert.metadata(),
+        }
+        res = await self.http.execute(CREATE_EVENT, {"input": payload})
+        evt = (res.get("data") or {}).get("createEvent")
+        if not evt:
+            LOG.error("Alert event for %s was not created: %s", alert.rule.name, res.get("errors") or res)
+            return
+        self.created += 1
+        LOG.info("Created event id=%s for alert %s", evt.get("id"), alert.rule.name)
+
+_RULE_FIELDS = {f.name for f in dataclasses.fields(Rule)}
+
+def load_rules(path: str) -> List[Rule]:
+    """Read alert rules from a JSON list of Rule fields, e.g.
+    [{"name": "person-burst", "detection_type": "PERSON", "threshold": 20, "window_s": 10}]."""
+    with open(path, encoding="utf-8") as fh:
+        doc = json.load(fh)
+    if not isinstance(doc, list):
+        raise ValueError(f"{path}: expected a list of rules")
+    rules = []
+    for i, entry in enumerate(doc):
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise ValueError(f"{path}: rule #{i} needs a name")
+        unknown = set(entry) - _RULE_FIELDS
+        if unknown:
+            raise ValueError(f"{path}: rule {entry['name']!r} has unknown keys {sorted(unknown)}")
+        rules.append(Rule(**entry))
+    return rules
@@ -0,0 +1,268 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import bisect, json, logging, os, threading, time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LOG = logging.getLogger("michael")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# upper bounds: seconds for durations, rows for batch sizes
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def _label_str(labels: Labels) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+def _series(name: str, labels: Labels) -> str:
+    return f"{name}{{{_label_str(labels)}}}" if labels else name
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def quantile(bounds: Sequence[float], counts: Sequence[int], q: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-th observation (Prometheus-style estimate)."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank, seen = q * total, 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= rank:
+            return bounds[i] if i < len(bounds) else float("inf")
+    return float("inf")
+
+class MetricsRegistry:
+    """Process-wide counters and fixed-bucket histograms, keyed by name and labels.
+
+    Cheap enough to update on every request, row batch and subscription message;
+    safe to update from the store's worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._hists: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self.started = time.time()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            series = self._hists.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram(buckets)
+            h.observe(value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._hists.clear()
+            self.started = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed_s": time.time() - self.started,
+                "counters": {name: [{"labels": dict(k), "value": v} for k, v in series.items()]
+                             for name, series in self._counters.items()},
+                "histograms": {name: [{"labels": dict(k), "bounds": list(h.bounds), "counts": list(h.counts),
+                                       "sum": h.sum, "count": h.count} for k, h in series.items()]
+                               for name, series in self._hists.items()},
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """Add another registry's snapshot (e.g. from a worker process) into this one."""
+        with self._lock:
+            for name, series in snapshot.get("counters", {}).items():
+                target = self._counters.setdefault(name, {})
+                for s in series:
+                    key = _labels(s["labels"])
+                    target[key] = target.get(key, 0.0) + s["value"]
+            for name, series in snapshot.get("histograms", {}).items():
+                target = self._hists.setdefault(name, {})
+                for s in series:
+                    key = _labels(s["labels"])
+                    h = target.get(key)
+                    if h is None:
+                        h = target[key] = _Histogram(s["bounds"])
+                    h.counts = [a + b for a, b in zip(h.counts, s["counts"])]
+                    h.sum += s["sum"]
+                    h.count += s["count"]
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (for node_exporter's textfile collector)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{_series(name, key)} {_num(value)}")
+            for name, series in sorted(self._hists.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    prefix = _label_str(key) + "," if key else ""
+                    cum = 0
+                    for bound, c in zip(h.bounds + (float("inf"),), h.counts):
+                        cum += c
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cum}')
+                    lines.append(f"{_series(name + '_sum', key)} {_num(h.sum)}")
+                    lines.append(f"{_series(name + '_count', key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        _atomic_write(path, self.prometheus())
+
+    def write_json(self, path: str):
+        _atomic_write(path, json.dumps(self.snapshot(), indent=1))
+
+def _atomic_write(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+def summarize(snapshot: Dict[str, Any]) -> List[str]:
+    """Human-readable lines for a snapshot: counter totals and rates, histogram count/mean/p50/p95/p99."""
+    elapsed = max(snapshot.get("elapsed_s") or 0.0, 1e-9)
+    lines = [f"window: {elapsed:.1f}s since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['started']))}"]
+    for name, series in sorted(snapshot.get("counters", {}).items()):
+        for s in series:
+            lines.append(f"{_series(name, _labels(s['labels']))}  {s['value']:,.0f}  ({s['value'] / elapsed:,.1f}/s)")
+    for name, series in sorted(snapshot.get("histograms", {}).items()):
+        for s in series:
+            n = s["count"]
+            if not n:
+                continue
+            q = [quantile(s["bounds"], s["counts"], p) for p in (0.5, 0.95, 0.99)]
+            lines.append(f"{_series(name, _labels(s['labels']))}  n={n:,} mean={s['sum'] / n:.4g} "
+                         f"p50<={q[0]:g} p95<={q[1]:g} p99<={q[2]:g}")
+    return lines
+
+class TextfileExporter:
+    """Rewrites a Prometheus textfile every `interval_s` from a background thread, and once more on stop."""
+
+    def __init__(self, registry: "MetricsRegistry", path: str, interval_s: float = 15.0):
+        self.registry = registry
+        self.path = path
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "TextfileExporter":
+        self._thread = threading.Thread(target=self._loop, name="michael-metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.registry.write_textfile(self.path)
+            except OSError as e:
+                LOG.warning("Could not write metrics textfile %s: %s", self.path, e)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.write_textfile(self.path)
+
+@contextmanager
+def profiled(mode: str, out: str = "", top: int = 25) -> Iterator[None]:
+    """Run the body under cProfile ("cpu") or tracemalloc ("mem") and log the top entries.
+
+    With `out`, the cProfile stats are dumped there (open with snakeviz/pstats) or the
+    tracemalloc snapshot is written for later comparison.
+    """
+    if mode == "cpu":
+        import cProfile, io, pstats
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            buf = io.StringIO()
+            pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(top)
+            LOG.info("CPU profile (top %d by cumulative time):\n%s", top, buf.getvalue())
+            if out:
+                prof.dump_stats(out)
+    elif mode == "mem":
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snap = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = snap.statistics("lineno")[:top]
+            LOG.info("Python heap: current %.1f MiB, peak %.1f MiB; top allocations:\n%s",
+                     current / 2**20, peak / 2**20, "\n".join(str(s) for s in stats))
+            if out:
+                snap.dump(out)
+    else:
+        yield
+
+REGISTRY = MetricsRegistry()
+for _name, _text in (
+    ("michael_http_requests_total", "GraphQL POSTs by operation and HTTP status"),
+    ("michael_http_request_seconds", "Time to first byte plus body read per POST"),
+    ("michael_http_decode_seconds", "JSON decoding time per response"),
+    ("michael_http_retries_total", "Retried POSTs by operation"),
+    ("michael_http_bytes_out_total", "Request body bytes sent"),
+    ("michael_http_bytes_in_total", "Response body bytes received"),
+    ("michael_sub_messages_total", "Subscription items delivered to callbacks"),
+    ("michael_sub_duplicates_total", "Subscription items dropped as already seen"),
+    ("michael_sub_callback_seconds", "Time spent in subscription callbacks"),
+    ("michael_sub_reconnects_total", "Subscription socket reconnects"),
+    ("michael_store_rows_total", "Rows written per table"),
+    ("michael_store_batch_rows", "Rows per save call"),
+    ("michael_store_write_seconds", "Duration of each save call, including row conversion"),
+    ("michael_store_commit_seconds", "Duration of each COMMIT"),
+    ("michael_store_expired_rows_total", "Rows removed by retention"),
+    ("michael_live_alerts_total", "Live alert rules fired"),
+    ("michael_live_eval_seconds", "Window update and rule evaluation per live detection"),
+):
+    REGISTRY.describe(_name, _text)
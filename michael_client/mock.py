@@ -0,0 +1,301 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import argparse, asyncio, bisect, json, logging, random, time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from aiohttp import WSMsgType, web
+from .config import MichaelConfig
+from .schema import root_fields
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+LOG = logging.getLogger("michael")
+
+DETECTION_TYPES = ("person", "car", "truck", "bicycle", "animal")
+
+_SCHEMA = {"types": [
+    {"name": "Query", "kind": "OBJECT", "description": None,
+     "fields": [{"name": n, "type": {"name": None, "kind": "LIST"}, "description": None}
+                for n in ("devices", "device", "tracks", "detections")]},
+    {"name": "Mutation", "kind": "OBJECT", "description": None,
+     "fields": [{"name": "createEvent", "type": {"name": "Event", "kind": "OBJECT"}, "description": None}]},
+    {"name": "Subscription", "kind": "OBJECT", "description": None,
+     "fields": [{"name": "detectionCreated", "type": {"name": "Detection", "kind": "OBJECT"}, "description": None}]},
+]}
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _epoch(value: Optional[str], default: float) -> float:
+    if not value:
+        return default
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+class Dataset:
+    """Deterministic synthetic devices, tracks and detections spread over the last `hours`.
+
+    Items are kept pre-serialized and sorted by time so the server spends its time
+    on I/O, not on building responses.
+    """
+
+    def __init__(self, devices: int = 50, tracks: int = 1000, points_per_track: int = 50,
+                 detections: int = 50_000, hours: float = 24.0, seed: int = 7):
+        rng = random.Random(seed)
+        end = time.time()
+        start = end - hours * 3600
+        centers = [(40.0 + rng.uniform(-0.5, 0.5), -74.0 + rng.uniform(-0.5, 0.5)) for _ in range(devices)]
+
+        self.devices = [_dumps({
+            "id": f"dev-{i}", "name": f"Device {i}", "type": "CAMERA", "status": "ONLINE",
+            "location": {"latitude": lat, "longitude": lon, "altitude": 10.0},
+            "lastSeen": _iso(end), "batteryLevel": rng.randint(5, 100), "firmwareVersion": "1.0.0",
+            "metadata": {"site": f"site-{i % 7}"}, "tags": ["bench"],
+        }) for i, (lat, lon) in enumerate(centers)]
+
+        track_ts = sorted(rng.uniform(start, end - points_per_track * 5) for _ in range(tracks))
+        self.track_ts, self.track_dev, self.tracks = track_ts, [], []
+        for i, t0 in enumerate(track_ts):
+            dev = rng.randrange(devices)
+            lat, lon = centers[dev]
+            points = []
+            for j in range(points_per_track):
+                lat += rng.uniform(-1e-4, 1e-4)
+                lon += rng.uniform(-1e-4, 1e-4)
+                points.append({"timestamp": _iso(t0 + j * 5),
+                               "location": {"latitude": lat, "longitude": lon, "altitude": 10.0},
+                               "speed": rng.uniform(0, 3), "heading": rng.uniform(0, 360)})
+            self.track_dev.append(f"dev-{dev}")
+            self.tracks.append(_dumps({
+                "id": f"trk-{i}", "deviceId": f"dev-{dev}", "startTime": _iso(t0),
+                "endTime": _iso(t0 + (points_per_track - 1) * 5), "totalDistance": 0.0,
+                "averageSpeed": 1.5, "maxSpeed": 3.0, "points": points, "metadata": {},
+            }))
+
+        det_ts = sorted(rng.uniform(start, end) for _ in range(detections))
+        self.det_ts, self.det_dev, self.det_conf, self.detections = det_ts, [], [], []
+        for i, ts in enumerate(det_ts):
+            dev = rng.randrange(devices)
+            lat, lon = centers[dev]
+            conf = round(rng.uniform(0.3, 1.0), 3)
+            self.det_dev.append(f"dev-{dev}")
+            self.det_conf.append(conf)
+            self.detections.append(_dumps({
+                "id": f"det-{i}", "deviceId": f"dev-{dev}", "timestamp": _iso(ts),
+                "detectionType": DETECTION_TYPES[i % len(DETECTION_TYPES)], "confidence": conf,
+                "location": {"latitude": lat + rng.uniform(-0.01, 0.01),
+                             "longitude": lon + rng.uniform(-0.01, 0.01), "altitude": 10.0},
+                "boundingBox": {"x": 0.1, "y": 0.2, "width": 0.3, "height": 0.4},
+                "metadata": {}, "associatedTrack": None,
+            }))
+
+    def window(self, times: List[float], lo: float, hi: float) -> range:
+        return range(bisect.bisect_left(times, lo), bisect.bisect_right(times, hi))
+
+class MockMichaelServer:
+    """Local stand-in for the Michael API on one URL: GraphQL over POST and graphql-transport-ws.
+
+    Serves GET_DEVICES (offset paging), GET_TRACKS/GET_DETECTIONS (time windows
+    with `limit`), CREATE_EVENT and introspection, and honours persisted-query
+    hashes. Each SUB_DETECTIONS operation receives `sub_count` detections at
+    `sub_rate` per second, then `complete`; every message carries its send time
+    in metadata.sentAt so clients can measure end-to-end latency. `latency_ms`
+    delays every POST and `fail_rate` answers that share of them with 503.
+    """
+
+    def __init__(self, dataset: Optional[Dataset] = None, host: str = "127.0.0.1", port: int = 0,
+                 sub_rate: float = 1000.0, sub_count: int = 10_000, latency_ms: float = 0.0,
+                 fail_rate: float = 0.0):
+        self.data = dataset or Dataset()
+        self.host = host
+        self.port = port
+        self.sub_rate = sub_rate
+        self.sub_count = sub_count
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self._persisted: Dict[str, str] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._rng = random.Random(0)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/graphql"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.host}:{self.port}/graphql"
+
+    def config(self, **overrides: Any) -> MichaelConfig:
+        return MichaelConfig(**{"api_url": self.url, "ws_url": self.ws_url,
+                                "token_id": "mock", "token_value": "mock", **overrides})
+
+    async def start(self) -> "MockMichaelServer":
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_get("/graphql", self._ws)
+        app.router.add_post("/graphql", self._post)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "MockMichaelServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    @staticmethod
+    def _list(field: str, items: List[bytes]) -> web.Response:
+        body = b'{"data":{"' + field.encode() + b'":[' + b",".join(items) + b"]}}"
+        return web.Response(body=body, content_type="application/json")
+
+    async def _post(self, req: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            return web.Response(status=503)
+        body = await req.json()
+        query, v = body.get("query"), body.get("variables") or {}
+        pq = (body.get("extensions") or {}).get("persistedQuery")
+        if pq:
+            if query:
+                self._persisted[pq["sha256Hash"]] = query
+            else:
+                query = self._persisted.get(pq["sha256Hash"])
+                if query is None:
+                    return web.json_response({"errors": [{"message": "PersistedQueryNotFound",
+                                                          "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+        fields = root_fields(query or "")
+        field = fields[0] if fields else ""
+        d = self.data
+        now = time.time()
+        if field == "__schema":
+            return web.json_response({"data": {"__schema": _SCHEMA}})
+        if field == "devices":
+            offset, limit = int(v.get("offset") or 0), int(v.get("limit") or len(d.devices))
+            return self._list(field, d.devices[offset:offset + limit])
+        if field in ("tracks", "detections"):
+            times = d.track_ts if field == "tracks" else d.det_ts
+            rows = d.window(times, _epoch(v.get("startTime"), 0.0), _epoch(v.get("endTime"), now))
+            devs = d.track_dev if field == "tracks" else d.det_dev
+            device, min_conf = v.get("deviceId"), v.get("minConfidence")
+            limit = int(v.get("limit") or len(rows))
+            items = d.tracks if field == "tracks" else d.detections
+            out = []
+            for i in rows:
+                if device is not None and devs[i] != device:
+                    continue
+                if field == "detections" and min_conf is not None and d.det_conf[i] < min_conf:
+                    continue
+                out.append(items[i])
+                if len(out) >= limit:
+                    break
+            return self._list(field, out)
+        if field == "createEvent":
+            evt = dict(v.get("input") or {}, id=f"evt-{self.requests}", createdAt=_iso(now), updatedAt=_iso(now))
+            return web.json_response({"data": {"createEvent": evt}})
+        return web.json_response({"errors": [{"message": f"Unknown field {field!r}"}]})
+
+    async def _ws(self, req: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(protocols=("graphql-transport-ws",))
+        await ws.prepare(req)
+        tasks: Dict[str, asyncio.Task] = {}
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                evt = json.loads(msg.data)
+                typ = evt.get("type")
+                if typ == "connection_init":
+                    await ws.send_str('{"type":"connection_ack"}')
+                elif typ == "ping":
+                    await ws.send_str('{"type":"pong"}')
+                elif typ == "subscribe":
+                    op_id = evt["id"]
+                    variables = (evt.get("payload") or {}).get("variables") or {}
+                    tasks[op_id] = asyncio.create_task(self._emit(ws, op_id, variables))
+                elif typ == "complete":
+                    task = tasks.pop(evt.get("id"), None)
+                    if task is not None:
+                        task.cancel()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return ws
+
+    async def _emit(self, ws: web.WebSocketResponse, op_id: str, variables: Dict[str, Any]):
+        rng = random.Random(op_id)
+        min_conf = float(variables.get("minConfidence") or 0.0)
+        dtype = variables.get("detectionType")
+        device = variables.get("deviceId")
+        sent, t0 = 0, time.perf_counter()
+        while sent < self.sub_count and not ws.closed:
+            due = min(self.sub_count, int((time.perf_counter() - t0) * self.sub_rate) + 1)
+            while sent < due:
+                now = time.time()
+                item = {
+                    "id": f"live-{op_id}-{sent}", "deviceId": device or f"dev-{sent % 50}",
+                    "timestamp": _iso(now), "detectionType": dtype or DETECTION_TYPES[sent % len(DETECTION_TYPES)],
+                    "confidence": round(min_conf + (1 - min_conf) * rng.random(), 3),
+                    "location": {"latitude": 40 + rng.uniform(-0.5, 0.5),
+                                 "longitude": -74 + rng.uniform(-0.5, 0.5), "altitude": 10.0},
+                    "metadata": {"sentAt": now},
+                }
+                await ws.send_str(_dumps({"id": op_id, "type": "next",
+                                          "payload": {"data": {"detectionCreated": item}}}).decode())
+                sent += 1
+            await asyncio.sleep(max(0.0, t0 + sent / self.sub_rate - time.perf_counter()))
+        if not ws.closed:
+            await ws.send_str(json.dumps({"id": op_id, "type": "complete"}))
+
+def _parse_cli(argv=None):
+    p = argparse.ArgumentParser(description="Local stand-in for the Michael GraphQL API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--devices", type=int, default=50)
+    p.add_argument("--tracks", type=int, default=1000)
+    p.add_argument("--points", type=int, default=50, help="Points per track")
+    p.add_argument("--detections", type=int, default=50_000)
+    p.add_argument("--hours", type=float, default=24.0, help="Time span the data covers (ending now)")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--sub-rate", type=float, default=1000.0, help="Subscription messages per second")
+    p.add_argument("--sub-count", type=int, default=10_000, help="Messages per subscription before complete")
+    p.add_argument("--latency-ms", type=float, default=0.0)
+    p.add_argument("--fail-rate", type=float, default=0.0, help="Share of POSTs answered with 503")
+    return p.parse_args(argv)
+
+async def serve(args) -> None:
+    data = Dataset(args.devices, args.tracks, args.points, args.detections, args.hours, args.seed)
+    server = MockMichaelServer(data, args.host, args.port, args.sub_rate, args.sub_count,
+                               args.latency_ms, args.fail_rate)
+    await server.start()
+    print(f"listening {server.url}", flush=True)  # read by the benchmark harness
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(_parse_cli(argv)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import hashlib, json, logging, os, re, time
+from typing import Any, Dict, List, Optional
+from .config import MichaelConfig
+from .gql import INTROSPECTION, operation
+
+LOG = logging.getLogger("michael")
+
+_ROOT_TYPES = {"query": "Query", "mutation": "Mutation", "subscription": "Subscription"}
+_UNAVAILABLE = "unavailable"  # cache entry recording that the server refused introspection
+_STRINGS = re.compile(r'"""[\s\S]*?"""|"(?:\\.|[^"\\])*"|#[^\n]*')
+
+def _default_path(cfg: MichaelConfig) -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    digest = hashlib.sha1(cfg.api_url.encode()).hexdigest()[:12]
+    return os.path.join(base, "michael-client", f"schema-{digest}.json")
+
+def root_fields(query: str) -> List[str]:
+    """Top-level field names selected by a GraphQL document (aliases resolved)."""
+    text = _STRINGS.sub("", query)
+    names: List[str] = []
+    depth = parens = 0
+    skip = False  # next name belongs to a fragment spread or directive, not a field
+    for tok in re.finditer(r"\.\.\.|@|[A-Za-z_]\w*|[{}():]", text):
+        t = tok.group()
+        if t == "{":
+            depth += 1
+        elif t == "}":
+            depth -= 1
+        elif t == "(":
+            parens += 1
+        elif t == ")":
+            parens -= 1
+        elif depth != 1 or parens:
+            continue
+        elif t in ("...", "@"):
+            skip = True
+        elif t == ":":
+            if names:
+                names.pop()  # alias; the real field name follows
+        elif skip:
+            skip = t == "on"
+        else:
+            names.append(t)
+    return names
+
+class SchemaCache:
+    """Introspection result cached on disk for `ttl_s`, used to check query documents locally."""
+
+    def __init__(self, cfg: MichaelConfig, path: Optional[str] = None, ttl_s: Optional[float] = None):
+        self.cfg = cfg
+        self.path = path or cfg.schema_cache_path or _default_path(cfg)
+        self.ttl_s = cfg.schema_cache_ttl_s if ttl_s is None else ttl_s
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.ttl_s:
+                return None
+            with open(self.path, encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, schema: Dict[str, Any]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"  # shard workers may share one cache file
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(schema, fh)
+        os.replace(tmp, self.path)
+
+    async def get(self, http, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """The cached or freshly introspected schema; None if the server refuses introspection."""
+        schema = None if refresh else self.load()
+        if schema is not None:
+            LOG.debug("Using cached schema %s", self.path)
+            return None if schema.get(_UNAVAILABLE) else schema
+        LOG.info("Introspecting schema…")
+        res = await http.execute(INTROSPECTION)
+        schema = (res.get("data") or {}).get("__schema")
+        if not schema:
+            # cached too, so runs within the TTL don't resend the introspection query
+            LOG.warning("Introspection unavailable, skipping query checks: %s", res.get("errors"))
+            self.save({_UNAVAILABLE: True})
+            return None
+        self.save(schema)
+        return schema
+
+    @staticmethod
+    def validate(schema: Dict[str, Any], query: str) -> List[str]:
+        """Problems found checking the document's root fields against the schema; [] if none."""
+        root = _ROOT_TYPES[operation(query)[0]]
+        types = {t.get("name"): t for t in schema.get("types") or []}
+        if root not in types:
+            return [f"schema has no {root} type"]
+        known = {f.get("name") for f in types[root].get("fields") or []}
+        return [f"unknown {root} field {name!r}" for name in root_fields(query)
+                if name not in known and not name.startswith("__")]
@@ -0,0 +1,120 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import asyncio, dataclasses, json, logging, multiprocessing, os, re, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+from .config import MichaelConfig
+from .metrics import REGISTRY
+from .store import michaeltore
+
+LOG = logging.getLogger("michael")
+
+_CONFIG_FIELDS = {f.name for f in dataclasses.fields(MichaelConfig)}
+_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+@dataclass(frozen=True)
+class ShardJob:
+    name: str
+    cfg: MichaelConfig
+    db: str
+    hours: int
+
+def load_manifest(path: str, base: MichaelConfig, shard_dir: str, hours: int = 24) -> List[ShardJob]:
+    """Read a fetch-all manifest: a JSON list of tenants, or {"defaults": {...}, "tenants": [...]}.
+
+    Each tenant needs a unique `name` (also its shard file name) and may set `db`, `hours`
+    and any MichaelConfig field (token_id, token_value, api_url, rate_limit_rps, ...).
+    """
+    with open(path, encoding="utf-8") as fh:
+        doc = json.load(fh)
+    defaults: Dict[str, Any] = {}
+    if isinstance(doc, dict):
+        defaults, doc = doc.get("defaults") or {}, doc.get("tenants")
+    if not isinstance(doc, list) or not doc:
+        raise ValueError(f"{path}: expected a non-empty list of tenants")
+    jobs, names = [], set()
+    for i, entry in enumerate(doc):
+        entry = {**defaults, **entry}
+        name = str(entry.pop("name", ""))
+        if not _NAME.match(name):
+            raise ValueError(f"{path}: tenant #{i} needs a name made of letters, digits, '.', '_' or '-'")
+        if name in names:
+            raise ValueError(f"{path}: duplicate tenant name {name!r}")
+        names.add(name)
+        db = entry.pop("db", "") or os.path.join(shard_dir, f"{name}.db")
+        tenant_hours = int(entry.pop("hours", hours))
+        unknown = set(entry) - _CONFIG_FIELDS
+        if unknown:
+            raise ValueError(f"{path}: tenant {name!r} has unknown keys {sorted(unknown)}")
+        entry.setdefault("schema_cache_path", os.path.join(shard_dir, f"{name}.schema.json"))
+        jobs.append(ShardJob(name, dataclasses.replace(base, **entry), db, tenant_hours))
+    return jobs
+
+def fetch_shard(job: ShardJob, incremental: bool = False, refresh_schema: bool = False,
+                stream: bool = False, chunk_size: int = 5000, compact_points: bool = False) -> Dict[str, Any]:
+    """Run one tenant's fetch into its own shard DB; meant to execute in a pool worker.
+
+    Never raises: failures are reported in the result so one tenant cannot sink the others.
+    """
+    from .cli import fetch_everything
+    for h in LOG.handlers:
+        h.setFormatter(logging.Formatter(f"[%(levelname)s] {job.name}: %(message)s"))
+    REGISTRY.reset()  # pool processes are reused across jobs
+    os.makedirs(os.path.dirname(os.path.abspath(job.db)), exist_ok=True)
+    started = time.perf_counter()
+    error = None
+    try:
+        with michaeltore(job.db, chunk_size=chunk_size, compact_points=compact_points) as store:
+            asyncio.run(fetch_everything(job.cfg, store, hours=job.hours, incremental=incremental,
+                                         refresh_schema=refresh_schema, stream=stream))
+    except Exception as e:
+        LOG.error("Fetch failed: %s", e)
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "name": job.name, "db": job.db, "error": error,
+        "seconds": time.perf_counter() - started,
+        "rows": {t: int(REGISTRY.counter("michael_store_rows_total", table=t))
+                 for t in ("devices", "tracks", "track_points", "detections")},
+        "metrics": REGISTRY.snapshot(),
+    }
+
+def fetch_all(jobs: Sequence[ShardJob], workers: int = 0, **opts: Any) -> List[Dict[str, Any]]:
+    """Fan `jobs` out over a process pool (one event loop and SQLite writer per process).
+
+    Worker metrics are folded into this process's REGISTRY. Results come back in completion order.
+    """
+    workers = min(len(jobs), workers or os.cpu_count() or 1)
+    LOG.info("Fetching %d tenant(s) with %d worker process(es)…", len(jobs), workers)
+    results = []
+    # spawn, not fork: children must not inherit the parent's event loop, threads or SQLite handles
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(fetch_shard, job, **opts): job for job in jobs}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:  # the worker died (OOM, segfault: BrokenProcessPool), not the fetch
+                res = {"name": job.name, "db": job.db, "error": f"{type(e).__name__}: {e}",
+                       "seconds": 0.0, "rows": {}, "metrics": {}}
+            REGISTRY.merge(res.pop("metrics"))
+            results.append(res)
+            if res["error"]:
+                LOG.error("%s failed after %.1fs: %s", res["name"], res["seconds"], res["error"])
+            else:
+                LOG.info("%s done in %.1fs: %s", res["name"], res["seconds"],
+                         ", ".join(f"{k}={v}" for k, v in res["rows"].items()))
+    return results
+
+def merge_shards(store: michaeltore, paths: Sequence[str]) -> Dict[str, int]:
+    """Merge shard DBs into `store` one at a time; returns rows changed per table."""
+    totals: Dict[str, int] = {}
+    for path in paths:
+        counts = store.merge_from(path)
+        LOG.info("Merged %s: %s", path, ", ".join(f"{k}={v}" for k, v in counts.items()))
+        for table, n in counts.items():
+            totals[table] = totals.get(table, 0) + n
+    return totals
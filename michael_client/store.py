@@ -4,18 +4,562 @@ Created by Michael Wilson, Senior Software Engineer
 """
 
 from __future__ import annotations
-import json, sqlite3
-from typing import Any, Dict, Iterable
-import pandas as pd
+import json, logging, os, re, sqlite3, threading, time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .lazy import lazy_import
+from .geo import bbox_around, haversine_m
+from .metrics import REGISTRY, SIZE_BUCKETS
+
+LOG = logging.getLogger("michael")
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")  # loaded on first use: detection/event writes never need either
+
+@dataclass(frozen=True)
+class IngestStats:
+    table: str
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+def _chunks(rows: Iterable[Tuple], size: int) -> Iterator[List[Tuple]]:
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def newest_marks(items: Iterable[Dict[str, Any]], *ts_keys: str,
+                 into: Optional[Dict[str, datetime]] = None) -> Dict[str, datetime]:
+    """Newest timestamp per deviceId ('' = across all devices), folded into `into` if given."""
+    marks = {} if into is None else into
+    for it in items:
+        ts = next((_parse_ts(it.get(k)) for k in ts_keys if it.get(k)), None)
+        if ts is None:
+            continue
+        for dev in ("", it.get("deviceId") or ""):
+            if dev not in marks or ts > marks[dev]:
+                marks[dev] = ts
+    return marks
+
+def _device_row(d: Dict[str, Any]) -> Tuple:
+    loc = d.get("location") or {}
+    return (
+        d.get("id"), d.get("name"), d.get("type"), d.get("status"),
+        loc.get("latitude"), loc.get("longitude"), loc.get("altitude"),
+        d.get("lastSeen"), d.get("batteryLevel"), d.get("firmwareVersion"),
+        json.dumps(d.get("metadata") or {})
+    )
+
+def _track_row(t: Dict[str, Any]) -> Tuple:
+    return (
+        t.get("id"), t.get("deviceId"), t.get("startTime"), t.get("endTime"),
+        t.get("totalDistance"), t.get("averageSpeed"), t.get("maxSpeed"),
+        json.dumps(t.get("metadata") or {}),
+    )
+
+def _point_rows(t: Dict[str, Any]) -> Iterator[Tuple]:
+    for p in (t.get("points") or []):
+        loc = p.get("location") or {}
+        yield (
+            t.get("id"), p.get("timestamp"), loc.get("latitude"),
+            loc.get("longitude"), loc.get("altitude"),
+            p.get("speed"), p.get("heading")
+        )
+
+def _epoch_s(values: pd.Series) -> np.ndarray:
+    """ISO-8601 strings to float epoch seconds, parsed in bulk by pandas."""
+    parsed = pd.to_datetime(values, utc=True, format="ISO8601")
+    return ((parsed - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype="f8")
+
+# packed float64 columns of a track_blobs row; "ts" is epoch seconds, missing values are NaN
+_BLOB_COLS = ("ts", "latitude", "longitude", "altitude", "speed", "heading")
+
+def _f64(value: Any) -> float:
+    return float("nan") if value is None else float(value)
+
+def _pack(columns: Dict[str, Any]) -> Tuple[bytes, ...]:
+    return tuple(np.asarray(columns[c], dtype="<f8").tobytes() for c in _BLOB_COLS)
+
+def _unpack(blobs: Iterable[bytes]) -> Dict[str, np.ndarray]:
+    return {c: np.frombuffer(b, dtype="<f8") for c, b in zip(_BLOB_COLS, blobs)}
+
+def _detection_row(det: Dict[str, Any]) -> Tuple:
+    loc = det.get("location") or {}
+    bb = det.get("boundingBox") or {}
+    return (
+        det.get("id"), det.get("deviceId"), det.get("timestamp"),
+        det.get("detectionType"), det.get("confidence"),
+        loc.get("latitude"), loc.get("longitude"), loc.get("altitude"),
+        bb.get("x"), bb.get("y"), bb.get("width"), bb.get("height"),
+        json.dumps(det.get("metadata") or {})
+    )
+
+_TRACK_POINTS_DDL = """
+  CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    track_id TEXT,
+    timestamp TEXT,
+    latitude REAL, longitude REAL, altitude REAL,
+    speed REAL, heading REAL,
+    UNIQUE (track_id, timestamp),
+    FOREIGN KEY (track_id) REFERENCES tracks(id)
+  )
+"""
+
+_DETECTIONS_DDL = """
+  CREATE TABLE IF NOT EXISTS detections (
+    id TEXT PRIMARY KEY,
+    device_id TEXT,
+    timestamp TEXT,
+    detection_type TEXT,
+    confidence REAL,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    bbox_x REAL, bbox_y REAL, bbox_width REAL, bbox_height REAL,
+    metadata TEXT,
+    created_at TEXT DEFAULT (datetime('now')),
+    FOREIGN KEY (device_id) REFERENCES devices(id)
+  )
+"""
+
+_DETECTION_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_det_time ON detections(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_det_type ON detections(detection_type)",
+    "CREATE INDEX IF NOT EXISTS idx_det_device ON detections(device_id)",
+)
+
+# Pre-aggregated detection counts/confidence per time bucket × type × device, kept current by
+# trg_det_rollup inside the inserting transaction. NULL type/device are stored as '' so they key.
+_ROLLUP_BUCKETS = {
+    "detection_rollup_day": "date({ts})",
+    "detection_rollup_hour": "strftime('%Y-%m-%dT%H:00:00', {ts})",
+}
+
+_ROLLUP_DDL = """
+  CREATE TABLE IF NOT EXISTS {table} (
+    bucket TEXT NOT NULL,
+    detection_type TEXT NOT NULL DEFAULT '',
+    device_id TEXT NOT NULL DEFAULT '',
+    n INTEGER NOT NULL,
+    conf_n INTEGER NOT NULL,
+    conf_sum REAL NOT NULL,
+    conf_min REAL,
+    conf_max REAL,
+    PRIMARY KEY (bucket, detection_type, device_id)
+  ) WITHOUT ROWID
+"""
+
+_ROLLUP_UPSERT = """
+  ON CONFLICT(bucket, detection_type, device_id) DO UPDATE SET
+    n=n + excluded.n,
+    conf_n=conf_n + excluded.conf_n,
+    conf_sum=conf_sum + excluded.conf_sum,
+    conf_min=MIN(COALESCE(conf_min, excluded.conf_min), COALESCE(excluded.conf_min, conf_min)),
+    conf_max=MAX(COALESCE(conf_max, excluded.conf_max), COALESCE(excluded.conf_max, conf_max))
+"""
+
+def _rollup_trigger() -> str:
+    body = "".join(f"""
+      INSERT INTO {table} (bucket, detection_type, device_id, n, conf_n, conf_sum, conf_min, conf_max)
+      VALUES ({bucket.format(ts="NEW.timestamp")}, COALESCE(NEW.detection_type, ''),
+              COALESCE(NEW.device_id, ''), 1, NEW.confidence IS NOT NULL,
+              COALESCE(NEW.confidence, 0), NEW.confidence, NEW.confidence)
+      {_ROLLUP_UPSERT};""" for table, bucket in _ROLLUP_BUCKETS.items())
+    return f"""
+      CREATE TRIGGER IF NOT EXISTS trg_det_rollup AFTER INSERT ON detections
+      WHEN date(NEW.timestamp) IS NOT NULL
+      BEGIN{body}
+      END
+    """
+
+# Column types for rows read back out of the store: parsed UTC timestamps, low-cardinality
+# labels as categoricals and measurements as float32
+_READ_DTYPES = {
+    "detection_type": "category", "device_id": "category",
+    "confidence": "float32", "avg_confidence": "float32",
+    "latitude": "float32", "longitude": "float32",
+}
+
+def typed_frame(df: pd.DataFrame, ts_cols: Tuple[str, ...] = ("timestamp",)) -> pd.DataFrame:
+    """Apply the read-side dtypes to whichever of their columns `df` has."""
+    for col in ts_cols:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], utc=True, format="ISO8601", errors="coerce")
+    return df.astype({c: t for c, t in _READ_DTYPES.items() if c in df.columns})
+
+def grid_from_partials(raw: pd.DataFrame, cell_deg: float) -> pd.DataFrame:
+    """Collapse per (gy, gx, detection_type) partial sums into one row per grid cell."""
+    if raw.empty:
+        return pd.DataFrame(columns=["latitude", "longitude", "count", "avg_confidence",
+                                     "top_type", "cell_deg"])
+    cells = raw.groupby(["gy", "gx"], sort=False)
+    sums = cells[["lat_sum", "lon_sum", "n", "conf_sum", "conf_n"]].sum()
+    top = raw.loc[cells["n"].idxmax(), ["gy", "gx", "detection_type"]].set_index(["gy", "gx"])
+    return pd.DataFrame({
+        "latitude": sums["lat_sum"] / sums["n"],
+        "longitude": sums["lon_sum"] / sums["n"],
+        "count": sums["n"],
+        "avg_confidence": sums["conf_sum"] / sums["conf_n"].where(sums["conf_n"] > 0),
+        "top_type": top["detection_type"].reindex(sums.index),
+        "cell_deg": cell_deg,
+    }).reset_index(drop=True)
+
+# R*Tree indexes over point coordinates, keyed on the source table's rowid and kept in sync by triggers
+_SPATIAL = {
+    "detections_rtree": "detections",
+    "track_points_rtree": "track_points",
+}
+
+def _spatial_ddl(rtree: str, table: str) -> List[str]:
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{rtree}_ins AFTER INSERT ON {table}
+            WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+            BEGIN
+              INSERT OR REPLACE INTO {rtree} VALUES (NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{rtree}_upd AFTER UPDATE OF latitude, longitude ON {table}
+            BEGIN
+              DELETE FROM {rtree} WHERE id = OLD.rowid;
+              INSERT INTO {rtree} SELECT NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+              WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{rtree}_del AFTER DELETE ON {table}
+            BEGIN
+              DELETE FROM {rtree} WHERE id = OLD.rowid;
+            END""",
+    ]
+
+# Export change log: every write or delete bumps its (table, UTC day) pair to a new, larger seq,
+# so a columnar export can rewrite only the days touched since the seq it last saw. Blob-stored
+# points are logged through track_blob_days, the days each compact track has points on.
+_CHANGES_DDL = """
+  CREATE TABLE IF NOT EXISTS export_changes (
+    seq INTEGER PRIMARY KEY,
+    tbl TEXT NOT NULL,
+    day TEXT NOT NULL,
+    UNIQUE (tbl, day)
+  )
+"""
+
+_CHANGE_UPSERT = "ON CONFLICT(tbl, day) DO UPDATE SET seq=(SELECT MAX(seq) FROM export_changes) + 1"
+
+# the column each exported table is split into days by
+EXPORT_DAY = {"tracks": "start_time", "track_points": "timestamp"}
+
+def _day_sql(ts: str) -> str:
+    return f"COALESCE(date({ts}), 'unknown')"
+
+def _change_ddl(table: str) -> List[str]:
+    def log(row: str) -> str:
+        return (f"INSERT INTO export_changes (tbl, day) VALUES ('{table}', {_day_sql(f'{row}.{EXPORT_DAY[table]}')}) "
+                f"{_CHANGE_UPSERT};")
+    return [f"CREATE TRIGGER IF NOT EXISTS trg_{table}_chg_{event.lower()} AFTER {event} ON {table} "
+            f"BEGIN {body} END"
+            for event, body in (("INSERT", log("NEW")), ("UPDATE", log("OLD") + log("NEW")), ("DELETE", log("OLD")))]
+
+def _seed_changes(table: str) -> str:
+    # rows written before the change log existed count as changed once
+    return (f"INSERT INTO main.export_changes (tbl, day) SELECT DISTINCT '{table}', "
+            f"{_day_sql(EXPORT_DAY[table])} FROM main.{table} WHERE true ON CONFLICT DO NOTHING")
+
+_BLOB_DAYS_DDL = (
+    """CREATE TABLE IF NOT EXISTS track_blob_days (
+         track_id TEXT NOT NULL,
+         day TEXT NOT NULL,
+         PRIMARY KEY (track_id, day)
+       ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_blob_days_day ON track_blob_days(day)",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_track_blob_days_chg_ins AFTER INSERT ON track_blob_days
+        BEGIN
+          INSERT INTO export_changes (tbl, day) VALUES ('track_points', NEW.day) {_CHANGE_UPSERT};
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_track_blobs_chg_upd AFTER UPDATE ON track_blobs
+        BEGIN
+          INSERT INTO export_changes (tbl, day)
+          SELECT 'track_points', day FROM track_blob_days WHERE track_id = OLD.track_id {_CHANGE_UPSERT};
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_track_blobs_chg_del AFTER DELETE ON track_blobs
+        BEGIN
+          INSERT INTO export_changes (tbl, day)
+          SELECT 'track_points', day FROM track_blob_days WHERE track_id = OLD.track_id {_CHANGE_UPSERT};
+          DELETE FROM track_blob_days WHERE track_id = OLD.track_id;
+        END""",
+)
+
+_BLOB_DAYS_INSERT = "INSERT INTO track_blob_days (track_id, day) VALUES (?,?) ON CONFLICT DO NOTHING"
+
+def _blob_days(epoch_s: Iterable[float]) -> List[str]:
+    days = np.unique(np.floor(np.asarray(epoch_s, dtype="f8") / 86400.0))
+    return [datetime.fromtimestamp(d * 86400.0, timezone.utc).strftime("%Y-%m-%d") for d in days]
+
+# Copies from an attached `src` store; `WHERE true` keeps SQLite from reading ON CONFLICT as a join.
+# Updates skip rows identical to the stored ones, so changes() counts only rows that really changed.
+_MERGE_SQL = {
+    "devices": """
+      INSERT INTO devices SELECT * FROM src.devices WHERE true
+      ON CONFLICT(id) DO UPDATE SET
+        name=excluded.name, type=excluded.type, status=excluded.status,
+        latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+        last_seen=excluded.last_seen, battery_level=excluded.battery_level,
+        firmware_version=excluded.firmware_version, metadata=excluded.metadata,
+        updated_at=excluded.updated_at
+      WHERE excluded.updated_at >= devices.updated_at
+        AND (name, type, status, latitude, longitude, altitude, last_seen, battery_level,
+             firmware_version, metadata, updated_at)
+         IS NOT (excluded.name, excluded.type, excluded.status, excluded.latitude, excluded.longitude,
+                 excluded.altitude, excluded.last_seen, excluded.battery_level,
+                 excluded.firmware_version, excluded.metadata, excluded.updated_at)
+    """,
+    "tracks": """
+      INSERT INTO tracks SELECT * FROM src.tracks WHERE true
+      ON CONFLICT(id) DO UPDATE SET
+        device_id=excluded.device_id, start_time=excluded.start_time, end_time=excluded.end_time,
+        total_distance=excluded.total_distance, average_speed=excluded.average_speed,
+        max_speed=excluded.max_speed, metadata=excluded.metadata
+      WHERE (device_id, start_time, end_time, total_distance, average_speed, max_speed, metadata)
+         IS NOT (excluded.device_id, excluded.start_time, excluded.end_time, excluded.total_distance,
+                 excluded.average_speed, excluded.max_speed, excluded.metadata)
+    """,
+    "track_points": """
+      INSERT INTO track_points (track_id, timestamp, latitude, longitude, altitude, speed, heading)
+      SELECT track_id, timestamp, latitude, longitude, altitude, speed, heading
+      FROM src.track_points WHERE true ORDER BY id
+      ON CONFLICT(track_id, timestamp) DO UPDATE SET
+        latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+        speed=excluded.speed, heading=excluded.heading
+      WHERE (latitude, longitude, altitude, speed, heading)
+         IS NOT (excluded.latitude, excluded.longitude, excluded.altitude, excluded.speed, excluded.heading)
+    """,
+    "track_blobs": """
+      INSERT INTO track_blobs SELECT * FROM src.track_blobs WHERE true
+      ON CONFLICT(track_id) DO UPDATE SET
+        n_points=excluded.n_points, ts=excluded.ts,
+        latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+        speed=excluded.speed, heading=excluded.heading
+      WHERE (n_points, ts, latitude, longitude, altitude, speed, heading)
+         IS NOT (excluded.n_points, excluded.ts, excluded.latitude, excluded.longitude,
+                 excluded.altitude, excluded.speed, excluded.heading)
+    """,
+    "track_blob_days": """
+      INSERT INTO track_blob_days SELECT * FROM src.track_blob_days WHERE true
+      ON CONFLICT DO NOTHING
+    """,
+    "detections": """
+      INSERT INTO detections SELECT * FROM src.detections WHERE true ORDER BY rowid
+      ON CONFLICT(id) DO NOTHING
+    """,
+}
+
+_DETECTION_COLS = ("id", "device_id", "timestamp", "detection_type", "confidence", "latitude", "longitude",
+                   "altitude", "bbox_x", "bbox_y", "bbox_width", "bbox_height", "metadata")
+_POINT_COLS = ("track_id", "timestamp", "latitude", "longitude", "altitude", "speed", "heading")
+
+_UPSERT = {
+    "detections": (_DETECTION_COLS, "ON CONFLICT(id) DO NOTHING"),
+    "track_points": (_POINT_COLS, """ON CONFLICT(track_id, timestamp) DO UPDATE SET
+        latitude=excluded.latitude,
+        longitude=excluded.longitude,
+        altitude=excluded.altitude,
+        speed=excluded.speed,
+        heading=excluded.heading
+      WHERE (latitude, longitude, altitude, speed, heading)
+         IS NOT (excluded.latitude, excluded.longitude, excluded.altitude, excluded.speed, excluded.heading)"""),
+}
+
+def _insert_sql(table: str, schema: str = "main", rowid: bool = False) -> str:
+    cols, conflict = _UPSERT[table]
+    cols = ("rowid", *cols) if rowid else cols
+    return (f"INSERT INTO {schema}.{table} ({','.join(cols)}) "
+            f"VALUES ({','.join('?' * len(cols))}) {conflict}")
+
+# Optional monthly partitions: detections and track_points rows live in <db>.parts/YYYY-MM.db, each
+# file self-contained (indexes, R*Trees, rollups and their triggers) so it can be deleted whole.
+# Partitions are ATTACHed and unioned behind TEMP views that shadow the main tables for readers.
+_PARTITIONED = ("detections", "track_points")
+# sync_state row holding the newest detection retention cutoff, below which rollups outlive rows
+_RETENTION_MARK = ("retention", "detections")
+RETAINED_TABLES = ("detections", "tracks", *_ROLLUP_BUCKETS)
+
+def _partition_ddl() -> List[str]:
+    return [_DETECTIONS_DDL, *_DETECTION_INDEXES, *_spatial_ddl("detections_rtree", "detections"),
+            *(_ROLLUP_DDL.format(table=t) for t in _ROLLUP_BUCKETS), _rollup_trigger(),
+            _TRACK_POINTS_DDL.format(name="track_points"), *_spatial_ddl("track_points_rtree", "track_points"),
+            _CHANGES_DDL, *_change_ddl("track_points")]
+
+def _month(value: Any) -> Optional[str]:
+    ts = _parse_ts(value)
+    return ts.strftime("%Y-%m") if ts else None
+
+def _month_end(month: str) -> datetime:
+    y, m = map(int, month.split("-"))
+    return datetime(y + m // 12, m % 12 + 1, 1, tzinfo=timezone.utc)
+
+def _months_between(start: datetime, end: datetime) -> List[str]:
+    """Every UTC month from `start`'s to `end`'s, inclusive."""
+    first, last = start.year * 12 + start.month - 1, end.year * 12 + end.month - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(first, last + 1)]
+
+def _rowid_base(month: str) -> int:
+    # disjoint rowid ranges per month keep rowids unique across the unioned partitions
+    y, m = map(int, month.split("-"))
+    return (y * 12 + m) << 32
+
+def _union(parts: Iterable[str]) -> str:
+    return "\n      UNION ALL ".join(parts)
+
+def _view_ddl(schemas: List[str], partitioned: bool) -> List[str]:
+    ddl = [
+        f"""CREATE TEMP VIEW detections_spatial AS {_union(
+            f"SELECT r.min_lat, r.max_lat, r.min_lon, r.max_lon, d.* FROM {s}.detections_rtree r "
+            f"JOIN {s}.detections d ON d.rowid = r.id" for s in schemas)}""",
+        f"""CREATE TEMP VIEW track_points_spatial AS {_union(
+            f"SELECT r.min_lat, r.max_lat, r.min_lon, r.max_lon, p.* FROM {s}.track_points_rtree r "
+            f"JOIN {s}.track_points p ON p.rowid = r.id" for s in schemas)}""",
+    ]
+    if partitioned:
+        ddl += [
+            f"CREATE TEMP VIEW detections AS {_union(f'SELECT rowid AS rowid, * FROM {s}.detections' for s in schemas)}",
+            f"CREATE TEMP VIEW track_points AS {_union(f'SELECT rowid AS rowid, * FROM {s}.track_points' for s in schemas)}",
+        ]
+        # a bucket may be split between main (folded from dropped partitions) and a live partition
+        ddl += [f"""CREATE TEMP VIEW {t} AS
+            SELECT bucket, detection_type, device_id, SUM(n) AS n, SUM(conf_n) AS conf_n,
+                   SUM(conf_sum) AS conf_sum, MIN(conf_min) AS conf_min, MAX(conf_max) AS conf_max
+            FROM ({_union(f'SELECT * FROM {s}.{t}' for s in schemas)})
+            GROUP BY bucket, detection_type, device_id""" for t in _ROLLUP_BUCKETS]
+    return ddl
+
+_VIEWS = ("detections_spatial", "track_points_spatial", *_PARTITIONED, *_ROLLUP_BUCKETS)
+_PART_FILE = re.compile(r"^(\d{4}-\d{2})\.db$")
+
+def _part_months(parts_dir: str) -> List[str]:
+    try:
+        names = os.listdir(parts_dir)
+    except OSError:
+        return []
+    return sorted(m.group(1) for m in map(_PART_FILE.match, names) if m)
+
+def _time_filters(alias: str, since: Optional[datetime], until: Optional[datetime],
+                  **equals: Optional[str]) -> Tuple[str, List[Any]]:
+    sql, params = "", []
+    if since is not None:
+        sql += f" AND {alias}.timestamp >= ?"
+        params.append(since.isoformat())
+    if until is not None:
+        sql += f" AND {alias}.timestamp <= ?"
+        params.append(until.isoformat())
+    for col, value in equals.items():
+        if value is not None:
+            sql += f" AND {alias}.{col} = ?"
+            params.append(value)
+    return sql, params
 
 class michaeltore:
-    def __init__(self, path: str = "michael_data.db"):
+    def __init__(self, path: str = "michael_data.db", chunk_size: int = 5000,
+                 compact_points: bool = False, partitioned: bool = False):
         self.path = path
+        self.chunk_size = chunk_size
+        self.compact_points = compact_points
+        self.parts_dir = f"{path}.parts"
+        self._parts = set(_part_months(self.parts_dir))  # months with a partition file
+        self._attached: Dict[str, str] = {}  # schema alias -> month
+        # once a store has partitions it stays partitioned, whatever later callers pass
+        self.partitioned = partitioned or bool(self._parts)
+        self._cx: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._ready = False
         self._init()
+        for month in sorted(self._parts):  # partitions written by older versions
+            self._create_partition(month)
+        self._ready = True
+        with self._lock:
+            self._attach(self.cx, force=True)
+            if self.partitioned:
+                self._move_to_partitions()
 
-    def _init(self):
-        with sqlite3.connect(self.path) as cx:
+    @property
+    def cx(self) -> sqlite3.Connection:
+        # One long-lived connection per store; transactions are managed explicitly in _tx.
+        if self._cx is None:
+            cx = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            cx.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only takes effect on a new file
             cx.execute("PRAGMA journal_mode=WAL")
+            cx.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe with WAL
+            cx.execute("PRAGMA cache_size=-65536")   # 64 MiB page cache
+            cx.execute("PRAGMA temp_store=MEMORY")
+            self._cx = cx
+            if self._ready:
+                self._attach(cx, force=True)
+        return self._cx
+
+    def close(self):
+        with self._lock:
+            if self._cx is not None:
+                self._cx.close()
+                self._cx = None
+                self._attached = {}
+
+    def __enter__(self) -> "michaeltore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            cx = self.cx
+            cx.execute("BEGIN IMMEDIATE")
+            try:
+                yield cx
+            except BaseException:
+                cx.execute("ROLLBACK")
+                raise
+            started = time.perf_counter()
+            cx.execute("COMMIT")
+            REGISTRY.observe("michael_store_commit_seconds", time.perf_counter() - started)
+
+    def _bulk(self, cx: sqlite3.Connection, sql: str, rows: Iterable[Tuple], changed: bool = False) -> int:
+        """Rows written; with `changed`, only those actually inserted or updated (triggers excluded)."""
+        n = 0
+        for chunk in _chunks(rows, self.chunk_size):
+            cur = cx.executemany(sql, chunk)
+            n += cur.rowcount if changed else len(chunk)
+        return n
+
+    def _stats(self, table: str, rows: int, started: float,
+               per_table: Optional[Dict[str, int]] = None) -> IngestStats:
+        """`per_table` splits the rows counter when one write fills several tables."""
+        st = IngestStats(table, rows, time.perf_counter() - started)
+        for name, n in (per_table or {table: rows}).items():
+            REGISTRY.inc("michael_store_rows_total", n, table=name)
+        REGISTRY.observe("michael_store_batch_rows", rows, SIZE_BUCKETS, table=table)
+        REGISTRY.observe("michael_store_write_seconds", st.seconds, table=table)
+        LOG.debug("Wrote %d %s rows in %.3fs (%.0f rows/s)", st.rows, table, st.seconds, st.rows_per_s)
+        return st
+
+    def _init(self):
+        with self._tx() as cx:
             cx.execute("""
               CREATE TABLE IF NOT EXISTS devices (
                 id TEXT PRIMARY KEY,
@@ -47,138 +591,977 @@ class michaeltore:
                 FOREIGN KEY (device_id) REFERENCES devices(id)
               )
             """)
+            self._migrate_track_points(cx)
+            cx.execute(_TRACK_POINTS_DDL.format(name="track_points"))
             cx.execute("""
-              CREATE TABLE IF NOT EXISTS track_points (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                track_id TEXT,
-                timestamp TEXT,
-                latitude REAL, longitude REAL, altitude REAL,
-                speed REAL, heading REAL,
+              CREATE TABLE IF NOT EXISTS track_blobs (
+                track_id TEXT PRIMARY KEY,
+                n_points INTEGER,
+                ts BLOB, latitude BLOB, longitude BLOB, altitude BLOB, speed BLOB, heading BLOB,
                 FOREIGN KEY (track_id) REFERENCES tracks(id)
               )
             """)
+            cx.execute(_DETECTIONS_DDL)
             cx.execute("""
-              CREATE TABLE IF NOT EXISTS detections (
-                id TEXT PRIMARY KEY,
-                device_id TEXT,
-                timestamp TEXT,
-                detection_type TEXT,
-                confidence REAL,
-                latitude REAL,
-                longitude REAL,
-                altitude REAL,
-                bbox_x REAL, bbox_y REAL, bbox_width REAL, bbox_height REAL,
-                metadata TEXT,
-                created_at TEXT DEFAULT (datetime('now')),
-                FOREIGN KEY (device_id) REFERENCES devices(id)
+              CREATE TABLE IF NOT EXISTS sync_state (
+                entity TEXT NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '',
+                last_ts TEXT,
+                updated_at TEXT DEFAULT (datetime('now')),
+                PRIMARY KEY (entity, device_id)
               )
             """)
             # indices
-            cx.execute("CREATE INDEX IF NOT EXISTS idx_det_time ON detections(timestamp)")
-            cx.execute("CREATE INDEX IF NOT EXISTS idx_det_type ON detections(detection_type)")
-            cx.execute("CREATE INDEX IF NOT EXISTS idx_det_device ON detections(device_id)")
-
-    def save_devices(self, devices: Iterable[Dict[str, Any]]):
-        with sqlite3.connect(self.path) as cx:
-            for d in devices:
-                loc = d.get("location") or {}
-                cx.execute("""
-                  INSERT INTO devices (id,name,type,status,latitude,longitude,altitude,
-                                       last_seen,battery_level,firmware_version,metadata,updated_at)
-                  VALUES (?,?,?,?,?,?,?,?,?,?,?,datetime('now'))
-                  ON CONFLICT(id) DO UPDATE SET
-                    name=excluded.name,
-                    type=excluded.type,
-                    status=excluded.status,
-                    latitude=excluded.latitude,
-                    longitude=excluded.longitude,
-                    altitude=excluded.altitude,
-                    last_seen=excluded.last_seen,
-                    battery_level=excluded.battery_level,
-                    firmware_version=excluded.firmware_version,
-                    metadata=excluded.metadata,
-                    updated_at=datetime('now')
-                """, (
-                    d.get("id"), d.get("name"), d.get("type"), d.get("status"),
-                    loc.get("latitude"), loc.get("longitude"), loc.get("altitude"),
-                    d.get("lastSeen"), d.get("batteryLevel"), d.get("firmwareVersion"),
-                    json.dumps(d.get("metadata") or {})
-                ))
-
-    def save_tracks(self, tracks: Iterable[Dict[str, Any]]):
-        with sqlite3.connect(self.path) as cx:
-            for t in tracks:
-                cx.execute("""
-                  INSERT INTO tracks (id, device_id, start_time, end_time, total_distance,
-                                      average_speed, max_speed, metadata)
-                  VALUES (?,?,?,?,?,?,?,?)
-                  ON CONFLICT(id) DO UPDATE SET
-                    device_id=excluded.device_id,
-                    start_time=excluded.start_time,
-                    end_time=excluded.end_time,
-                    total_distance=excluded.total_distance,
-                    average_speed=excluded.average_speed,
-                    max_speed=excluded.max_speed,
-                    metadata=excluded.metadata
-                """, (
-                    t.get("id"), t.get("deviceId"), t.get("startTime"), t.get("endTime"),
-                    t.get("totalDistance"), t.get("averageSpeed"), t.get("maxSpeed"),
-                    json.dumps(t.get("metadata") or {}),
-                ))
-                # track points
-                for p in (t.get("points") or []):
-                    loc = p.get("location") or {}
-                    cx.execute("""
-                      INSERT INTO track_points (track_id, timestamp, latitude, longitude, altitude, speed, heading)
-                      VALUES (?,?,?,?,?,?,?)
-                    """, (
-                        t.get("id"), p.get("timestamp"), loc.get("latitude"),
-                        loc.get("longitude"), loc.get("altitude"),
-                        p.get("speed"), p.get("heading")
-                    ))
-
-    def save_detections(self, detections: Iterable[Dict[str, Any]]):
-        with sqlite3.connect(self.path) as cx:
-            for det in detections:
-                loc = det.get("location") or {}
-                bb = det.get("boundingBox") or {}
-                cx.execute("""
-                  INSERT INTO detections (id,device_id,timestamp,detection_type,confidence,
-                    latitude,longitude,altitude,bbox_x,bbox_y,bbox_width,bbox_height,metadata)
-                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-                  ON CONFLICT(id) DO NOTHING
-                """, (
-                    det.get("id"), det.get("deviceId"), det.get("timestamp"),
-                    det.get("detectionType"), det.get("confidence"),
-                    loc.get("latitude"), loc.get("longitude"), loc.get("altitude"),
-                    bb.get("x"), bb.get("y"), bb.get("width"), bb.get("height"),
-                    json.dumps(det.get("metadata") or {})
-                ))
+            for ddl in _DETECTION_INDEXES:
+                cx.execute(ddl)
+            # spatial
+            for rtree, table in _SPATIAL.items():
+                fresh = cx.execute("SELECT 1 FROM sqlite_master WHERE name=?", (rtree,)).fetchone() is None
+                for ddl in _spatial_ddl(rtree, table):
+                    cx.execute(ddl)
+                if fresh:
+                    cx.execute(f"""
+                      INSERT INTO {rtree} SELECT rowid, latitude, latitude, longitude, longitude
+                      FROM {table} WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                    """)
+            # export change log
+            fresh = cx.execute("SELECT 1 FROM sqlite_master WHERE name='export_changes'").fetchone() is None
+            cx.execute(_CHANGES_DDL)
+            for table in EXPORT_DAY:
+                for ddl in _change_ddl(table):
+                    cx.execute(ddl)
+                if fresh:
+                    cx.execute(_seed_changes(table))
+            fresh = cx.execute("SELECT 1 FROM sqlite_master WHERE name='track_blob_days'").fetchone() is None
+            for ddl in _BLOB_DAYS_DDL:
+                cx.execute(ddl)
+            if fresh:
+                for track_id, ts in cx.execute("SELECT track_id, ts FROM track_blobs"):
+                    cx.executemany(_BLOB_DAYS_INSERT, [(track_id, d) for d in _blob_days(np.frombuffer(ts, "<f8"))])
+            # rollups
+            fresh = cx.execute(
+                "SELECT 1 FROM sqlite_master WHERE name='trg_det_rollup'").fetchone() is None
+            for table in _ROLLUP_BUCKETS:
+                cx.execute(_ROLLUP_DDL.format(table=table))
+            cx.execute(_rollup_trigger())
+            if fresh and cx.execute("SELECT 1 FROM detections LIMIT 1").fetchone():
+                LOG.info("Building detection rollups for existing rows…")
+                self._rebuild_rollups(cx)
+
+    def _rebuild_rollups(self, cx: sqlite3.Connection, schema: str = "main", after: Optional[datetime] = None):
+        """Recompute `schema`'s rollups; with `after`, only the buckets later than the one holding it."""
+        for table, bucket in _ROLLUP_BUCKETS.items():
+            floor = bucket.format(ts="?") if after else "''"
+            params = (after.isoformat(),) if after else ()
+            cx.execute(f"DELETE FROM {schema}.{table} WHERE bucket > {floor}", params)
+            cx.execute(f"""
+              INSERT INTO {schema}.{table} (bucket, detection_type, device_id, n, conf_n, conf_sum, conf_min, conf_max)
+              SELECT {bucket.format(ts="timestamp")} AS b, COALESCE(detection_type, ''),
+                     COALESCE(device_id, ''), COUNT(*), COUNT(confidence), TOTAL(confidence),
+                     MIN(confidence), MAX(confidence)
+              FROM {schema}.detections
+              WHERE b > {floor}
+              GROUP BY 1, 2, 3
+            """, params)
+
+    def rebuild_rollups(self) -> IngestStats:
+        """Recompute the rollup buckets from the detections table.
+
+        Partitioned stores rebuild each attached partition and keep the rollups in main, which
+        hold the history folded in from expired partitions. Unpartitioned stores leave the
+        buckets up to the last detection retention cutoff alone, since their rows are gone.
+        """
+        started = time.perf_counter()
+        cutoff = self.sync_mark(*_RETENTION_MARK)
+        with self._tx() as cx:
+            if self.partitioned:
+                for schema in self._schemas()[1:]:
+                    self._rebuild_rollups(cx, schema)
+            else:
+                self._rebuild_rollups(cx, "main", cutoff)
+            n = sum(cx.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in _ROLLUP_BUCKETS)
+        return self._stats("rollup", n, started)
+
+    def _migrate_track_points(self, cx: sqlite3.Connection):
+        # Pre-dedup databases keyed points on an AUTOINCREMENT id; collapse refetched copies.
+        row = cx.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='track_points'").fetchone()
+        if not row or "UNIQUE" in row[0]:
+            return
+        LOG.info("Migrating track_points to (track_id, timestamp) keys…")
+        cx.execute(_TRACK_POINTS_DDL.format(name="track_points_dedup"))
+        cx.execute("""
+          INSERT INTO track_points_dedup (track_id, timestamp, latitude, longitude, altitude, speed, heading)
+          SELECT track_id, timestamp, latitude, longitude, altitude, speed, heading
+          FROM track_points WHERE true ORDER BY id
+          ON CONFLICT(track_id, timestamp) DO UPDATE SET
+            latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+            speed=excluded.speed, heading=excluded.heading
+        """)
+        cx.execute("DROP TABLE track_points")
+        cx.execute("ALTER TABLE track_points_dedup RENAME TO track_points")
+
+    def save_devices(self, devices: Iterable[Dict[str, Any]]) -> IngestStats:
+        started = time.perf_counter()
+        rows = (_device_row(d) for d in devices)
+        with self._tx() as cx:
+            n = self._bulk(cx, """
+              INSERT INTO devices (id,name,type,status,latitude,longitude,altitude,
+                                   last_seen,battery_level,firmware_version,metadata,updated_at)
+              VALUES (?,?,?,?,?,?,?,?,?,?,?,datetime('now'))
+              ON CONFLICT(id) DO UPDATE SET
+                name=excluded.name,
+                type=excluded.type,
+                status=excluded.status,
+                latitude=excluded.latitude,
+                longitude=excluded.longitude,
+                altitude=excluded.altitude,
+                last_seen=excluded.last_seen,
+                battery_level=excluded.battery_level,
+                firmware_version=excluded.firmware_version,
+                metadata=excluded.metadata,
+                updated_at=datetime('now')
+            """, rows)
+        return self._stats("devices", n, started)
+
+    def save_tracks(self, tracks: Iterable[Dict[str, Any]]) -> IngestStats:
+        started = time.perf_counter()
+        tracks = list(tracks)
+        with self._tx() as cx:
+            n = self._bulk(cx, """
+              INSERT INTO tracks (id, device_id, start_time, end_time, total_distance,
+                                  average_speed, max_speed, metadata)
+              VALUES (?,?,?,?,?,?,?,?)
+              ON CONFLICT(id) DO UPDATE SET
+                device_id=excluded.device_id,
+                start_time=excluded.start_time,
+                end_time=excluded.end_time,
+                total_distance=excluded.total_distance,
+                average_speed=excluded.average_speed,
+                max_speed=excluded.max_speed,
+                metadata=excluded.metadata
+            """, (_track_row(t) for t in tracks))
+            # track points
+            points = 0
+            if self.compact_points:
+                points = self._save_track_blobs(cx, tracks)
+            elif not self.partitioned:
+                points = self._bulk(cx, _insert_sql("track_points"), (row for t in tracks for row in _point_rows(t)))
+        if self.partitioned and not self.compact_points:
+            points = self._save_partitioned("track_points", [row for t in tracks for row in _point_rows(t)])
+        return self._stats("tracks", n + points, started, {"tracks": n, "track_points": points})
+
+    def _save_track_blobs(self, cx: sqlite3.Connection, tracks: List[Dict[str, Any]]) -> int:
+        n = 0
+        for t in tracks:
+            merged: Dict[float, Tuple[float, ...]] = {}
+            old = cx.execute(
+                "SELECT ts, latitude, longitude, altitude, speed, heading FROM track_blobs WHERE track_id=?",
+                (t.get("id"),)
+            ).fetchone()
+            if old:
+                cols = _unpack(old)
+                merged.update(zip(cols["ts"].tolist(), zip(*(cols[c].tolist() for c in _BLOB_COLS[1:]))))
+            for _, ts, lat, lon, alt, speed, heading in _point_rows(t):
+                parsed = _parse_ts(ts)
+                if parsed is not None:
+                    merged[parsed.timestamp()] = tuple(map(_f64, (lat, lon, alt, speed, heading)))
+                    n += 1
+            if not merged:
+                continue
+            keys = sorted(merged)
+            columns = {"ts": keys, **{c: [merged[k][i] for k in keys] for i, c in enumerate(_BLOB_COLS[1:])}}
+            cx.execute("""
+              INSERT INTO track_blobs (track_id, n_points, ts, latitude, longitude, altitude, speed, heading)
+              VALUES (?,?,?,?,?,?,?,?)
+              ON CONFLICT(track_id) DO UPDATE SET
+                n_points=excluded.n_points, ts=excluded.ts,
+                latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+                speed=excluded.speed, heading=excluded.heading
+            """, (t.get("id"), len(keys), *_pack(columns)))
+            cx.executemany(_BLOB_DAYS_INSERT, [(t.get("id"), d) for d in _blob_days(keys)])
+        return n
+
+    def track_columns(self, track_id: str) -> Dict[str, np.ndarray]:
+        """Points of one track as NumPy columns, from the packed blob if present else from track_points."""
+        with self._lock:
+            row = self.cx.execute(
+                "SELECT ts, latitude, longitude, altitude, speed, heading FROM track_blobs WHERE track_id=?",
+                (track_id,)
+            ).fetchone()
+            if row:
+                cols = _unpack(row)
+            else:
+                rows = self.cx.execute("""
+                  SELECT timestamp, latitude, longitude, altitude, speed, heading
+                  FROM track_points WHERE track_id=? ORDER BY timestamp
+                """, (track_id,)).fetchall()
+                parsed = [(ts.timestamp(), r) for r in rows for ts in (_parse_ts(r[0]),) if ts]
+                cols = {"ts": np.array([ts for ts, _ in parsed], dtype="<f8")}
+                for i, c in enumerate(_BLOB_COLS[1:], start=1):
+                    cols[c] = np.array([_f64(r[i]) for _, r in parsed], dtype="<f8")
+        epoch = cols.pop("ts")
+        cols["timestamp"] = (epoch * 1e6).astype("int64").astype("datetime64[us]")
+        return cols
+
+    def iter_track_columns(self, track_ids: Optional[Iterable[str]] = None,
+                           batch_size: int = 500) -> Iterator[Dict[str, np.ndarray]]:
+        """Points of many tracks as flat NumPy columns, `batch_size` tracks at a time.
+
+        Each batch has per-point "track" (index into the per-track "track_id" /
+        "device_id" arrays), "ts" (epoch seconds), "latitude", "longitude" and
+        "speed", sorted by track then time. Points without coordinates are skipped.
+        Row-stored and blob-stored tracks are both read.
+        """
+        if track_ids is None:
+            with self._lock:
+                track_ids = [r[0] for r in self.cx.execute("""
+                  SELECT DISTINCT track_id FROM track_points
+                  UNION SELECT track_id FROM track_blobs
+                """)]
+        for chunk in _chunks(((t,) for t in track_ids), batch_size):
+            ids = [t for (t,) in chunk]
+            marks = ",".join("?" * len(ids))
+            with self._lock:
+                rows = pd.read_sql_query(f"""
+                  SELECT track_id, timestamp, latitude, longitude, speed FROM track_points
+                  WHERE track_id IN ({marks}) AND latitude IS NOT NULL AND longitude IS NOT NULL
+                """, self.cx, params=ids)
+                blobs = self.cx.execute(f"""
+                  SELECT track_id, ts, latitude, longitude, altitude, speed, heading
+                  FROM track_blobs WHERE track_id IN ({marks})
+                """, ids).fetchall()
+                devices = dict(self.cx.execute(
+                    f"SELECT id, device_id FROM tracks WHERE id IN ({marks})", ids).fetchall())
+            frames = [pd.DataFrame({
+                "track_id": rows["track_id"].to_numpy(),
+                "ts": _epoch_s(rows["timestamp"]),
+                "latitude": rows["latitude"].to_numpy(dtype="f8"),
+                "longitude": rows["longitude"].to_numpy(dtype="f8"),
+                "speed": rows["speed"].to_numpy(dtype="f8"),
+            })]
+            for track_id, *packed in blobs:
+                cols = _unpack(packed)
+                frames.append(pd.DataFrame({"track_id": track_id, "ts": cols["ts"], "latitude": cols["latitude"],
+                                            "longitude": cols["longitude"], "speed": cols["speed"]}))
+            df = pd.concat(frames, ignore_index=True)
+            df = df[df["latitude"].notna() & df["longitude"].notna()]
+            df = df.drop_duplicates(["track_id", "ts"]).sort_values(["track_id", "ts"], kind="stable")
+            codes, uniques = pd.factorize(df["track_id"], sort=True)
+            yield {
+                "track": codes.astype("int32"),
+                "track_id": np.asarray(uniques, dtype=object),
+                "device_id": np.array([devices.get(t) for t in uniques], dtype=object),
+                "ts": df["ts"].to_numpy(dtype="f8"),
+                "latitude": df["latitude"].to_numpy(dtype="f8"),
+                "longitude": df["longitude"].to_numpy(dtype="f8"),
+                "speed": df["speed"].to_numpy(dtype="f8"),
+            }
+
+    def track_frame(self, track_id: str) -> pd.DataFrame:
+        cols = self.track_columns(track_id)
+        df = pd.DataFrame(cols, columns=["timestamp", *_BLOB_COLS[1:]])
+        df["timestamp"] = df["timestamp"].dt.tz_localize("UTC")
+        return df
+
+    def save_detections(self, detections: Iterable[Dict[str, Any]]) -> IngestStats:
+        started = time.perf_counter()
+        rows = (_detection_row(det) for det in detections)
+        if self.partitioned:
+            n = self._save_partitioned("detections", list(rows))
+        else:
+            with self._tx() as cx:
+                n = self._bulk(cx, _insert_sql("detections"), rows)
+        return self._stats("detections", n, started)
+
+    # -- monthly partitions -------------------------------------------------------------
+
+    def _part_path(self, month: str) -> str:
+        return os.path.join(self.parts_dir, f"{month}.db")
+
+    @staticmethod
+    def _alias(month: str) -> str:
+        return f"p_{month.replace('-', '_')}"
+
+    @staticmethod
+    def _slots(cx: sqlite3.Connection) -> int:
+        limit = cx.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(cx, "getlimit") else 10
+        return max(1, limit - 1)  # one slot stays free for merge_from's source
+
+    def _schemas(self) -> List[str]:
+        return ["main", *self._attached]
+
+    def _check_slots(self, months: Iterable[str]):
+        """Refuse a partition layout the views cannot span: queries would silently skip months."""
+        months = sorted(set(months))
+        slots = self._slots(self.cx)
+        if len(months) > slots:
+            raise ValueError(f"{len(months)} monthly partitions ({months[0]} to {months[-1]}) but only {slots} "
+                             f"can be queried at once; keep retention under {slots} months or move the oldest "
+                             f"files out of {self.parts_dir}")
+
+    def _attach(self, cx: sqlite3.Connection, wanted: Iterable[str] = (), force: bool = False):
+        """Attach the `wanted` months plus the newest others that fit, detach the rest and rebuild
+        the TEMP views over them. Must run outside a transaction."""
+        slots = self._slots(cx)
+        newest = sorted(self._parts, reverse=True)
+        if not wanted:
+            self._check_slots(newest)
+        target = {self._alias(m): m for m in list(dict.fromkeys([*wanted, *newest]))[:slots]}
+        if target == self._attached and not force:
+            return
+        for alias in set(self._attached) - set(target):
+            cx.execute(f"DETACH DATABASE {alias}")
+        for alias, month in target.items():
+            if alias not in self._attached:
+                cx.execute(f"ATTACH DATABASE ? AS {alias}", (self._part_path(month),))
+                cx.execute(f"PRAGMA {alias}.synchronous=NORMAL")
+        self._attached = target
+        for view in _VIEWS:
+            cx.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        for ddl in _view_ddl(self._schemas(), self.partitioned):
+            cx.execute(ddl)
+
+    def _create_partition(self, month: str):
+        """Create a month's partition file, or bring an existing one up to the current schema."""
+        os.makedirs(self.parts_dir, exist_ok=True)
+        cx = sqlite3.connect(self._part_path(month), isolation_level=None)
+        try:
+            cx.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cx.execute("PRAGMA journal_mode=WAL")
+            cx.execute("BEGIN")
+            fresh = cx.execute("SELECT 1 FROM sqlite_master WHERE name='export_changes'").fetchone() is None
+            for ddl in _partition_ddl():
+                cx.execute(ddl)
+            if fresh:
+                cx.execute(_seed_changes("track_points"))
+            cx.execute("COMMIT")
+        finally:
+            cx.close()
+        self._parts.add(month)
+
+    def _save_partitioned(self, table: str, rows: List[Tuple], changed: bool = False) -> int:
+        """Write rows into their UTC month's partition; rows without a usable timestamp stay in main."""
+        ts_at = _UPSERT[table][0].index("timestamp")
+        by_month: Dict[Optional[str], List[Tuple]] = {}
+        for row in rows:
+            by_month.setdefault(_month(row[ts_at]), []).append(row)
+        n = 0
+        with self._lock:
+            loose = by_month.pop(None, None)
+            self._check_slots([*self._parts, *by_month])
+            if loose:
+                with self._tx() as cx:
+                    n += self._bulk(cx, _insert_sql(table), loose, changed)
+            for wave in _chunks(sorted(by_month), self._slots(self.cx)):
+                for month in wave:
+                    if month not in self._parts:
+                        self._create_partition(month)
+                self._attach(self.cx, wave)
+                with self._tx() as cx:
+                    for month in wave:
+                        alias = self._alias(month)
+                        last = cx.execute(f"SELECT MAX(rowid) FROM {alias}.{table}").fetchone()[0]
+                        start = last or _rowid_base(month)
+                        n += self._bulk(cx, _insert_sql(table, alias, rowid=True),
+                                        ((start + i, *row) for i, row in enumerate(by_month[month], 1)), changed)
+            self._attach(self.cx)  # back to the newest months if late rows pulled in older ones
+        return n
+
+    def _iter_rows(self, table: str, schema: str) -> Iterator[List[Tuple]]:
+        cols = ",".join(_UPSERT[table][0])
+        q = f"SELECT rowid, {cols} FROM {schema}.{table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+        after = 0
+        while True:
+            with self._lock:
+                rows = self.cx.execute(q, (after, self.chunk_size)).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield rows
+
+    def _move_to_partitions(self):
+        """Route rows written before partitioning was enabled out of the main tables."""
+        existing = set(self._parts)
+        with self._lock:
+            self._check_slots([*existing, *(m for table in _PARTITIONED for (m,) in self.cx.execute(
+                f"SELECT DISTINCT strftime('%Y-%m', timestamp) FROM main.{table} WHERE true") if m)])
+        for table in _PARTITIONED:
+            ts_at = 1 + _UPSERT[table][0].index("timestamp")
+            moved = 0
+            for rows in self._iter_rows(table, "main"):
+                rows = [r for r in rows if _month(r[ts_at])]
+                if not rows:
+                    continue
+                if not moved:
+                    LOG.info("Moving existing %s into monthly partitions…", table)
+                self._save_partitioned(table, [r[1:] for r in rows])
+                with self._tx() as cx:
+                    cx.executemany(f"DELETE FROM main.{table} WHERE rowid=?", [(r[0],) for r in rows])
+                moved += len(rows)
+            if moved and table == "detections":
+                # main's rollups already count the moved rows (and any expired before the switch):
+                # hand each new month's buckets to its partition in place of what the triggers built,
+                # so main keeps only folded history and rebuild_rollups never counts a month twice
+                with self._lock:
+                    for wave in _chunks(sorted(self._parts - existing), self._slots(self.cx)):
+                        self._attach(self.cx, wave)
+                        with self._tx() as cx:
+                            for month in wave:
+                                alias = self._alias(month)
+                                for t in _ROLLUP_BUCKETS:
+                                    cx.execute(f"DELETE FROM {alias}.{t}")
+                                    cx.execute(f"INSERT INTO {alias}.{t} SELECT * FROM main.{t} "
+                                               f"WHERE substr(bucket, 1, 7) = ?", (month,))
+                                    cx.execute(f"DELETE FROM main.{t} WHERE substr(bucket, 1, 7) = ?", (month,))
+                    self._attach(self.cx)
+
+    def _expire_partitions(self, table: str, cutoff: datetime) -> int:
+        """Empty `table` in every partition whose whole month is older than `cutoff`, and delete
+        partition files left with no rows at all; returns the rows expired.
+
+        Detection rollups are folded into main first, so daily/hourly history outlives raw rows.
+        """
+        n = 0
+        with self._lock:
+            for month in sorted(m for m in self._parts if _month_end(m) <= cutoff):
+                alias = self._alias(month)
+                self._attach(self.cx, [month])
+                with self._tx() as cx:
+                    n += cx.execute(f"SELECT COUNT(*) FROM {alias}.{table}").fetchone()[0]
+                    if table == "detections":
+                        for t in _ROLLUP_BUCKETS:
+                            cx.execute(f"INSERT INTO main.{t} SELECT * FROM {alias}.{t} WHERE true {_ROLLUP_UPSERT}")
+                            cx.execute(f"DELETE FROM {alias}.{t}")
+                    cx.execute(f"DELETE FROM {alias}.{table}")
+                    empty = not any(cx.execute(f"SELECT EXISTS (SELECT 1 FROM {alias}.{t})").fetchone()[0]
+                                    for t in _PARTITIONED)
+                if empty:
+                    self._parts.discard(month)
+                    self._attach(self.cx)
+                    for suffix in ("", "-wal", "-shm"):
+                        try:
+                            os.remove(self._part_path(month) + suffix)
+                        except FileNotFoundError:
+                            pass
+                    LOG.info("Dropped partition %s", month)
+            self._attach(self.cx)
+        return n
+
+    # -- retention and maintenance ------------------------------------------------------
+
+    def _delete_chunked(self, table: str, where: str, *params: Any) -> int:
+        """Delete matching main-table rows `chunk_size` at a time so writers never wait long."""
+        total = 0
+        while True:
+            with self._tx() as cx:
+                cx.execute(f"""
+                  DELETE FROM main.{table} WHERE rowid IN (
+                    SELECT rowid FROM main.{table} WHERE {where} LIMIT ?)
+                """, (*params, self.chunk_size))
+                n = cx.execute("SELECT changes()").fetchone()[0]
+            total += n
+            if n < self.chunk_size:
+                return total
+
+    def apply_retention(self, days: Dict[str, float], now: Optional[datetime] = None) -> Dict[str, int]:
+        """Expire data older than `days[name]` days; returns rows removed per name.
+
+        "detections" and "tracks" (with their points and blobs) drop whole monthly partitions once
+        the month is past the cutoff, and delete row by row in unpartitioned tables. The rollup
+        tables keep their own, typically longer, retention.
+        """
+        unknown = set(days) - set(RETAINED_TABLES)
+        if unknown:
+            raise ValueError(f"Unknown retention table(s) {sorted(unknown)}; expected some of {RETAINED_TABLES}")
+        now = now or datetime.now(timezone.utc)
+        if self.partitioned:
+            for name in set(days) & {"detections", "tracks"}:
+                cutoff = now - timedelta(days=days[name])
+                self._check_slots(_months_between(cutoff, now))
+        removed: Dict[str, int] = {}
+        for name, keep_days in days.items():
+            cutoff = now - timedelta(days=keep_days)
+            ts = cutoff.isoformat()
+            if name == "detections":
+                n = self._expire_partitions("detections", cutoff) + self._delete_chunked("detections", "timestamp < ?", ts)
+                self.write_sync_marks(_RETENTION_MARK[0], {_RETENTION_MARK[1]: cutoff})
+            elif name == "tracks":
+                expired = "track_id IN (SELECT id FROM main.tracks WHERE COALESCE(end_time, start_time) < ?)"
+                n = (self._expire_partitions("track_points", cutoff)
+                     + self._delete_chunked("track_points", expired, ts)
+                     + self._delete_chunked("track_blobs", expired, ts)
+                     + self._delete_chunked("tracks", "COALESCE(end_time, start_time) < ?", ts))
+            else:
+                n = 0
+                with self._tx() as cx:
+                    for schema in self._schemas():
+                        cx.execute(f"DELETE FROM {schema}.{name} WHERE bucket < {_ROLLUP_BUCKETS[name].format(ts='?')}",
+                                   (ts,))
+                        n += cx.execute("SELECT changes()").fetchone()[0]
+            removed[name] = n
+            REGISTRY.inc("michael_store_expired_rows_total", n, table=name)
+            LOG.info("Retention %s: removed %d rows older than %s", name, n, cutoff.date())
+        return removed
+
+    def maintain(self, analyze: bool = True, full_vacuum: bool = False) -> Dict[str, Any]:
+        """Reclaim free pages, checkpoint and truncate the WALs, and refresh planner statistics.
+
+        Files created before incremental auto-vacuum was enabled only shrink with `full_vacuum`,
+        a one-off rewrite of the main DB that also switches it over.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            cx = self.cx
+            schemas = ["main", *self._attached]
+            if full_vacuum:
+                cx.execute("PRAGMA main.auto_vacuum=INCREMENTAL")
+                cx.execute("VACUUM main")
+            freed = busy = 0
+            for s in schemas:
+                page, before = (cx.execute(f"PRAGMA {s}.{p}").fetchone()[0] for p in ("page_size", "freelist_count"))
+                if cx.execute(f"PRAGMA {s}.auto_vacuum").fetchone()[0] == 2:  # INCREMENTAL
+                    cx.execute(f"PRAGMA {s}.incremental_vacuum").fetchall()
+                freed += (before - cx.execute(f"PRAGMA {s}.freelist_count").fetchone()[0]) * page
+                busy += cx.execute(f"PRAGMA {s}.wal_checkpoint(TRUNCATE)").fetchone()[0]
+            if analyze:
+                cx.execute("PRAGMA analysis_limit=1000")  # sampled ANALYZE keeps big tables cheap
+                cx.execute("ANALYZE")
+            else:
+                cx.execute("PRAGMA optimize")
+        return {"schemas": len(schemas), "freed_bytes": freed, "checkpoint_busy": busy,
+                "seconds": time.perf_counter() - started}
+
+    def sync_mark(self, entity: str, device_id: str = "") -> Optional[datetime]:
+        """High-water mark for `entity`; device_id '' is the mark across all devices."""
+        with self._lock:
+            row = self.cx.execute(
+                "SELECT last_ts FROM sync_state WHERE entity=? AND device_id=?", (entity, device_id)
+            ).fetchone()
+        return _parse_ts(row[0]) if row else None
+
+    def sync_marks(self, entity: str) -> Dict[str, datetime]:
+        """Every mark for `entity`, keyed by device_id ('' = across all devices)."""
+        with self._lock:
+            rows = self.cx.execute("SELECT device_id, last_ts FROM sync_state WHERE entity=?", (entity,)).fetchall()
+        return {dev: ts for dev, ts in ((dev, _parse_ts(v)) for dev, v in rows) if ts is not None}
+
+    def advance_sync_marks(self, entity: str, items: Iterable[Dict[str, Any]], *ts_keys: str):
+        """Move the per-device and global marks forward to the newest timestamp in `items`.
+
+        The first non-empty key in `ts_keys` is used per item; marks never move backwards.
+        """
+        self.write_sync_marks(entity, newest_marks(items, *ts_keys))
+
+    def write_sync_marks(self, entity: str, marks: Dict[str, datetime]):
+        if not marks:
+            return
+        with self._tx() as cx:
+            cx.executemany("""
+              INSERT INTO sync_state (entity, device_id, last_ts, updated_at)
+              VALUES (?,?,?,datetime('now'))
+              ON CONFLICT(entity, device_id) DO UPDATE SET
+                last_ts=MAX(sync_state.last_ts, excluded.last_ts),
+                updated_at=datetime('now')
+            """, [(entity, dev, ts.isoformat(timespec="microseconds")) for dev, ts in marks.items()])
+
+    def recent_detection_ids(self, since: datetime) -> List[str]:
+        with self._lock:
+            rows = self.cx.execute(
+                "SELECT id FROM detections WHERE timestamp >= ?", (since.isoformat(),)
+            ).fetchall()
+        return [r[0] for r in rows]
 
     def recent_detection_analytics(self, days: int = 30) -> pd.DataFrame:
-        q = f"""
+        chunks = list(self.iter_detection_analytics(days))
+        if not chunks:
+            return typed_frame(pd.DataFrame(columns=["detection_type", "date", "avg_confidence",
+                                                     "detection_count", "device_id"]), ("date",))
+        # chunks carry different category sets and concat would fall back to strings
+        return typed_frame(pd.concat(chunks, ignore_index=True), ())
+
+    def iter_detection_analytics(self, days: int = 30,
+                                 chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Daily rollup rows for the last `days` days, newest first, as typed chunks."""
+        q = """
         SELECT
-          detection_type,
-          DATE(timestamp) AS date,
-          AVG(confidence) AS avg_confidence,
-          COUNT(*) AS detection_count,
-          device_id
-        FROM detections
-        WHERE timestamp >= datetime('now', '-{days} days')
-        GROUP BY detection_type, DATE(timestamp), device_id
-        ORDER BY date DESC
+          NULLIF(detection_type, '') AS detection_type,
+          bucket AS date,
+          conf_sum / NULLIF(conf_n, 0) AS avg_confidence,
+          n AS detection_count,
+          NULLIF(device_id, '') AS device_id,
+          detection_type AS _type_key, device_id AS _device_key
+        FROM detection_rollup_day
+        WHERE bucket >= date('now', ?) AND (bucket, detection_type, device_id) < (?, ?, ?)
+        ORDER BY bucket DESC, detection_type DESC, device_id DESC
+        LIMIT ?
         """
-        with sqlite3.connect(self.path) as cx:
-            return pd.read_sql_query(q, cx)
+        size = chunk_size or self.chunk_size
+        key = ("9999-12-31", "", "")
+        while True:
+            with self._lock:
+                df = pd.read_sql_query(q, self.cx, params=(f"-{int(days)} days", *key, size))
+            if df.empty:
+                return
+            last = df.iloc[-1]
+            key = (last["date"], last["_type_key"], last["_device_key"])
+            yield typed_frame(df.drop(columns=["_type_key", "_device_key"]), ("date",))
+            if len(df) < size:
+                return
 
-    def detection_points(self, limit: int = 1000) -> pd.DataFrame:
+    def hourly_detection_analytics(self, hours: int = 48) -> pd.DataFrame:
+        q = """
+        SELECT
+          NULLIF(detection_type, '') AS detection_type,
+          bucket AS hour,
+          conf_sum / NULLIF(conf_n, 0) AS avg_confidence,
+          conf_min AS min_confidence,
+          conf_max AS max_confidence,
+          n AS detection_count,
+          NULLIF(device_id, '') AS device_id
+        FROM detection_rollup_hour
+        WHERE bucket >= strftime('%Y-%m-%dT%H:00:00', 'now', ?)
+        ORDER BY hour DESC
+        """
+        with self._lock:
+            return pd.read_sql_query(q, self.cx, params=(f"-{int(hours)} hours",))
+
+    def detections_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                           since: Optional[datetime] = None, until: Optional[datetime] = None,
+                           detection_type: Optional[str] = None,
+                           device_id: Optional[str] = None) -> pd.DataFrame:
+        where, params = _time_filters("d", since, until, detection_type=detection_type, device_id=device_id)
+        q = f"""
+        SELECT d.id, d.device_id, d.timestamp, d.detection_type, d.confidence,
+               d.latitude, d.longitude
+        FROM detections_spatial d
+        WHERE d.max_lat >= ? AND d.min_lat <= ? AND d.max_lon >= ? AND d.min_lon <= ?{where}
+        ORDER BY d.timestamp DESC
+        """
+        with self._lock:
+            return pd.read_sql_query(q, self.cx, params=[min_lat, max_lat, min_lon, max_lon, *params])
+
+    def detections_within(self, lat: float, lon: float, radius_m: float,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          detection_type: Optional[str] = None,
+                          device_id: Optional[str] = None) -> pd.DataFrame:
+        """Detections within `radius_m` metres of (lat, lon), nearest first, with a distance_m column."""
+        df = self.detections_in_bbox(*bbox_around(lat, lon, radius_m), since=since, until=until,
+                                     detection_type=detection_type, device_id=device_id)
+        df["distance_m"] = haversine_m(lat, lon, df["latitude"].to_numpy(), df["longitude"].to_numpy())
+        return df[df["distance_m"] <= radius_m].sort_values("distance_m").reset_index(drop=True)
+
+    def detections_near_track(self, track_id: str, radius_m: float,
+                              time_slack_s: Optional[float] = None) -> pd.DataFrame:
+        """Detections within `radius_m` of any point of a track, with distance_m to the closest point.
+
+        With `time_slack_s`, only detections inside the track's time span widened by
+        that many seconds are considered.
+        """
+        cols = self.track_columns(track_id)
+        ok = ~(np.isnan(cols["latitude"]) | np.isnan(cols["longitude"]))
+        lat, lon, ts = cols["latitude"][ok], cols["longitude"][ok], cols["timestamp"][ok]
+        if not len(lat):
+            return self.detections_in_bbox(0, 0, -1, -1).assign(distance_m=[])
+        since = until = None
+        if time_slack_s is not None:
+            slack = np.timedelta64(int(time_slack_s * 1e6), "us")
+            since = pd.Timestamp(ts.min() - slack, tz="UTC").to_pydatetime()
+            until = pd.Timestamp(ts.max() + slack, tz="UTC").to_pydatetime()
+        # the longitude margin is widest at the track's highest |latitude|, so size it there
+        far = float(np.abs(lat).max())
+        west, east = (bbox_around(far, float(x), radius_m) for x in (lon.min(), lon.max()))
+        min_lon, max_lon = (-180.0, 180.0) if west[1] <= -180.0 or east[3] >= 180.0 else (west[1], east[3])
+        min_lat = bbox_around(float(lat.min()), 0.0, radius_m)[0]
+        max_lat = bbox_around(float(lat.max()), 0.0, radius_m)[2]
+        df = self.detections_in_bbox(min_lat, min_lon, max_lat, max_lon, since=since, until=until)
+        dist = np.full(len(df), np.inf)
+        dlat, dlon = df["latitude"].to_numpy(), df["longitude"].to_numpy()
+        step = max(1, 2_000_000 // len(lat))  # bound the detections × points distance matrix
+        for i in range(0, len(df), step):
+            block = haversine_m(dlat[i:i + step, None], dlon[i:i + step, None], lat[None, :], lon[None, :])
+            dist[i:i + step] = block.min(axis=1)
+        df["distance_m"] = dist
+        return df[df["distance_m"] <= radius_m].sort_values("distance_m").reset_index(drop=True)
+
+    def track_points_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                             since: Optional[datetime] = None,
+                             until: Optional[datetime] = None) -> pd.DataFrame:
+        """Row-stored track points inside a box; points kept only as compact blobs are not indexed."""
+        where, params = _time_filters("p", since, until)
         q = f"""
+        SELECT p.track_id, p.timestamp, p.latitude, p.longitude, p.altitude, p.speed, p.heading
+        FROM track_points_spatial p
+        WHERE p.max_lat >= ? AND p.min_lat <= ? AND p.max_lon >= ? AND p.min_lon <= ?{where}
+        ORDER BY p.track_id, p.timestamp
+        """
+        with self._lock:
+            return pd.read_sql_query(q, self.cx, params=[min_lat, max_lat, min_lon, max_lon, *params])
+
+    def detection_grid(self, cell_deg: float, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None, detection_type: Optional[str] = None,
+                       max_cells: Optional[int] = None) -> pd.DataFrame:
+        """Detections binned into square lat/lon cells of `cell_deg` degrees, aggregated in SQL.
+
+        One row per non-empty cell: mean position, count, mean confidence and the most
+        frequent detection type. With `max_cells`, the cell size doubles until the grid fits.
+        """
+        where, params = _time_filters("d", since, until, detection_type=detection_type)
+        while True:
+            q = f"""
+            SELECT CAST((d.latitude + 90) / ? AS INTEGER) AS gy,
+                   CAST((d.longitude + 180) / ? AS INTEGER) AS gx,
+                   d.detection_type,
+                   SUM(d.latitude) AS lat_sum, SUM(d.longitude) AS lon_sum,
+                   COUNT(*) AS n, TOTAL(d.confidence) AS conf_sum, COUNT(d.confidence) AS conf_n
+            FROM detections d
+            WHERE d.latitude IS NOT NULL AND d.longitude IS NOT NULL{where}
+            GROUP BY gy, gx, d.detection_type
+            """
+            with self._lock:
+                raw = pd.read_sql_query(q, self.cx, params=[cell_deg, cell_deg, *params])
+            cells = raw.groupby(["gy", "gx"], sort=False)
+            if max_cells is None or cells.ngroups <= max_cells:
+                break
+            cell_deg *= 2
+        return grid_from_partials(raw, cell_deg)
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """Row counts per table plus database, freelist and WAL sizes in bytes."""
+        tables = ("devices", "tracks", "track_points", "track_blobs", "detections", "sync_state",
+                  *_ROLLUP_BUCKETS)
+        with self._lock:
+            cx = self.cx
+            rows = {t: cx.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in tables}
+            page = cx.execute("PRAGMA page_size").fetchone()[0]
+            pages = cx.execute("PRAGMA page_count").fetchone()[0]
+            free = cx.execute("PRAGMA freelist_count").fetchone()[0]
+        try:
+            wal = os.path.getsize(f"{self.path}-wal")
+        except OSError:
+            wal = 0
+        parts = [self._part_path(m) for m in self._parts]
+        return {"rows": rows, "db_bytes": page * pages, "free_bytes": page * free, "wal_bytes": wal,
+                "partitions": len(parts), "partition_bytes": sum(os.path.getsize(p) for p in parts)}
+
+    def merge_from(self, path: str) -> Dict[str, int]:
+        """Upsert every row of another store (e.g. a fetch-all shard) into this one.
+
+        Inserts go through the normal triggers, so rollups and R*Trees stay consistent; detections
+        already present are skipped. Sync marks are per shard and are not copied. A partitioned
+        source is read partition by partition.
+        """
+        started = time.perf_counter()
+        counts: Dict[str, int] = {}
+        sources = [(path, tuple(_MERGE_SQL))]
+        sources += [(os.path.join(f"{path}.parts", f"{m}.db"), _PARTITIONED) for m in _part_months(f"{path}.parts")]
+        with self._lock:
+            for src, tables in sources:
+                self.cx.execute("ATTACH DATABASE ? AS src", (src,))
+                try:
+                    with self._tx() as cx:
+                        for table in tables:
+                            if self.partitioned and table in _PARTITIONED:
+                                continue
+                            cx.execute(_MERGE_SQL[table])
+                            if table != "track_blob_days":  # an index over track_blobs, not data
+                                counts[table] = counts.get(table, 0) + cx.execute("SELECT changes()").fetchone()[0]
+                    if self.partitioned:
+                        for table in _PARTITIONED:
+                            counts[table] = counts.get(table, 0) + sum(
+                                self._save_partitioned(table, [r[1:] for r in rows], changed=True)
+                                for rows in self._iter_rows(table, "src"))
+                finally:
+                    self.cx.execute("DETACH DATABASE src")
+        self._stats("merge", sum(counts.values()), started)
+        return counts
+
+    def iter_table_since(self, table: str, after_rowid: int = 0,
+                         chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Rows of a base table inserted after `after_rowid`, in rowid order, as DataFrame chunks.
+
+        Each chunk carries the source rowid in a `_rowid` column so callers can resume.
+        """
+        if table not in ("devices", "tracks", "track_points", "detections", "track_blobs"):
+            raise ValueError(f"Unknown table {table!r}")
+        q = f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+        size = chunk_size or self.chunk_size
+        while True:
+            with self._lock:
+                df = pd.read_sql_query(q, self.cx, params=(after_rowid, size))
+            if df.empty:
+                return
+            after_rowid = int(df["_rowid"].iloc[-1])
+            yield df.drop(columns="rowid", errors="ignore")  # partition views expose rowid as a column
+
+    def iter_table_sources(self, table: str, after: Dict[str, int], default: int = 0,
+                           chunk_size: Optional[int] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """Like iter_table_since, but main and each monthly partition are read on their own, each past
+        its own rowid mark (`after[source]`, else `default`); yields (source, chunk), where source
+        is "main" or the partition's month.
+
+        Partition rowids are per-month ranges, so a single mark over the unioned view would skip
+        rows arriving late for an older month, and every loose row in main after the first run.
+        """
+        sources = ["main", *sorted(self._parts)] if table in _PARTITIONED else ["main"]
+        size = chunk_size or self.chunk_size
+        for source in sources:
+            mark = after.get(source, default)
+            while True:
+                with self._lock:
+                    if source != "main" and source not in self._parts:
+                        break  # expired meanwhile
+                    schema = "main"
+                    if source != "main":
+                        self._attach(self.cx, [source])
+                        schema = self._alias(source)
+                    df = pd.read_sql_query(
+                        f"SELECT rowid AS _rowid, * FROM {schema}.{table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        self.cx, params=(mark, size))
+                if df.empty:
+                    break
+                mark = int(df["_rowid"].iloc[-1])
+                yield source, df
+                if len(df) < size:
+                    break
+        if len(sources) > 1:
+            with self._lock:
+                self._attach(self.cx)
+
+    def export_changes(self, after: Dict[str, int]) -> Tuple[Dict[str, Set[str]], Dict[str, int]]:
+        """Days changed in tracks and track_points since the per-source seqs in `after` ("main"
+        or a partition's month), and the newest seq of every source.
+
+        A month in `after` whose partition has since been dropped counts as changed throughout.
+        """
+        days: Dict[str, Set[str]] = {table: set() for table in EXPORT_DAY}
+        marks: Dict[str, int] = {}
+        with self._lock:
+            for source in ["main", *sorted(self._parts)]:
+                schema = "main"
+                if source != "main":
+                    self._attach(self.cx, [source])
+                    schema = self._alias(source)
+                marks[source] = after.get(source, 0)
+                for tbl, day, seq in self.cx.execute(
+                        f"SELECT tbl, day, seq FROM {schema}.export_changes WHERE seq > ?", (marks[source],)):
+                    days[tbl].add(day)
+                    marks[source] = max(marks[source], seq)
+            self._attach(self.cx)
+        for month in set(after) - set(marks):
+            start = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+            days["track_points"].update((start + timedelta(days=i)).strftime("%Y-%m-%d")
+                                        for i in range((_month_end(month) - start).days))
+        return days, marks
+
+    def iter_table_days(self, table: str, days: Iterable[str],
+                        chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Rows of tracks or track_points whose UTC day (EXPORT_DAY column, 'unknown' when it does
+        not parse) is in `days`, as DataFrame chunks with `_rowid` and `date` columns.
+
+        Partitions are only read for their own month's days.
+        """
+        if table not in EXPORT_DAY:
+            raise ValueError(f"Unknown table {table!r}")
+        days = set(days)
+        sources = ["main"]
+        if table in _PARTITIONED:
+            sources += [m for m in sorted(self._parts) if any(d.startswith(m) for d in days)]
+        day = _day_sql(EXPORT_DAY[table])
+        size = chunk_size or self.chunk_size
+        wanted = json.dumps(sorted(days))
+        for source in sources:
+            mark = 0
+            while True:
+                with self._lock:
+                    if source != "main" and source not in self._parts:
+                        break
+                    schema = "main"
+                    if source != "main":
+                        self._attach(self.cx, [source])
+                        schema = self._alias(source)
+                    df = pd.read_sql_query(f"""
+                      SELECT rowid AS _rowid, *, {day} AS date FROM {schema}.{table}
+                      WHERE rowid > ? AND {day} IN (SELECT value FROM json_each(?))
+                      ORDER BY rowid LIMIT ?
+                    """, self.cx, params=(mark, wanted, size))
+                if df.empty:
+                    break
+                mark = int(df["_rowid"].iloc[-1])
+                yield df
+                if len(df) < size:
+                    break
+        if len(sources) > 1:
+            with self._lock:
+                self._attach(self.cx)
+
+    def iter_blob_points(self, days: Iterable[str], batch_size: int = 500) -> Iterator[pd.DataFrame]:
+        """Points of blob-stored tracks that fall on the given UTC days, `batch_size` tracks at a
+        time, as frames of track_id, timestamp, coordinates, speed, heading and date."""
+        days = set(days)
+        with self._lock:
+            ids = [r[0] for r in self.cx.execute(
+                "SELECT DISTINCT track_id FROM track_blob_days WHERE day IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(days)),))]
+        for chunk in _chunks(((t,) for t in ids), batch_size):
+            ids = [t for (t,) in chunk]
+            with self._lock:
+                blobs = self.cx.execute(f"""
+                  SELECT track_id, ts, latitude, longitude, altitude, speed, heading
+                  FROM track_blobs WHERE track_id IN ({','.join('?' * len(ids))})
+                """, ids).fetchall()
+            if not blobs:
+                continue
+            cols = [_unpack(packed) for _, *packed in blobs]
+            epoch = np.concatenate([c["ts"] for c in cols])
+            df = pd.DataFrame({
+                "track_id": np.repeat([b[0] for b in blobs], [len(c["ts"]) for c in cols]),
+                "timestamp": pd.to_datetime((epoch * 1e6).astype("int64"), unit="us", utc=True),
+                **{c: np.concatenate([p[c] for p in cols]) for c in _BLOB_COLS[1:]},
+            })
+            df["date"] = df["timestamp"].dt.strftime("%Y-%m-%d")
+            df = df[df["date"].isin(days)]
+            if len(df):
+                yield df.reset_index(drop=True)
+
+    def detection_points(self, limit: int = 1000) -> pd.DataFrame:
+        q = """
         SELECT id, device_id, timestamp, detection_type, confidence,
                latitude, longitude
         FROM detections
         WHERE latitude IS NOT NULL AND longitude IS NOT NULL
         ORDER BY timestamp DESC
-        LIMIT {limit}
+        LIMIT ?
+        """
+        with self._lock:
+            return typed_frame(pd.read_sql_query(q, self.cx, params=(int(limit),)))
+
+    def iter_detections(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        detection_type: Optional[str] = None, device_id: Optional[str] = None,
+                        located_only: bool = False, chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Timestamped detections in time order as typed chunks of at most `chunk_size` rows.
+
+        Pages by (timestamp, rowid) keyset so each chunk is an index range scan and the
+        store lock is only held while a chunk is read.
+        """
+        where, params = _time_filters("d", since, until, detection_type=detection_type, device_id=device_id)
+        if located_only:
+            where += " AND d.latitude IS NOT NULL AND d.longitude IS NOT NULL"
+        q = f"""
+        SELECT d.rowid AS _rowid, d.id, d.device_id, d.timestamp, d.detection_type, d.confidence,
+               d.latitude, d.longitude
+        FROM detections d
+        WHERE (d.timestamp, d.rowid) > (?, ?){where}
+        ORDER BY d.timestamp, d.rowid
+        LIMIT ?
         """
-        with sqlite3.connect(self.path) as cx:
-            return pd.read_sql_query(q, cx)
+        size = chunk_size or self.chunk_size
+        key: Tuple[str, int] = ("", 0)
+        while True:
+            with self._lock:
+                df = pd.read_sql_query(q, self.cx, params=[*key, *params, size])
+            if df.empty:
+                return
+            key = (df["timestamp"].iloc[-1], int(df["_rowid"].iloc[-1]))
+            yield typed_frame(df.drop(columns="_rowid"))
+            if len(df) < size:
+                return
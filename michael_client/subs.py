@@ -4,63 +4,210 @@ Created by Michael Wilson, Senior Software Engineer
 """
 
 from __future__ import annotations
-import json, logging
-from typing import Any, Dict, Optional, Callable, Awaitable
+import asyncio, contextlib, itertools, json, logging, random, time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Callable, Awaitable, Union
 import websockets
 from .config import MichaelConfig
-from .gql import SUB_DETECTIONS
+from .dedupe import BloomSeen, SeenIds
+from .gql import SUB_DETECTIONS, operation
+from .metrics import REGISTRY
 
 LOG = logging.getLogger("michael")
 
+# graphql-transport-ws close codes after which reconnecting cannot help
+_FATAL_CLOSE_CODES = {4400, 4401, 4403}
+# the backoff doubles up to ws_reconnect_max_s anyway; capping the exponent keeps a long
+# outage from overflowing the float conversion
+_MAX_BACKOFF_EXP = 16
+
+@dataclass
+class _Subscription:
+    id: str
+    query: str
+    variables: Dict[str, Any]
+    on_item: Callable[[Dict[str, Any]], Awaitable[None]]
+    field: Optional[str] = None
+    op: str = "subscription"  # operation name, used as the metrics label
+
 class michaelubs:
-    def __init__(self, cfg: MichaelConfig):
+    """Multiplexes any number of subscriptions over one graphql-transport-ws socket.
+
+    Register operations with `subscribe`/`add_detections`, then `run()`. The
+    connection answers server pings, sends its own keepalive pings, and on any
+    drop reconnects with jittered exponential backoff and re-subscribes every
+    operation that has not completed.
+
+    With `dedupe` set, items whose id was already delivered (reconnect replays,
+    overlapping operations, rows seeded from a backfill) are dropped before any
+    callback runs; `dedupe.stats()` reports the hit counts.
+    """
+
+    def __init__(self, cfg: MichaelConfig, dedupe: Optional[Union[SeenIds, BloomSeen]] = None):
         self.cfg = cfg
+        self.dedupe = dedupe
+        self._subs: Dict[str, _Subscription] = {}
+        self._ids = itertools.count(1)
+        self._ws: Optional[Any] = None
+        self._closed = False
+        self.reconnects = 0
+        self._healthy = False  # a `next` arrived on the current socket
+        self._acked_at: Optional[float] = None  # monotonic time of the current socket's ack
+        self.metrics = REGISTRY
 
-    async def detections(
+    @property
+    def active(self) -> int:
+        return len(self._subs)
+
+    def subscribe(self, query: str, on_item: Callable[[Dict[str, Any]], Awaitable[None]],
+                  variables: Optional[Dict[str, Any]] = None, field: Optional[str] = None) -> str:
+        """Register an operation; `on_item` receives data[field] (or the whole data dict)."""
+        sub = _Subscription(str(next(self._ids)), query, dict(variables or {}), on_item, field,
+                            operation(query)[1] or "subscription")
+        self._subs[sub.id] = sub
+        if self._ws is not None:
+            asyncio.ensure_future(self._send_subscribe(self._ws, sub))
+        return sub.id
+
+    async def unsubscribe(self, op_id: str):
+        if self._subs.pop(op_id, None) and self._ws is not None:
+            await self._ws.send(json.dumps({"id": op_id, "type": "complete"}))
+
+    def add_detections(
         self,
         on_item: Callable[[Dict[str, Any]], Awaitable[None]],
         device_id: Optional[str] = None,
         detection_type: Optional[str] = None,
         min_confidence: float = 0.5,
-    ):
+    ) -> str:
         variables = {
             "deviceId": device_id,
             "detectionType": detection_type,
             "minConfidence": min_confidence,
         }
         variables = {k: v for k, v in variables.items() if v is not None}
+        return self.subscribe(SUB_DETECTIONS, on_item, variables, field="detectionCreated")
+
+    async def detections(
+        self,
+        on_item: Callable[[Dict[str, Any]], Awaitable[None]],
+        device_id: Optional[str] = None,
+        detection_type: Optional[str] = None,
+        min_confidence: float = 0.5,
+    ):
+        self.add_detections(on_item, device_id, detection_type, min_confidence)
+        LOG.info("Listening for detections (min_confidence=%.2f)...", min_confidence)
+        await self.run()
 
-        async with websockets.connect(
-            self.cfg.ws_url,
-            subprotocols=["graphql-transport-ws"],
-        ) as ws:
-            # Init
-            await ws.send(json.dumps({"type": "connection_init", "payload": {
-                "x-token-id": self.cfg.token_id,
-                "x-token-value": self.cfg.token_value,
-            }}))
-
-            # Expect ack
+    def close(self):
+        self._closed = True
+        if self._ws is not None:
+            asyncio.ensure_future(self._ws.close())
+
+    async def run(self):
+        attempt = 0
+        while not self._closed and self._subs:
+            try:
+                async with websockets.connect(
+                    self.cfg.ws_url,
+                    subprotocols=["graphql-transport-ws"],
+                    ping_interval=self.cfg.ws_ping_interval_s,
+                ) as ws:
+                    await self._handshake(ws)
+                    self._healthy = False
+                    self._acked_at = time.monotonic()
+                    self._ws = ws
+                    for sub in list(self._subs.values()):
+                        await self._send_subscribe(ws, sub)
+                    keepalive = asyncio.create_task(self._keepalive(ws))
+                    try:
+                        await self._pump(ws)
+                    finally:
+                        keepalive.cancel()
+                        with contextlib.suppress(asyncio.CancelledError, websockets.ConnectionClosed):
+                            await keepalive
+            except websockets.ConnectionClosed as e:
+                code = getattr(e.rcvd, "code", None)
+                if code in _FATAL_CLOSE_CODES:
+                    raise
+                LOG.warning("Subscription socket closed (%s)", code)
+            except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+                LOG.warning("Subscription connection failed: %s", e)
+            finally:
+                self._ws = None
+            if self._closed or not self._subs:
+                break
+            # a socket that delivered data, or was acked and stayed up for a full backoff cap
+            # (quiet filters may see no data for a long time), resets the backoff; one that is
+            # accepted and then dropped straight away keeps growing the delay
+            if self._healthy or (self._acked_at is not None
+                                 and time.monotonic() - self._acked_at >= self.cfg.ws_reconnect_max_s):
+                attempt = 0
+            self._healthy = False
+            self._acked_at = None
+            cap = min(self.cfg.ws_reconnect_max_s,
+                      self.cfg.ws_reconnect_base_s * 2 ** min(attempt, _MAX_BACKOFF_EXP))
+            delay = random.uniform(0, cap)
+            attempt += 1
+            self.reconnects += 1
+            self.metrics.inc("michael_sub_reconnects_total")
+            LOG.info("Reconnecting in %.1fs (%d active subscriptions)", delay, len(self._subs))
+            await asyncio.sleep(delay)
+
+    async def _handshake(self, ws):
+        # Init
+        await ws.send(json.dumps({"type": "connection_init", "payload": {
+            "x-token-id": self.cfg.token_id,
+            "x-token-value": self.cfg.token_value,
+        }}))
+
+        # Expect ack
+        async def ack():
             while True:
                 msg = json.loads(await ws.recv())
                 if msg.get("type") == "connection_ack":
-                    break
-
-            # Subscribe
-            await ws.send(json.dumps({
-                "id": "1",
-                "type": "subscribe",
-                "payload": {"query": SUB_DETECTIONS, "variables": variables},
-            }))
-
-            LOG.info("Listening for detections (min_confidence=%.2f)...", min_confidence)
-            async for raw in ws:
-                evt = json.loads(raw)
-                if evt.get("type") == "next":
-                    payload = evt.get("payload", {}).get("data", {})
-                    det = payload.get("detectionCreated")
-                    if det:
-                        await on_item(det)
-                elif evt.get("type") in ("error", "complete"):
-                    LOG.info("Subscription finished: %s", evt.get("type"))
-                    break
+                    return
+                if msg.get("type") == "ping":
+                    await ws.send(json.dumps({"type": "pong"}))
+        await asyncio.wait_for(ack(), self.cfg.ws_ack_timeout_s)
+
+    async def _send_subscribe(self, ws, sub: _Subscription):
+        await ws.send(json.dumps({
+            "id": sub.id,
+            "type": "subscribe",
+            "payload": {"query": sub.query, "variables": sub.variables},
+        }))
+
+    async def _keepalive(self, ws):
+        while True:
+            await asyncio.sleep(self.cfg.ws_ping_interval_s)
+            await ws.send(json.dumps({"type": "ping"}))
+
+    async def _pump(self, ws):
+        async for raw in ws:
+            evt = json.loads(raw)
+            typ = evt.get("type")
+            if typ == "next":
+                self._healthy = True
+                sub = self._subs.get(evt.get("id"))
+                if sub is None:
+                    continue
+                data = evt.get("payload", {}).get("data") or {}
+                item = data.get(sub.field) if sub.field else data
+                if not item:
+                    continue
+                if self.dedupe is not None and isinstance(item, dict) and item.get("id") is not None:
+                    if self.dedupe.seen(item["id"]):
+                        self.metrics.inc("michael_sub_duplicates_total", op=sub.op)
+                        continue
+                started = time.perf_counter()
+                await sub.on_item(item)
+                self.metrics.observe("michael_sub_callback_seconds", time.perf_counter() - started, op=sub.op)
+                self.metrics.inc("michael_sub_messages_total", op=sub.op)
+            elif typ == "ping":
+                await ws.send(json.dumps({"type": "pong"}))
+            elif typ in ("error", "complete"):
+                LOG.info("Subscription %s finished: %s %s", evt.get("id"), typ, evt.get("payload") or "")
+                self._subs.pop(evt.get("id"), None)
+                if not self._subs:
+                    return
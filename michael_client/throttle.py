@@ -0,0 +1,134 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+import asyncio, random, time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while an endpoint's breaker is open."""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt: int, base_s: float, max_s: float) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max_s, base_s * 2**(attempt-1))]."""
+    return random.uniform(0.0, min(max_s, base_s * (2 ** max(0, attempt - 1))))
+
+class TokenBucket:
+    """Admits `rate` requests per second on average with bursts of up to `burst`; rate <= 0 disables it."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:  # FIFO: waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AIMDLimiter:
+    """Concurrency limit that grows by one slot per window of successes and halves on throttling.
+
+    Decreases are applied at most once per `cooldown_s`, so a burst of rejections
+    from one overloaded moment only shrinks the limit once.
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 decrease: float = 0.5, cooldown_s: float = 1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.decrease = decrease
+        self.cooldown_s = cooldown_s
+        self.in_flight = 0
+        self._last_cut = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_cut >= self.cooldown_s:
+            self._last_cut = now
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failures; after `reset_s` one trial request is let through.
+
+    A successful trial closes the breaker, a failed one re-opens it for another `reset_s`;
+    a trial that never reports back (cancelled) is replaced after `reset_s`.
+    """
+
+    def __init__(self, failures: int = 5, reset_s: float = 30.0):
+        self.failures = failures
+        self.reset_s = reset_s
+        self.state = "closed"
+        self._count = 0
+        self._opened_at = 0.0
+        self._trial_at: Optional[float] = None
+
+    def before_call(self, name: str = ""):
+        if self.failures <= 0 or self.state == "closed":
+            return
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self._opened_at < self.reset_s:
+                raise CircuitOpenError(f"Circuit open for {name or 'endpoint'}; retry in "
+                                       f"{self.reset_s - (now - self._opened_at):.1f}s")
+            self.state = "half_open"
+            self._trial_at = None
+        if self._trial_at is not None and now - self._trial_at < self.reset_s:
+            raise CircuitOpenError(f"Circuit half-open for {name or 'endpoint'}; trial request in flight")
+        self._trial_at = now
+
+    def record_success(self):
+        self.state = "closed"
+        self._count = 0
+        self._trial_at = None
+
+    def record_failure(self):
+        self._count += 1
+        if self.state == "half_open" or (self.failures > 0 and self._count >= self.failures):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._trial_at = None
@@ -0,0 +1,136 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from __future__ import annotations
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .geo import haversine_m
+
+# Everything below works on the flat column batches produced by
+# michaeltore.iter_track_columns: per-point arrays sorted by track then time,
+# with "track" indexing into the per-track "track_id"/"device_id" arrays.
+
+def segments(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Per-point segment metrics (the segment ending at each point).
+
+    `same` is False at the first point of every track, where dist/dt are 0 and
+    speed is NaN.
+    """
+    track, ts, lat, lon = cols["track"], cols["ts"], cols["latitude"], cols["longitude"]
+    n = len(ts)
+    same = np.zeros(n, dtype=bool)
+    same[1:] = track[1:] == track[:-1]
+    dist = np.zeros(n)
+    dt = np.zeros(n)
+    if n > 1:
+        dist[1:] = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        dt[1:] = ts[1:] - ts[:-1]
+    dist[~same] = 0.0
+    dt[~same] = 0.0
+    speed = np.full(n, np.nan)
+    np.divide(dist, dt, out=speed, where=dt > 0)
+    return {"same": same, "dist_m": dist, "dt_s": dt, "speed_mps": speed}
+
+def _bounds(same: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    starts = np.flatnonzero(~same)
+    ends = np.r_[starts[1:], len(same)] - 1
+    return starts, ends
+
+def summarize(cols: Dict[str, np.ndarray], seg: Optional[Dict[str, np.ndarray]] = None,
+              moving_mps: float = 0.5) -> pd.DataFrame:
+    """One row per track: points, time span, distance, average/max speed and moving time."""
+    seg = seg or segments(cols)
+    if not len(cols["ts"]):
+        return pd.DataFrame(columns=["track_id", "device_id", "n_points", "start", "end", "duration_s",
+                                     "distance_m", "avg_speed_mps", "max_speed_mps", "moving_time_s"])
+    starts, ends = _bounds(seg["same"])
+    ts = cols["ts"]
+    duration = ts[ends] - ts[starts]
+    distance = np.add.reduceat(seg["dist_m"], starts)
+    max_speed = np.maximum.reduceat(np.nan_to_num(seg["speed_mps"], nan=-np.inf), starts)
+    moving = np.add.reduceat(np.where(seg["speed_mps"] >= moving_mps, seg["dt_s"], 0.0), starts)
+    idx = cols["track"][starts]
+    return pd.DataFrame({
+        "track_id": cols["track_id"][idx],
+        "device_id": cols["device_id"][idx],
+        "n_points": ends - starts + 1,
+        "start": pd.to_datetime(ts[starts], unit="s", utc=True),
+        "end": pd.to_datetime(ts[ends], unit="s", utc=True),
+        "duration_s": duration,
+        "distance_m": distance,
+        "avg_speed_mps": np.divide(distance, duration, out=np.full(len(starts), np.nan), where=duration > 0),
+        "max_speed_mps": np.where(np.isfinite(max_speed), max_speed, np.nan),
+        "moving_time_s": moving,
+    })
+
+def stops(cols: Dict[str, np.ndarray], seg: Optional[Dict[str, np.ndarray]] = None,
+          max_speed_mps: float = 0.5, min_duration_s: float = 120.0) -> pd.DataFrame:
+    """Dwell segments: runs of consecutive segments slower than `max_speed_mps` lasting `min_duration_s`."""
+    seg = seg or segments(cols)
+    slow = seg["same"] & (np.nan_to_num(seg["speed_mps"], nan=np.inf) < max_speed_mps)
+    edges = np.diff(np.r_[0, slow.astype(np.int8), 0])
+    first_seg = np.flatnonzero(edges == 1)
+    last_seg = np.flatnonzero(edges == -1) - 1
+    # a run of slow segments i..j spans points i-1..j; runs never cross tracks since same[start] is False
+    p0, p1 = first_seg - 1, last_seg
+    ts = cols["ts"]
+    duration = ts[p1] - ts[p0]
+    keep = duration >= min_duration_s
+    p0, p1, duration = p0[keep], p1[keep], duration[keep]
+    counts = p1 - p0 + 1
+    clat = np.r_[0.0, np.cumsum(cols["latitude"])]
+    clon = np.r_[0.0, np.cumsum(cols["longitude"])]
+    idx = cols["track"][p0]
+    return pd.DataFrame({
+        "track_id": cols["track_id"][idx],
+        "device_id": cols["device_id"][idx],
+        "start": pd.to_datetime(ts[p0], unit="s", utc=True),
+        "end": pd.to_datetime(ts[p1], unit="s", utc=True),
+        "duration_s": duration,
+        "n_points": counts,
+        "latitude": (clat[p1 + 1] - clat[p0]) / counts,
+        "longitude": (clon[p1 + 1] - clon[p0]) / counts,
+    })
+
+def daily_distance(cols: Dict[str, np.ndarray], seg: Optional[Dict[str, np.ndarray]] = None) -> pd.DataFrame:
+    """Distance per device per UTC day; each segment counts toward the day it ends in."""
+    seg = seg or segments(cols)
+    mask = seg["dist_m"] > 0
+    day = (cols["ts"][mask] // 86400).astype("int64")
+    device = cols["device_id"][cols["track"][mask]]
+    df = pd.DataFrame({"device_id": device, "day": day, "distance_m": seg["dist_m"][mask]})
+    out = df.groupby(["device_id", "day"], dropna=False, sort=True)["distance_m"].sum().reset_index()
+    out["date"] = pd.to_datetime(out.pop("day"), unit="D").dt.date
+    return out[["device_id", "date", "distance_m"]]
+
+class TrackAnalytics:
+    """Runs the vectorised track metrics over a store, a batch of tracks at a time."""
+
+    def __init__(self, store, batch_size: int = 500, moving_mps: float = 0.5,
+                 stop_speed_mps: float = 0.5, min_stop_s: float = 120.0):
+        self.store = store
+        self.batch_size = batch_size
+        self.moving_mps = moving_mps
+        self.stop_speed_mps = stop_speed_mps
+        self.min_stop_s = min_stop_s
+
+    def run(self, track_ids: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+        summaries, dwell, daily = [], [], []
+        for cols in self.store.iter_track_columns(track_ids, batch_size=self.batch_size):
+            seg = segments(cols)
+            summaries.append(summarize(cols, seg, self.moving_mps))
+            dwell.append(stops(cols, seg, self.stop_speed_mps, self.min_stop_s))
+            daily.append(daily_distance(cols, seg))
+        if not summaries:
+            empty = {"ts": np.empty(0), "track": np.empty(0, dtype="int32"), "track_id": np.empty(0, dtype=object),
+                     "device_id": np.empty(0, dtype=object), "latitude": np.empty(0), "longitude": np.empty(0)}
+            summaries, dwell, daily = [summarize(empty)], [stops(empty)], [daily_distance(empty)]
+        per_day = pd.concat(daily, ignore_index=True)
+        per_day = per_day.groupby(["device_id", "date"], dropna=False, sort=True)["distance_m"].sum().reset_index()
+        return {
+            "tracks": pd.concat(summaries, ignore_index=True),
+            "stops": pd.concat(dwell, ignore_index=True),
+            "daily_distance": per_day,
+        }
@@ -4,10 +4,17 @@ Created by Michael Wilson, Senior Software Engineer
 """
 
 from __future__ import annotations
+import math
+from typing import Optional
+import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
 
+def grid_cell_deg(zoom: int, cells_per_tile: int = 16) -> float:
+    """Grid cell size (degrees) giving roughly `cells_per_tile` cells across a web-map tile at `zoom`."""
+    return 360.0 / (2 ** zoom) / cells_per_tile
+
 class MichaelViz:
     @staticmethod
     def dashboard(df: pd.DataFrame) -> go.Figure:
@@ -19,14 +26,14 @@ class MichaelViz:
             ),
             specs=[[{}, {}], [{}, {}]]
         )
-        daily = df.groupby("date")["detection_count"].sum().reset_index()
+        daily = df.groupby("date", observed=True)["detection_count"].sum().reset_index()
         fig.add_scatter(x=daily["date"], y=daily["detection_count"], mode="lines+markers", row=1, col=1)
         fig.add_histogram(x=df["avg_confidence"], nbinsx=20, row=1, col=2)
 
-        by_type = df.groupby("detection_type")["detection_count"].sum()
+        by_type = df.groupby("detection_type", observed=True)["detection_count"].sum()
         fig.add_bar(x=by_type.index, y=by_type.values, row=2, col=1)
 
-        by_device = df.groupby("device_id")["detection_count"].sum()
+        by_device = df.groupby("device_id", observed=True)["detection_count"].sum()
         fig.add_bar(x=by_device.index, y=by_device.values, row=2, col=2)
 
         fig.update_layout(height=600, showlegend=False, title_text="Detections (last window)")
@@ -35,8 +42,8 @@ class MichaelViz:
     @staticmethod
     def map(points: pd.DataFrame) -> go.Figure:
         fig = go.Figure()
-        for dtype, chunk in points.groupby("detection_type"):
-            fig.add_trace(go.Scattermapbox(
+        for dtype, chunk in points.groupby("detection_type", observed=True):
+            fig.add_trace(go.Scattermap(
                 lat=chunk["latitude"], lon=chunk["longitude"],
                 mode="markers", marker=dict(size=8), name=str(dtype),
                 hovertemplate="<b>%{text}</b><br>Conf: %{customdata[0]:.2f}<br>"
@@ -47,8 +54,45 @@ class MichaelViz:
         lat_center = float(points["latitude"].mean()) if not points.empty else 0.0
         lon_center = float(points["longitude"].mean()) if not points.empty else 0.0
         fig.update_layout(
-            mapbox=dict(style="open-street-map", center=dict(lat=lat_center, lon=lon_center), zoom=10),
+            map=dict(style="open-street-map", center=dict(lat=lat_center, lon=lon_center), zoom=10),
             title="Detection Locations",
             height=600
         )
         return fig
+
+    @staticmethod
+    def density_map(grid: pd.DataFrame, zoom: Optional[int] = None) -> go.Figure:
+        """Map of pre-binned cells (michaeltore.detection_grid): a density layer plus sized cluster markers.
+
+        Figure size depends on the number of cells, not on the number of detections.
+        """
+        fig = go.Figure()
+        if not grid.empty:
+            counts = grid["count"].to_numpy(dtype=float)
+            fig.add_trace(go.Densitymap(
+                lat=grid["latitude"], lon=grid["longitude"], z=np.log1p(counts),
+                radius=20, colorscale="YlOrRd", showscale=False, name="density", hoverinfo="skip",
+            ))
+            fig.add_trace(go.Scattermap(
+                lat=grid["latitude"], lon=grid["longitude"], mode="markers", name="clusters",
+                marker=dict(size=np.clip(4 + 3 * np.sqrt(counts), 4, 40), color="#1f77b4", opacity=0.6),
+                text=grid["top_type"].astype(str),
+                customdata=np.column_stack([counts, grid["avg_confidence"].to_numpy(dtype=float)]),
+                hovertemplate="<b>%{customdata[0]:,.0f} detections</b><br>Top type: %{text}<br>"
+                              "Avg conf: %{customdata[1]:.2f}<extra></extra>",
+            ))
+            weights = counts / counts.sum()
+            lat_center = float(np.dot(grid["latitude"], weights))
+            lon_center = float(np.dot(grid["longitude"], weights))
+            if zoom is None:
+                span = max(float(np.ptp(grid["latitude"])), float(np.ptp(grid["longitude"])), 1e-3)
+                zoom = int(max(0, min(15, math.log2(360.0 / span))))
+        else:
+            lat_center = lon_center = 0.0
+        fig.update_layout(
+            map=dict(style="open-street-map", center=dict(lat=lat_center, lon=lon_center),
+                        zoom=10 if zoom is None else zoom),
+            title="Detection Density",
+            height=600
+        )
+        return fig
@@ -0,0 +1,82 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import os
+from datetime import datetime, timezone
+import pytest
+from michael_client.store import michaeltore
+
+pytest.importorskip("pyarrow")
+from michael_client import columnar  # noqa: E402
+from michael_client.columnar import ColumnarStore, export_store  # noqa: E402
+
+def _track(track_id, day, speed=1.0):
+    points = [{"timestamp": f"2025-03-{day:02d}T{h:02d}:00:00+00:00", "speed": speed, "heading": 0.0,
+               "location": {"latitude": 10.0 + h / 100, "longitude": 20.0, "altitude": 0.0}} for h in range(4)]
+    return {"id": track_id, "deviceId": "dev-1", "startTime": points[0]["timestamp"],
+            "endTime": points[-1]["timestamp"], "points": points}
+
+def _files(root, table):
+    found = {}
+    for dirpath, _, names in os.walk(os.path.join(root, table)):
+        for name in names:
+            found[os.path.join(dirpath, name)] = os.stat(os.path.join(dirpath, name)).st_ino
+    return found
+
+@pytest.mark.parametrize("opts", [{}, {"partitioned": True}, {"compact_points": True}])
+def test_export_rewrites_only_changed_days(tmp_path, opts):
+    root = str(tmp_path / "export")
+    with michaeltore(str(tmp_path / "michael.db"), **opts) as store:
+        store.save_tracks([_track("a", 1), _track("b", 2)])
+        first = export_store(store, root)
+        assert first["tracks"] == 2
+        assert first["track_points"] + first["track_points_compact"] == 8
+
+        again = export_store(store, root)
+        assert again["tracks"] == again["track_points"] == again["track_points_compact"] == 0
+
+        before = _files(root, "track_points")
+        store.save_tracks([_track("b", 2, speed=5.0)])
+        third = export_store(store, root)
+        assert third["track_points"] + third["track_points_compact"] == 4
+        after = _files(root, "track_points")
+        day1 = [p for p in before if "date=2025-03-01" in p]
+        assert day1 and all(after.get(p) == before[p] for p in day1)
+
+    points = ColumnarStore(root).read("track_points").to_pandas()
+    assert len(points) == 8
+    assert sorted(points.groupby("track_id")["speed"].max()) == [1.0, 5.0]
+
+def test_export_drops_days_left_empty(tmp_path):
+    root = str(tmp_path / "export")
+    with michaeltore(str(tmp_path / "michael.db")) as store:
+        store.save_tracks([_track("a", 1), _track("b", 2)])
+        export_store(store, root)
+        store.apply_retention({"tracks": 0}, now=datetime(2025, 3, 2, tzinfo=timezone.utc))
+        export_store(store, root)
+    points = ColumnarStore(root).read("track_points").to_pandas()
+    assert set(points["track_id"]) == {"b"}
+    assert not os.path.exists(os.path.join(root, "track_points", "date=2025-03-01"))
+
+def test_next_export_finishes_an_interrupted_swap(tmp_path, monkeypatch):
+    root = str(tmp_path / "export")
+    with michaeltore(str(tmp_path / "michael.db")) as store:
+        store.save_tracks([_track("a", 1), _track("b", 2)])
+        export_store(store, root)
+        store.save_tracks([_track("a", 1, speed=5.0)])
+        real = os.replace
+
+        def crash(src, dst):
+            if os.path.basename(src) == "date=2025-03-01":  # after the old day was moved aside
+                raise OSError("crashed")
+            real(src, dst)
+
+        monkeypatch.setattr(columnar.os, "replace", crash)
+        with pytest.raises(OSError):
+            export_store(store, root)
+        monkeypatch.setattr(columnar.os, "replace", real)
+        export_store(store, root)
+    points = ColumnarStore(root).read("track_points").to_pandas()
+    assert len(points) == 8
+    assert sorted(points.groupby("track_id")["speed"].max()) == [1.0, 5.0]
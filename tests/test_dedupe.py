@@ -0,0 +1,37 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from michael_client.dedupe import SeenIds
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_ids_expire_ttl_after_last_seen():
+    clock = _Clock()
+    ids = SeenIds(ttl_s=10, clock=clock)
+    assert not ids.seen("a")
+    clock.now = 4
+    assert not ids.seen("b")
+    clock.now = 9
+    assert ids.seen("a")  # refreshed: now kept until t=19
+    clock.now = 15
+    assert not ids.seen("b")  # b was last seen at t=4
+    assert ids.seen("a")
+    clock.now = 26
+    assert not ids.seen("a")
+    assert ids.stats()["size"] == 1
+
+def test_hits_do_not_keep_stale_entries_alive():
+    clock = _Clock()
+    ids = SeenIds(ttl_s=10, clock=clock)
+    ids.seen("old")
+    clock.now = 5
+    ids.seen("new")
+    ids.seen("new")
+    clock.now = 14
+    assert not ids.seen("old")
@@ -0,0 +1,46 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import asyncio, json
+import pytest
+from michael_client import http
+
+class _Body:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self.data), n):
+            yield self.data[i:i + n]
+
+def _collect(data: bytes, chunk_size: int):
+    async def run():
+        return [item async for item in http._iter_array(_Body(data), "tracks", chunk_size)]
+    return asyncio.run(run())
+
+TRACKS = [
+    {"id": 't"1\\', "name": "ünïcode ✓", "points": [{"xy": [1.5, -2]}, {"note": "a,b]}{["}]},
+    {"id": "t2", "points": []},
+    7, "plain", None, [1, [2, [3]]],
+]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 16])
+def test_elements_survive_any_chunking(chunk_size):
+    body = json.dumps({"data": {"other": [0], "tracks": TRACKS, "after": 1}}, ensure_ascii=False).encode()
+    assert _collect(body, chunk_size) == TRACKS
+
+def test_each_element_is_decoded_once(monkeypatch):
+    big = [{"id": str(i), "points": [{"lat": j * 0.1, "lon": -j} for j in range(2000)]} for i in range(5)]
+    body = json.dumps({"data": {"tracks": big}}).encode()
+    calls = []
+    monkeypatch.setattr(http, "_loads", lambda s: calls.append(len(s)) or json.loads(s))
+    assert _collect(body, 1024) == big
+    assert len(calls) == len(big)
+
+def test_truncated_array_raises():
+    with pytest.raises(ValueError, match="inside the 'tracks' array"):
+        _collect(b'{"data": {"tracks": [{"id": 1}, {"id"', 8)
+
+def test_missing_array_yields_nothing():
+    assert _collect(b'{"data": null, "errors": [{"message": "nope"}]}', 8) == []
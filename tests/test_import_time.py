@@ -0,0 +1,17 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import subprocess, sys
+
+HEAVY = ("pandas", "numpy", "plotly", "pyarrow", "aiohttp", "websockets")
+
+_PROBE = f"""
+import sys
+import michael_client, michael_client.cli
+print(",".join(m for m in {HEAVY!r} if m in sys.modules and type(sys.modules[m]).__name__ != "_LazyModule"))
+"""
+
+def test_cli_import_loads_no_heavy_modules():
+    out = subprocess.run([sys.executable, "-c", _PROBE], check=True, capture_output=True, text=True).stdout
+    assert out.strip() == ""
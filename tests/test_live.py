@@ -0,0 +1,67 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import pytest
+from michael_client.live import ANY, LiveAggregator, Rule, _Ring
+
+def _det(dtype="PERSON", dev="cam-1", conf=0.9):
+    return {"id": "x", "detectionType": dtype, "deviceId": dev, "confidence": conf}
+
+def test_ring_window_wraps_and_zeroes_overtaken_slots():
+    ring = _Ring(4)
+    for slot in range(6):  # slots 4 and 5 reuse the cells of 0 and 1
+        ring.add(slot, 0.1 * slot)
+    assert ring.totals(5, 4)[0] == 4  # slots 2..5, a window across the end of the ring
+    count, conf_n, conf_sum, conf_min, conf_max = ring.totals(5, 2)
+    assert (count, conf_n) == (2, 2)
+    assert conf_min == pytest.approx(0.4) and conf_max == pytest.approx(0.5)
+    assert ring.totals(7, 4)[0] == 2  # reading later zeroes slots 6 and 7 on the way
+    assert ring.totals(20, 4)[0] == 0  # everything overtaken
+    ring.add(20, None)
+    assert ring.totals(20, 10)[:2] == (1, 0)  # k is capped at the ring size
+
+def test_threshold_rule_count_cooldown_and_per_device():
+    rule = Rule("burst", threshold=3, window_s=10, per_device=True, cooldown_s=30)
+    agg = LiveAggregator([rule], clock=lambda: 0.0)
+    assert agg.observe(_det(dev="a"), now=1) == []
+    assert agg.observe(_det(dev="b"), now=2) == []
+    assert agg.observe(_det(dev="a"), now=3) == []
+    alerts = agg.observe(_det(dev="a"), now=4)
+    assert [(a.key, a.value) for a in alerts] == [((ANY, "a"), 3)]
+    assert agg.observe(_det(dev="a"), now=5) == []  # cooling down
+    assert agg.observe(_det(dev="a"), now=40) == []  # earlier ones left the window
+    assert agg.stats(device_id="a", window_s=10, now=40)["count"] == 1
+
+def test_threshold_rule_below_needs_min_count():
+    rule = Rule("weak", metric="mean_conf", threshold=0.4, below=True, min_count=3, window_s=60)
+    agg = LiveAggregator([rule], clock=lambda: 0.0)
+    assert agg.observe(_det(conf=0.1), now=1) == []
+    assert agg.observe(_det(conf=0.2), now=2) == []
+    alerts = agg.observe(_det(conf=0.3), now=3)
+    assert len(alerts) == 1 and alerts[0].value == pytest.approx(0.2)
+
+def test_spike_needs_a_baseline():
+    rule = Rule("surge", kind="spike", window_s=10, baseline_s=100, factor=3, cooldown_s=0)
+    agg = LiveAggregator([rule], clock=lambda: 0.0)
+    assert agg.observe(_det(), now=1000) == []  # a lone detection after a quiet baseline
+    for t in range(1000, 1090, 30):  # steady baseline: one per 30 s
+        agg.observe(_det(), now=t)
+    alerts = []
+    for t in range(1091, 1100):
+        alerts += agg.observe(_det(), now=t)
+    assert alerts and alerts[-1].value >= 3
+    assert alerts[-1].stats["baseline_rate"] > 0
+
+def test_spike_off_an_empty_baseline_when_allowed():
+    rule = Rule("first", kind="spike", window_s=10, baseline_s=100, min_baseline=0)
+    agg = LiveAggregator([rule], clock=lambda: 0.0)
+    (alert,) = agg.observe(_det(), now=1000)
+    assert alert.value == float("inf") and alert.metadata()["value"] is None
+
+def test_prune_forgets_idle_keys():
+    agg = LiveAggregator([Rule("any", threshold=100)], window_s=10, clock=lambda: 0.0)
+    agg.observe(_det(dev="a"), now=1)
+    agg.stats(device_id="a", now=5)  # reads do not count as activity
+    agg.prune(now=500)
+    assert agg.snapshot(now=500) == [] and not agg._rings
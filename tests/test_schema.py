@@ -0,0 +1,27 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import asyncio
+from michael_client.config import MichaelConfig
+from michael_client.schema import SchemaCache
+
+class _HTTP:
+    def __init__(self, res):
+        self.res = res
+        self.calls = 0
+
+    async def execute(self, query, variables=None):
+        self.calls += 1
+        return self.res
+
+def test_refused_introspection_is_cached(tmp_path):
+    cache = SchemaCache(MichaelConfig(), path=str(tmp_path / "schema.json"), ttl_s=60)
+    http = _HTTP({"errors": [{"message": "introspection is disabled"}]})
+    assert asyncio.run(cache.get(http)) is None
+    assert asyncio.run(cache.get(http)) is None
+    assert http.calls == 1
+    http.res = {"data": {"__schema": {"types": []}}}
+    assert asyncio.run(cache.get(http, refresh=True)) == {"types": []}
+    assert asyncio.run(cache.get(http)) == {"types": []}
+    assert http.calls == 2
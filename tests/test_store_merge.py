@@ -0,0 +1,45 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import pytest
+from michael_client.metrics import REGISTRY
+from michael_client.store import michaeltore
+
+def _device(i):
+    return {"id": f"dev-{i}", "name": f"Device {i}", "type": "CAMERA", "status": "ONLINE",
+            "location": {"latitude": 1.0 * i, "longitude": 2.0, "altitude": 0.0}}
+
+def _track(i, speed=1.0):
+    points = [{"timestamp": f"2025-03-{1 + i % 20:02d}T00:{j:02d}:00+00:00", "speed": speed,
+               "location": {"latitude": 10.0 + j, "longitude": 20.0}} for j in range(10)]
+    return {"id": f"trk-{i}", "deviceId": f"dev-{i % 5}", "startTime": points[0]["timestamp"],
+            "endTime": points[-1]["timestamp"], "points": points}
+
+def _shard(path, **opts):
+    with michaeltore(path, **opts) as store:
+        store.save_devices([_device(i) for i in range(5)])
+        store.save_tracks([_track(i) for i in range(50)])
+
+def test_save_tracks_counts_points_separately(tmp_path):
+    REGISTRY.reset()
+    _shard(str(tmp_path / "shard.db"))
+    assert REGISTRY.counter("michael_store_rows_total", table="tracks") == 50
+    assert REGISTRY.counter("michael_store_rows_total", table="track_points") == 500
+
+@pytest.mark.parametrize("opts", [{}, {"partitioned": True}, {"compact_points": True}])
+def test_merging_the_same_shard_again_changes_nothing(tmp_path, opts):
+    shard = str(tmp_path / "shard.db")
+    _shard(shard, compact_points=opts.get("compact_points", False))
+    with michaeltore(str(tmp_path / "michael.db"), **opts) as store:
+        first = store.merge_from(shard)
+        assert (first["devices"], first["tracks"]) == (5, 50)
+        assert first.get("track_points", 0) + first.get("track_blobs", 0) == (50 if opts.get("compact_points") else 500)
+        assert not any(store.merge_from(shard).values())
+    with michaeltore(shard, compact_points=opts.get("compact_points", False)) as src:
+        src.save_tracks([_track(3, speed=9.0)])
+    with michaeltore(str(tmp_path / "michael.db"), **opts) as store:
+        third = store.merge_from(shard)
+        assert third["tracks"] == 0 and third["devices"] == 0
+        assert third.get("track_points", 0) + third.get("track_blobs", 0) == \
+            (1 if opts.get("compact_points") else 10)
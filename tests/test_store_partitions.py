@@ -0,0 +1,79 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+import pytest
+from michael_client.store import michaeltore
+
+NOW = datetime.now(timezone.utc)
+
+def _detections(lo: int, hi: int):
+    # four per hour, so 3000 rows span about a month back from now
+    return [{"id": str(i), "deviceId": f"dev-{i % 5}", "detectionType": "PERSON", "confidence": 0.5,
+             "timestamp": (NOW - timedelta(minutes=15 * i)).isoformat()} for i in range(lo, hi)]
+
+def _counts(store: michaeltore):
+    cx = store.cx
+    return (cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0],
+            cx.execute("SELECT SUM(n) FROM detection_rollup_day").fetchone()[0],
+            cx.execute("SELECT SUM(n) FROM detection_rollup_hour").fetchone()[0],
+            int(store.recent_detection_analytics(days=400)["detection_count"].sum()))
+
+def test_migrate_then_rebuild_rollups_keeps_counts(tmp_path):
+    path = str(tmp_path / "michael.db")
+    with michaeltore(path) as store:
+        store.save_detections(_detections(0, 3000))
+    with michaeltore(path, partitioned=True) as store:
+        store.save_detections(_detections(3000, 3500))
+        assert _counts(store) == (3500,) * 4
+        store.rebuild_rollups()
+        assert _counts(store) == (3500,) * 4
+
+def _monthly(months, per_month=10, prefix="m"):
+    # per_month detections on the 10th of each 2025 month
+    return [{"id": f"{prefix}{m}-{i}", "deviceId": "dev-1", "detectionType": "CAR", "confidence": 0.5,
+             "timestamp": datetime(2025, m, 10, i, tzinfo=timezone.utc).isoformat()}
+            for m in months for i in range(per_month)]
+
+def _part_files(store: michaeltore):
+    return sorted(f for f in os.listdir(store.parts_dir) if f.endswith(".db"))
+
+def test_retention_expires_whole_months_and_keeps_their_rollups(tmp_path):
+    path = str(tmp_path / "michael.db")
+    with michaeltore(path, partitioned=True) as store:
+        store.save_detections(_monthly(range(1, 7)))
+        assert _part_files(store) == [f"2025-0{m}.db" for m in range(1, 7)]
+        removed = store.apply_retention({"detections": 90}, now=datetime(2025, 6, 15, tzinfo=timezone.utc))
+        assert removed["detections"] == 20  # January and February, whose whole month is past the cutoff
+        assert _part_files(store) == [f"2025-0{m}.db" for m in range(3, 7)]
+        assert store.cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 40
+        assert store.cx.execute("SELECT SUM(n) FROM detection_rollup_day").fetchone()[0] == 60
+        store.rebuild_rollups()
+        assert store.cx.execute("SELECT SUM(n) FROM detection_rollup_day").fetchone()[0] == 60
+
+def test_merge_into_partitioned_store(tmp_path):
+    shard = str(tmp_path / "shard.db")
+    with michaeltore(shard) as store:
+        store.save_detections(_monthly([1, 2, 3]))
+    with michaeltore(str(tmp_path / "michael.db"), partitioned=True) as store:
+        store.save_detections(_monthly([3], prefix="local"))
+        counts = store.merge_from(shard)
+        assert counts["detections"] == 30
+        assert store.merge_from(shard)["detections"] == 0
+        assert store.cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 40
+        assert store.cx.execute("SELECT SUM(n) FROM detection_rollup_day").fetchone()[0] == 40
+        assert _part_files(store) == ["2025-01.db", "2025-02.db", "2025-03.db"]
+
+def test_layouts_beyond_the_attach_slots_are_refused(tmp_path):
+    with michaeltore(str(tmp_path / "michael.db"), partitioned=True) as store:
+        store.save_detections(_monthly(range(1, 10)))
+        with pytest.raises(ValueError, match="monthly partitions"):
+            store.save_detections(_monthly([10]))
+        assert store.cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 90
+        with pytest.raises(ValueError, match="monthly partitions"):
+            store.apply_retention({"detections": 365}, now=datetime(2025, 9, 30, tzinfo=timezone.utc))
+        store.apply_retention({"detections": 200}, now=datetime(2025, 9, 30, tzinfo=timezone.utc))
+        store.save_detections(_monthly([10]))  # January and February are gone, so October fits
+        assert store.cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 80
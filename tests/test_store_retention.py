@@ -0,0 +1,26 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+from datetime import datetime, timedelta, timezone
+from michael_client.store import michaeltore
+
+NOW = datetime(2025, 6, 30, 12, tzinfo=timezone.utc)
+
+def _detections(n: int, step: timedelta = timedelta(hours=1)):
+    return [{"id": str(i), "deviceId": f"dev-{i % 3}", "detectionType": "PERSON", "confidence": 0.5,
+             "timestamp": (NOW - step * i).isoformat()} for i in range(n)]
+
+def _rollup_sums(store: michaeltore):
+    return tuple(store.cx.execute(f"SELECT SUM(n) FROM {t}").fetchone()[0]
+                 for t in ("detection_rollup_day", "detection_rollup_hour"))
+
+def test_rebuild_after_retention_keeps_rollup_history(tmp_path):
+    with michaeltore(str(tmp_path / "michael.db")) as store:
+        store.save_detections(_detections(600))
+        removed = store.apply_retention({"detections": 10}, now=NOW)
+        assert removed["detections"] == 359
+        assert store.cx.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 241
+        assert _rollup_sums(store) == (600, 600)
+        store.rebuild_rollups()
+        assert _rollup_sums(store) == (600, 600)
@@ -0,0 +1,27 @@
+"""
+Created by Michael Wilson, Senior Software Engineer
+"""
+
+import asyncio
+from michael_client import subs
+from michael_client.config import MichaelConfig
+from michael_client.subs import michaelubs
+
+def test_long_outage_keeps_backing_off(monkeypatch):
+    client = michaelubs(MichaelConfig(ws_url="ws://127.0.0.1:9/graphql"))
+    client.add_detections(lambda item: None)
+    delays = []
+
+    def refuse(*args, **kwargs):
+        raise OSError("connection refused")
+
+    async def sleep(delay):
+        delays.append(delay)
+        if len(delays) >= 3000:
+            client.close()
+
+    monkeypatch.setattr(subs.websockets, "connect", refuse)
+    monkeypatch.setattr(subs.asyncio, "sleep", sleep)
+    asyncio.run(client.run())
+    assert client.reconnects == 3000
+    assert all(0 <= d <= client.cfg.ws_reconnect_max_s for d in delays)